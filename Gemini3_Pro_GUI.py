@@ -203,6 +203,10 @@ class Gemini3ProGUI:
         self.seed = tk.IntVar(value=0)
         ttk.Spinbox(param_box, from_=0, to=2147483647, textvariable=self.seed, width=12).grid(row=2, column=1, sticky=tk.W, padx=5, pady=2)
         
+        # 流式接收：图片逐张到达即显示，降低内存峰值
+        self.stream_mode = tk.BooleanVar(value=True)
+        tk.Checkbutton(param_box, text="流式接收 (逐张显示)", variable=self.stream_mode).grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
         # 保存路径
         path_box = tk.LabelFrame(left, text="保存设置", font=("微软雅黑", 10, "bold"), padx=5, pady=5)
         path_box.pack(fill=tk.X, pady=3)
@@ -286,7 +290,13 @@ class Gemini3ProGUI:
         try:
             self.root.after(0, lambda: self.progress.config(value=10))
             
-            url = f"{self.api_url.get()}?key={key}"
+            stream = self.stream_mode.get()
+            api_url = self.api_url.get()
+            if stream and ":generateContent" in api_url:
+                url = f"{api_url.replace(':generateContent', ':streamGenerateContent')}?alt=sse&key={key}"
+            else:
+                stream = False
+                url = f"{api_url}?key={key}"
             
             parts = [{"text": prompt}]
             for z in self.drop_zones:
@@ -317,21 +327,26 @@ class Gemini3ProGUI:
             
             resp = requests.post(url, headers={"Content-Type": "application/json", 
                                                "Authorization": f"Bearer {key}"}, 
-                               json=payload, timeout=600)
+                               json=payload, timeout=600, stream=stream)
             self.root.after(0, lambda: self.progress.config(value=70))
             
             if resp.status_code != 200:
                 self.log(f"错误: {resp.status_code}")
                 return
                 
-            result = resp.json()
             images = []
-            
-            for cand in result.get("candidates", []):
-                for part in cand.get("content", {}).get("parts", []):
-                    if "inline_data" in part or "inlineData" in part:
-                        data = part.get("inline_data") or part.get("inlineData")
-                        images.append(Image.open(BytesIO(base64.b64decode(data["data"]))))
+            if stream:
+                # SSE：每个事件解析完立即解码图片并丢弃原始分片
+                for chunk in self._iter_sse(resp):
+                    before = len(images)
+                    self._collect_images(chunk, images)
+                    if len(images) > before:
+                        shown = list(images)
+                        self.root.after(0, lambda shown=shown: self.show_images(shown))
+                        self.log(f"已收到第 {len(images)} 张图片")
+                resp.close()
+            else:
+                self._collect_images(resp.json(), images)
                         
             self.root.after(0, lambda: self.progress.config(value=100))
             
@@ -345,6 +360,27 @@ class Gemini3ProGUI:
         except Exception as e:
             self.log(f"错误: {str(e)}")
             
+    def _iter_sse(self, resp):
+        """逐个产出 SSE 事件解析后的 JSON"""
+        data_lines = []
+        for line in resp.iter_lines(chunk_size=64 * 1024):
+            if not line:
+                if data_lines:
+                    yield json.loads(b"\n".join(data_lines))
+                    data_lines = []
+                continue
+            if line.startswith(b"data:"):
+                data_lines.append(line[5:].lstrip())
+        if data_lines:
+            yield json.loads(b"\n".join(data_lines))
+            
+    def _collect_images(self, result, images):
+        for cand in result.get("candidates", []):
+            for part in cand.get("content", {}).get("parts", []):
+                if "inline_data" in part or "inlineData" in part:
+                    data = part.get("inline_data") or part.get("inlineData")
+                    images.append(Image.open(BytesIO(base64.b64decode(data["data"]))))
+            
     def show_images(self, images):
         for w in self.result_inner.winfo_children():
             w.destroy()
@@ -4,11 +4,14 @@ from .py.houlai_switch import HouLai_8_Way_Image_Switch
 from .py.houlai_text_switch import HouLai_8_Way_Text_Switch
 from .py.recolor_node import HouLai_Recolor_Batch_V3
 from .py.houlai_data_gate import HouLai_Data_Gate
-from .py.houlai_super_api import HouLaiSuperCloudGen
+from .py.houlai_super_api import HouLaiSuperCloudGen, HouLaiSuperCloudGenBatch, HouLaiCloudTaskCollector
 from .py.houlai_llm_agent import Universal_LLM_Config, Ecommerce_Skill_Router
-from .py.nanobana_node import NanoBananaScheduler
-# 新增：Gemini 3 Pro 节点 (假设文件名为 houlai_gemini.py)
-from .py.houlai_gemini import HouLai_Gemini3_Pro_Generate
+from .py.nanobana_node import NanoBananaScheduler, NanoBananaCollector
+from .py.houlai_providers import HouLai_Provider_Pool
+# 新增：Gemini 3 Pro 节点
+from .py.HouLai_Gemini3_Pro import (HouLai_Gemini3_Pro_Generate, HouLai_Gemini3_Pro_Batch,
+                                    HouLai_Gemini3_Pro_Submit, HouLai_Gemini3_Pro_Stream_Submit,
+                                    HouLai_Gemini3_Pro_Collect)
 
 # 2. 统一注册节点类 (合并到一个字典中)
 NODE_CLASS_MAPPINGS = {
@@ -18,10 +21,18 @@ NODE_CLASS_MAPPINGS = {
     "HouLai_Recolor_Batch_V3": HouLai_Recolor_Batch_V3,
     "HouLai_Data_Gate": HouLai_Data_Gate,
     "HouLaiSuperCloudGen": HouLaiSuperCloudGen,
+    "HouLaiSuperCloudGenBatch": HouLaiSuperCloudGenBatch,
+    "HouLaiCloudTaskCollector": HouLaiCloudTaskCollector,
     "Universal_LLM_Config": Universal_LLM_Config,
     "Ecommerce_Skill_Router": Ecommerce_Skill_Router,
     "NanoBananaScheduler": NanoBananaScheduler,
+    "NanoBananaCollector": NanoBananaCollector,
+    "HouLai_Provider_Pool": HouLai_Provider_Pool,
     "HouLai_Gemini3_Pro": HouLai_Gemini3_Pro_Generate, # 新增注册
+    "HouLai_Gemini3_Pro_Batch": HouLai_Gemini3_Pro_Batch,
+    "HouLai_Gemini3_Pro_Submit": HouLai_Gemini3_Pro_Submit,
+    "HouLai_Gemini3_Pro_Stream_Submit": HouLai_Gemini3_Pro_Stream_Submit,
+    "HouLai_Gemini3_Pro_Collect": HouLai_Gemini3_Pro_Collect,
 }
 
 # 3. 统一注册显示名称 (ComfyUI 菜单中看到的中文名)
@@ -32,10 +43,18 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "HouLai_Recolor_Batch_V3": "🎨 后来_批量质感改色 V3 (Recolor)",
     "HouLai_Data_Gate": "🛑 后来_万能数据闸门 (Data Gate)",
     "HouLaiSuperCloudGen": "☁️ 后来_全能云端绘图 (Super Cloud Gen)",
+    "HouLaiSuperCloudGenBatch": "☁️ 后来_全能云端绘图批量版 (Super Cloud Gen Batch)",
+    "HouLaiCloudTaskCollector": "☁️ 后来_云端任务收集器 (Task Collector)",
     "Universal_LLM_Config": "🤖 后来_通用LLM配置 (LLM Config)",
     "Ecommerce_Skill_Router": "🛒 后来_电商技能路由 (Skill Router)",
     "NanoBananaScheduler": "🚀 后来_NanoBanana云端调度器 (NanoBanana)",
+    "NanoBananaCollector": "📬 后来_NanoBanana结果收集器 (Collector)",
+    "HouLai_Provider_Pool": "🔑 后来_API端点池 (Provider Pool)",
     "HouLai_Gemini3_Pro": "💎 后来_Gemini3 Pro生成 (Gemini Preview)", # 新增菜单名
+    "HouLai_Gemini3_Pro_Batch": "💎 后来_Gemini3 Pro批量并发 (Gemini Batch)",
+    "HouLai_Gemini3_Pro_Submit": "💎 后来_Gemini3 Pro异步提交 (Gemini Submit)",
+    "HouLai_Gemini3_Pro_Stream_Submit": "💎 后来_Gemini3 Pro边写边出图 (Gemini Stream Submit)",
+    "HouLai_Gemini3_Pro_Collect": "💎 后来_Gemini3 Pro结果收集 (Gemini Collect)",
 }
 
 # 4. 导出
@@ -1,29 +1,42 @@
-import requests
 import json
 import base64
 import torch
-import numpy as np
 from PIL import Image
 from io import BytesIO
 import comfy.utils
 import os
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import houlai_http, houlai_jobs
+from .houlai_metrics import PhaseTimer
+from .houlai_providers import ProviderError, retry_after_from
+from .houlai_ratelimit import get_limiter
+from .houlai_cache import DiskLRUCache, hash_key
+from .utils import encode_base64_cached, split_frames, decode_arrays, decode_async, uint8_to_tensor
+
+API_BASE = "https://aigc002.com/v1beta/models/gemini-3-pro-image-preview"
+
+# Gemini 3 Pro Image 单次请求最多接受的参考图数量
+MAX_REFERENCE_IMAGES = 14
+
+# 生成结果磁盘缓存 (默认 2GB，可通过 HOULAI_GEMINI_CACHE_MB 调整)
+RESULT_CACHE = DiskLRUCache("gemini_results", int(os.environ.get("HOULAI_GEMINI_CACHE_MB", "2048")) * 1024 * 1024)
+
+
+def model_name(api_base):
+    """接口地址中的模型名: .../models/<模型名>"""
+    return api_base.rstrip("/").rsplit("/", 1)[-1]
 
-# 尝试导入辅助函数，如果合并到工具箱中可能需要调整引用路径
-try:
-    from .utils import tensor2pil, pil2tensor, get_config, save_config
-except ImportError:
-    # 如果作为独立文件运行，提供基础实现
-    def tensor2pil(image):
-        return [Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))]
 
-    def pil2tensor(image):
-        return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+def is_deterministic(payload_dict):
+    """固定种子 (build_payload 只在 seed > 0 时写入) 的请求才可以复用缓存结果，随机种子每次都应出新图"""
+    return "seed" in payload_dict.get("generationConfig", {})
 
-    def get_config():
-        return {}
 
-    def save_config(config):
-        pass
+class GeminiAPIError(ProviderError):
+    """接口返回非 200 状态码 (连接端点池时，限流 / 服务端错误会自动切换端点)"""
+
 
 class HouLai_Gemini3_Pro_Generate:
     @classmethod
@@ -37,12 +50,19 @@ class HouLai_Gemini3_Pro_Generate:
             "optional": {
                 "image_input": ("IMAGE",), # 开放式图片输入端口，对应API中的 inline_data [cite: 2]
                 "apikey": ("STRING", {"default": "", "multiline": False}),
-                "seed": ("INT", {"default": 0, "min": 0, "max": 2147483647})
+                "seed": ("INT", {"default": 0, "min": 0, "max": 2147483647}),
+                "use_cache": ("BOOLEAN", {"default": True, "label_on": "开启:复用缓存结果", "label_off": "关闭:强制重新生成", "tooltip": "仅固定种子 (seed > 0) 时复用，随机种子每次都重新生成"}),
+                "stream": ("BOOLEAN", {"default": False, "label_on": "开启:流式接收", "label_off": "关闭:整包接收"}),
+                "max_input_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64, "tooltip": "上传前把参考图长边缩小到该值以内，0 = 不缩放"}),
+                "max_retries": ("INT", {"default": 2, "min": 0, "max": 10, "tooltip": "429/5xx 时按指数退避重试的次数 (遵守 Retry-After)"}),
+                "hedge_percentile": ("INT", {"default": 0, "min": 0, "max": 99, "tooltip": "耗时超过历史延迟该分位数时发送对冲请求，先返回者胜出，0 = 关闭"}),
+                # 连接后忽略 apikey，接口地址为 .../models/<模型名>
+                "provider_pool": ("PROVIDER_POOL",),
             }
         }
 
-    RETURN_TYPES = ("IMAGE", "STRING")
-    RETURN_NAMES = ("image", "response_log")
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
+    RETURN_NAMES = ("image", "response_log", "timing")
     FUNCTION = "generate_content"
     CATEGORY = "HouLai_ToolBox/Google" # 适配您的工具箱分类
 
@@ -56,45 +76,30 @@ class HouLai_Gemini3_Pro_Generate:
             "Authorization": f"Bearer {api_key}" 
         }
 
-    def image_to_base64(self, image_tensor):
-        """Convert tensor to base64 string for inline_data"""
+    def image_to_base64(self, image_tensor, max_side=0):
+        """Convert every frame of an IMAGE batch to base64 strings for inline_data"""
         if image_tensor is None:
-            return None
-        pil_image = tensor2pil(image_tensor)[0]
-        buffered = BytesIO()
-        pil_image.save(buffered, format="JPEG") # API文档示例使用 image/jpeg [cite: 2]
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-    def generate_content(self, prompt, aspect_ratio="9:16", image_size="1K", image_input=None, apikey="", seed=0):
-        # 1. API Key 处理逻辑 (沿用同步插件风格) [cite: 12]
-        current_api_key = apikey
-        if current_api_key.strip():
-            config = get_config()
-            config['api_key'] = current_api_key
-            save_config(config)
-        else:
-            current_api_key = get_config().get('api_key', '')
-        
-        if not current_api_key:
-            return (torch.zeros((1, 1024, 1024, 3)), "Error: API Key is missing.")
+            return []
+        # API文档示例使用 image/jpeg [cite: 2]
+        frames = split_frames(image_tensor, MAX_REFERENCE_IMAGES)
+        return encode_base64_cached(frames, "JPEG", quality=75, max_side=max_side)
 
-        # 2. 构建 Payload 
-        # URL 结构参考文档: key={{YOUR_API_KEY}} [cite: 1]
-        url = f"https://aigc002.com/v1beta/models/gemini-3-pro-image-preview:generateContent?key={current_api_key}"
-        
+    def resolve_api_key(self, apikey):
+        """API Key 处理逻辑 (只使用节点中填写的 Key，不写入磁盘) [cite: 12]"""
+        return apikey if apikey and apikey.strip() else ""
+
+    def build_payload(self, prompt, aspect_ratio, image_size, base64_imgs=(), seed=0):
         # 构建 parts 部分
         parts = [{"text": prompt}]
-        
-        # 处理图片输入 (开放式端口逻辑)
-        if image_input is not None:
-            base64_img = self.image_to_base64(image_input)
-            if base64_img:
-                parts.append({
-                    "inline_data": {
-                        "mime_type": "image/jpeg",
-                        "data": base64_img
-                    }
-                })
+
+        # 处理图片输入 (开放式端口逻辑，batch 中每一帧都作为一张参考图)
+        for base64_img in base64_imgs:
+            parts.append({
+                "inline_data": {
+                    "mime_type": "image/jpeg",
+                    "data": base64_img
+                }
+            })
 
         payload_dict = {
             "contents": [
@@ -111,70 +116,534 @@ class HouLai_Gemini3_Pro_Generate:
                 }
             }
         }
+        if seed > 0:
+            payload_dict["generationConfig"]["seed"] = seed
+        return payload_dict
+
+    def parse_parts(self, result, image_blobs, log_lines, on_image=None):
+        """
+        解析一个完整响应或一个流式分片，图像字节追加到 image_blobs，日志追加到 log_lines
+
+        Gemini 通常在 candidates -> content -> parts 中返回图像
+        """
+        for candidate in result.get("candidates", []):
+            for part in candidate.get("content", {}).get("parts", []):
+                # 处理 Base64 图像
+                if "inline_data" in part or "inlineData" in part:
+                    img_data_entry = part.get("inline_data") or part.get("inlineData")
+                    # 取出后立即释放 base64 文本
+                    blob = base64.b64decode(img_data_entry.pop("data"))
+                    image_blobs.append(blob)
+                    log_lines.append("Image decoded from Base64.")
+                    if on_image is not None:
+                        on_image(blob)
+                # 处理文本响应 (流式响应中文本被拆成多个分片，连续文本合并为一行)
+                if "text" in part:
+                    if log_lines and log_lines[-1].startswith("Text Response: "):
+                        log_lines[-1] += part["text"]
+                    else:
+                        log_lines.append(f"Text Response: {part['text']}")
+
+    def fetch_images(self, api_key, payload_dict, stream=False, on_image=None, policy=None, timer=None,
+                     provider=None):
+        """
+        发送一次 generateContent 请求
+
+        Args:
+            stream: 使用 streamGenerateContent (SSE)，每个图像分片到达即解码并释放缓冲
+            on_image: 每解码出一张图像时回调 (参数为图像字节)，用于提前预览
+            policy: houlai_http.RequestPolicy，重试与对冲策略
+            timer: houlai_metrics.PhaseTimer，记录序列化 / 上传 / 首字节 / 下载耗时
+            provider: houlai_providers.Provider，使用端点池中的地址和 Key (None = 默认地址)
+
+        Returns:
+            (image_bytes_list, log_info)
+
+        Raises:
+            GeminiAPIError: 接口返回非 200 或流中返回错误
+        """
+        timer = timer or PhaseTimer()
+        if stream:
+            return self.fetch_images_stream(api_key, payload_dict, on_image, policy, timer, provider)
+
+        api_base, api_key = self.endpoint(api_key, provider)
+        # URL 结构参考文档: key={{YOUR_API_KEY}} [cite: 1]
+        url = f"{api_base}:generateContent?key={api_key}"
+        headers = self.get_headers(api_key)
+        with timer.phase("serialize"):
+            body = json.dumps(payload_dict).encode("utf-8")
+        response = houlai_http.send("POST", url, policy, limiter=get_limiter(api_base, api_key),
+                                    headers=headers, timeout=self.timeout, **timer.instrument(body))
+        timer.response_done(response)
+        if provider is not None:
+            provider.observe_headers(response.headers)
+
+        if response.status_code != 200:
+            raise GeminiAPIError(f"API Error {response.status_code}: {response.text}",
+                                 response.status_code, retry_after_from(response))
+
+        with timer.phase("parse"):
+            result = response.json()
+            image_blobs, log_lines = [], [f"Status: {response.status_code}"]
+            self.parse_parts(result, image_blobs, log_lines, on_image)
+
+        if not image_blobs:
+            return (image_blobs, f"No image found in response. Raw: {str(result)}")
+        return (image_blobs, "\n".join(log_lines) + "\n")
+
+    def fetch_images_stream(self, api_key, payload_dict, on_image=None, policy=None, timer=None, provider=None):
+        """流式版本: 逐个 SSE 分片解析，避免 原始文本 + 完整 dict + 解码结果 同时驻留内存"""
+        timer = timer or PhaseTimer()
+        api_base, api_key = self.endpoint(api_key, provider)
+        url = f"{api_base}:streamGenerateContent?alt=sse&key={api_key}"
+        headers = self.get_headers(api_key)
+        with timer.phase("serialize"):
+            body = json.dumps(payload_dict).encode("utf-8")
+        response = houlai_http.send("POST", url, policy, limiter=get_limiter(api_base, api_key),
+                                    headers=headers, timeout=self.timeout, stream=True,
+                                    **timer.instrument(body))
+        try:
+            if provider is not None:
+                provider.observe_headers(response.headers)
+            if response.status_code != 200:
+                raise GeminiAPIError(f"API Error {response.status_code}: {response.text}",
+                                     response.status_code, retry_after_from(response))
+
+            image_blobs, log_lines = [], [f"Status: {response.status_code} (stream)"]
+            last_chunk = None
+            for data in houlai_http.iter_sse_events(response):
+                timer.incr("response_bytes", len(data))
+                chunk = json.loads(data)
+                del data
+                if "error" in chunk:
+                    error = chunk["error"]
+                    code = error.get("code") if isinstance(error, dict) else None
+                    raise GeminiAPIError(f"API Error: {error}", code if isinstance(code, int) else None)
+                self.parse_parts(chunk, image_blobs, log_lines, on_image)
+                # 分片解析完即丢弃 (其中的 base64 已转为图像字节)
+                last_chunk = {k: v for k, v in chunk.items() if k != "candidates"}
+                del chunk
+        finally:
+            response.close()
+            # 流式模式下 download 包含边接收边解析的时间
+            timer.response_done()
+
+        if not image_blobs:
+            return (image_blobs, f"No image found in stream response. Last chunk: {str(last_chunk)}")
+        return (image_blobs, "\n".join(log_lines) + "\n")
+
+    def make_policy(self, max_retries, hedge_percentile, provider_pool=None):
+        """多端点池时由池负责切换端点重试，单个端点内不再等待退避"""
+        if provider_pool is not None and len(provider_pool) > 1:
+            max_retries = 0
+        return houlai_http.RequestPolicy(max_retries=max_retries, hedge_percentile=hedge_percentile)
+
+    def endpoint(self, api_key, provider=None):
+        """(接口地址, API Key)，连接端点池时使用池中选中的端点"""
+        if provider is None:
+            return API_BASE, api_key
+        return provider.base_url, provider.api_key
+
+    def fetch_images_pooled(self, pool, payload_dict, stream=False, on_image=None, policy=None, timer=None,
+                            fetch=None):
+        """
+        通过端点池发送请求: 按延迟 / 错误率 / 剩余额度选择端点，失败自动切换
+
+        fetch: 自定义的单端点请求函数 fetch(provider)，默认直接调用 fetch_images
+        """
+        def attempt(provider):
+            try:
+                if fetch is not None:
+                    return fetch(provider)
+                return self.fetch_images(None, payload_dict, stream, on_image, policy, timer, provider)
+            except requests.RequestException as e:
+                raise GeminiAPIError(f"Network Error ({provider.name}): {e}") from e
+
+        return pool.call(attempt)
+
+    def read_cache(self, cache_key):
+        """读取缓存结果，返回 (image_bytes_list, log_info)，未命中返回 None"""
+        entry = RESULT_CACHE.get_entry(cache_key)
+        if entry is None:
+            return None
+        try:
+            meta = json.loads(entry["meta.json"])
+            image_blobs = [entry[f"{i}.img"] for i in range(meta["count"])]
+        except (KeyError, ValueError):
+            # 条目不完整 (如写入旧版本缓存时中断)，按未命中处理，重新生成后覆盖
+            return None
+        stats = RESULT_CACHE.stats()
+        return (image_blobs, meta["log"] + f"Cache: hit (hits={stats['hits']}, misses={stats['misses']})\n")
+
+    def write_cache(self, cache_key, image_blobs, log_info):
+        files = {f"{i}.img": blob for i, blob in enumerate(image_blobs)}
+        files["meta.json"] = json.dumps({"count": len(image_blobs), "log": log_info},
+                                        ensure_ascii=False).encode("utf-8")
+        RESULT_CACHE.put_entry(cache_key, files)
+
+    def request_images(self, api_key, payload_dict, use_cache=True, stream=False, on_image=None, policy=None,
+                       timer=None, provider_pool=None):
+        """
+        带结果缓存的生成请求: 相同 模型 + payload (含参考图字节、宽高比、尺寸、种子) 直接读磁盘
+
+        随机种子 (seed <= 0) 的请求不读写缓存，重新运行或批量中相同的提示词都会生成新图。
+
+        Returns:
+            (image_tensor, log_info)，没有图像时 image_tensor 为 None
+        """
+        timer = timer or PhaseTimer()
+        use_cache = use_cache and is_deterministic(payload_dict)
+        timer.set(cache="miss" if use_cache else "off")
+
+        # 流式接收时每张图一到就提交到解码线程池，与接收剩余分片并行
+        decoding = []
+
+        def on_blob(blob):
+            decoding.append(decode_async(blob))
+            if on_image is not None:
+                on_image(blob)
+
+        def lookup(api_base):
+            """缓存 key 取实际使用端点的模型名 (.../models/<模型名>)，同一模型经哪个端点生成都能命中"""
+            cache_key = hash_key(model_name(api_base), payload_dict)
+            return cache_key, (self.read_cache(cache_key) if use_cache else None)
+
+        def fetch(provider):
+            decoding.clear()  # 端点池切换端点时丢弃上一次尝试的结果
+            cache_key, cached = lookup(self.endpoint(api_key, provider)[0])
+            if cached is not None:
+                timer.set(cache="hit")
+                return cached
+            image_blobs, log_info = self.fetch_images(api_key, payload_dict, stream,
+                                                      on_blob if stream else on_image, policy, timer, provider)
+            if use_cache and image_blobs:
+                self.write_cache(cache_key, image_blobs, log_info)
+            return image_blobs, log_info
+
+        if provider_pool is None:
+            image_blobs, log_info = fetch(None)
+        else:
+            # 池中端点都是同一个模型时先查缓存，命中不经过端点池 (不影响端点的延迟统计)；
+            # 混合模型的池按选中端点的模型查缓存
+            models = {model_name(p.base_url) for p in provider_pool.providers}
+            cached = lookup(provider_pool.providers[0].base_url)[1] if len(models) == 1 else None
+            if cached is not None:
+                timer.set(cache="hit")
+                image_blobs, log_info = cached
+            else:
+                image_blobs, log_info = self.fetch_images_pooled(provider_pool, payload_dict, stream, on_image,
+                                                                 policy, timer, fetch=fetch)
+
+        if not image_blobs:
+            return (None, log_info)
+        timer.set(images=len(image_blobs))
+        with timer.phase("decode"):
+            if len(decoding) == len(image_blobs):
+                arrays = [future.result() for future in decoding]
+            else:
+                arrays = decode_arrays(image_blobs)
+            decoding.clear()
+        with timer.phase("to_tensor"):
+            image = uint8_to_tensor(arrays)
+        return (image, log_info)
+
+    def request_images_timed(self, timer, *args, **kwargs):
+        """request_images 并在结束时写入耗时日志 (批量 / 后台任务使用，结果不含 timing 输出)"""
+        try:
+            result = self.request_images(*args, timer=timer, **kwargs)
+        except Exception as e:
+            timer.finish("error", error=str(e))
+            raise
+        timer.finish("ok" if result[0] is not None else "no_image")
+        return result
+
+    def generate_content(self, prompt, aspect_ratio="9:16", image_size="1K", image_input=None, apikey="", seed=0,
+                         use_cache=True, stream=False, max_input_side=0, max_retries=2, hedge_percentile=0,
+                         provider_pool=None):
+        timer = PhaseTimer("HouLai_Gemini3_Pro_Generate", aspect_ratio=aspect_ratio, image_size=image_size,
+                           stream=stream)
+
+        # 1. API Key (连接端点池时由池提供)
+        current_api_key = self.resolve_api_key(apikey) if provider_pool is None else None
+        if provider_pool is None and not current_api_key:
+            return (torch.zeros((1, 1024, 1024, 3)), "Error: API Key is missing.", timer.finish("error"))
+
+        # 2. 构建 Payload 
+        with timer.phase("encode"):
+            base64_imgs = self.image_to_base64(image_input, max_input_side)
+        timer.set(reference_images=len(base64_imgs))
+        payload_dict = self.build_payload(prompt, aspect_ratio, image_size, base64_imgs, seed)
 
         # 3. 发送请求
         try:
             pbar = comfy.utils.ProgressBar(100)
             pbar.update_absolute(30)
-            
-            headers = self.get_headers(current_api_key)
-            response = requests.post(url, headers=headers, json=payload_dict, timeout=self.timeout)
-            
-            pbar.update_absolute(70)
 
-            if response.status_code != 200:
-                error_msg = f"API Error {response.status_code}: {response.text}"
-                print(error_msg)
-                return (torch.zeros((1, 1024, 1024, 3)), error_msg)
+            # 流式模式下每张图解码后立即推送预览
+            def on_image(blob):
+                pbar.update_absolute(70, 100, ("JPEG", Image.open(BytesIO(blob)), 512))
 
-            result = response.json()
-            
-            # 4. 解析响应
-            # Gemini 通常在 candidates -> content -> parts 中返回图像
-            # 这里的解析逻辑针对标准 Gemini 格式进行了适配
-            generated_tensors = []
-            log_info = f"Status: {response.status_code}\n"
-            
-            if "candidates" in result:
-                for candidate in result["candidates"]:
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        for part in candidate["content"]["parts"]:
-                            # 处理 Base64 图像
-                            if "inline_data" in part or "inlineData" in part:
-                                img_data_entry = part.get("inline_data") or part.get("inlineData")
-                                img_bytes = base64.b64decode(img_data_entry["data"])
-                                img = Image.open(BytesIO(img_bytes))
-                                generated_tensors.append(pil2tensor(img))
-                                log_info += "Image decoded from Base64.\n"
-                            # 处理文本响应
-                            if "text" in part:
-                                log_info += f"Text Response: {part['text']}\n"
-            
-            # 备用解析：如果 API 返回结构不同（参考文档中只print了text，未展示具体返回结构，这里做兼容处理）
-            if not generated_tensors and "data" in result:
-                 # 尝试处理类似 Nano Banana 的返回结构 [cite: 32]
-                 pass 
+            policy = self.make_policy(max_retries, hedge_percentile, provider_pool)
+            image, log_info = self.request_images(current_api_key, payload_dict, use_cache, stream,
+                                                  on_image if stream else None, policy, timer, provider_pool)
 
             pbar.update_absolute(100)
 
-            if generated_tensors:
-                final_image = torch.cat(generated_tensors, dim=0)
-                return (final_image, log_info)
+            if image is not None:
+                return (image, log_info, timer.finish())
             else:
-                return (torch.zeros((1, 1024, 1024, 3)), f"No image found in response. Raw: {str(result)}")
+                return (torch.zeros((1, 1024, 1024, 3)), log_info, timer.finish("no_image"))
 
+        except ProviderError as e:
+            # 含 GeminiAPIError 和端点池的 NoProviderAvailable (所有端点都在冷却中)
+            print(str(e))
+            return (torch.zeros((1, 1024, 1024, 3)), str(e), timer.finish("error", error=str(e)))
         except Exception as e:
             error_msg = f"Exception: {str(e)}"
             print(error_msg)
             import traceback
             traceback.print_exc()
-            return (torch.zeros((1, 1024, 1024, 3)), error_msg)
+            return (torch.zeros((1, 1024, 1024, 3)), error_msg, timer.finish("error", error=error_msg))
+
+
+class HouLai_Gemini3_Pro_Batch(HouLai_Gemini3_Pro_Generate):
+    """
+    批量并发模式: 接收提示词列表 (如 Ecommerce_Skill_Router / HouLaiRandomPrompts 的列表输出)，
+    以有限并发同时发送，结果按原始顺序返回，单条失败只占用对应的错误槽位。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "prompts": ("STRING", {"forceInput": True}),
+                "aspect_ratio": (["9:16", "16:9", "1:1", "4:3", "3:4"], {"default": "9:16"}),
+                "image_size": (["1K"], {"default": "1K"}),
+                "max_concurrency": ("INT", {"default": 4, "min": 1, "max": 32}),
+            },
+            "optional": {
+                "image_input": ("IMAGE",),
+                "apikey": ("STRING", {"default": "", "multiline": False}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 2147483647}),
+                "use_cache": ("BOOLEAN", {"default": True, "label_on": "开启:复用缓存结果", "label_off": "关闭:强制重新生成", "tooltip": "仅固定种子 (seed > 0) 时复用，随机种子每次都重新生成"}),
+                "stream": ("BOOLEAN", {"default": False, "label_on": "开启:流式接收", "label_off": "关闭:整包接收"}),
+                "max_input_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64, "tooltip": "上传前把参考图长边缩小到该值以内，0 = 不缩放"}),
+                "max_retries": ("INT", {"default": 2, "min": 0, "max": 10, "tooltip": "429/5xx 时按指数退避重试的次数 (遵守 Retry-After)"}),
+                "hedge_percentile": ("INT", {"default": 0, "min": 0, "max": 99, "tooltip": "耗时超过历史延迟该分位数时发送对冲请求，先返回者胜出，0 = 关闭"}),
+                # 可选: 逐条指定宽高比 (列表长度需与 prompts 一致，否则使用上面的统一值)
+                "aspect_ratios": ("STRING", {"forceInput": True}),
+                # 多个 Key / 中转地址分摊并发，吞吐量随 Key 数量增加
+                "provider_pool": ("PROVIDER_POOL",),
+            }
+        }
+
+    # 所有输入均以列表形式接收，由本节点自行并发调度
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
+    RETURN_NAMES = ("images", "response_logs", "errors")
+    OUTPUT_IS_LIST = (True, True, True)
+    FUNCTION = "generate_batch"
+
+    def generate_batch(self, prompts, aspect_ratio, image_size, max_concurrency,
+                       image_input=None, apikey=None, seed=None, use_cache=None, stream=None,
+                       max_input_side=None, max_retries=None, hedge_percentile=None, aspect_ratios=None,
+                       provider_pool=None):
+        aspect_ratio, image_size = aspect_ratio[0], image_size[0]
+        max_concurrency = max_concurrency[0]
+        use_cache = use_cache[0] if use_cache else True
+        stream = stream[0] if stream else False
+        max_input_side = max_input_side[0] if max_input_side else 0
+        provider_pool = provider_pool[0] if provider_pool else None
+        policy = self.make_policy(max_retries[0] if max_retries else 2,
+                                  hedge_percentile[0] if hedge_percentile else 0, provider_pool)
+        # 每个输入占一个槽位 (空提示词也保留，输出与输入逐条对应)
+        prompt_list = list(prompts) or [""]
+        count = len(prompt_list)
+
+        # 逐条参数: 列表长度匹配时逐条使用，否则单个种子按序号递增
+        seeds = seed or [0]
+        if len(seeds) == count:
+            item_seeds = list(seeds)
+        else:
+            item_seeds = [seeds[0] + idx if seeds[0] > 0 else 0 for idx in range(count)]
+        if aspect_ratios and len(aspect_ratios) == count:
+            item_ratios = list(aspect_ratios)
+        else:
+            item_ratios = [aspect_ratio] * count
+
+        blank = torch.zeros((1, 1024, 1024, 3))
+        current_api_key = self.resolve_api_key(apikey[0] if apikey else "") if provider_pool is None else None
+        if provider_pool is None and not current_api_key:
+            msg = "Error: API Key is missing."
+            return ([blank] * count, [msg] * count, [msg] * count)
+
+        # 参考图只编码一次，所有条目共享
+        base64_imgs = []
+        if image_input is not None and image_input[0] is not None:
+            base64_imgs = self.image_to_base64(image_input[0], max_input_side)
+
+        images, logs, errors = [blank] * count, [""] * count, [""] * count
+        # 空提示词不发送请求，对应槽位直接记为失败
+        pending = []
+        for idx, prompt in enumerate(prompt_list):
+            if prompt and prompt.strip():
+                pending.append(idx)
+            else:
+                errors[idx] = logs[idx] = "Error: Prompt is empty."
+
+        def run_item(idx):
+            payload_dict = self.build_payload(prompt_list[idx], item_ratios[idx], image_size,
+                                              base64_imgs, item_seeds[idx])
+            timer = PhaseTimer("HouLai_Gemini3_Pro_Batch", index=idx, aspect_ratio=item_ratios[idx],
+                               image_size=image_size, stream=stream)
+            return self.request_images_timed(timer, current_api_key, payload_dict, use_cache, stream, policy=policy,
+                                             provider_pool=provider_pool)
+
+        print(f"💎 [Gemini Batch] 并发发送 {len(pending)} 个任务 (并发上限 {max_concurrency}，"
+              f"空提示词 {count - len(pending)} 条)")
+        pbar = comfy.utils.ProgressBar(count)
+        pbar.update(count - len(pending))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as executor:
+            futures = {executor.submit(run_item, idx): idx for idx in pending}
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    image, log_info = future.result()
+                    logs[idx] = log_info
+                    if image is not None:
+                        images[idx] = image
+                    else:
+                        errors[idx] = "No image found in response."
+                except ProviderError as e:
+                    errors[idx] = logs[idx] = str(e)
+                    print(f"❌ [Gemini Batch] 第 {idx + 1} 条失败: {e}")
+                except Exception as e:
+                    errors[idx] = logs[idx] = f"Exception: {str(e)}"
+                    print(f"❌ [Gemini Batch] 第 {idx + 1} 条失败: {e}")
+                pbar.update(1)
+
+        failed = sum(1 for e in errors if e)
+        print(f"✅ [Gemini Batch] 完成 {count - failed}/{count}")
+        return (images, logs, errors)
+
+
+class HouLai_Gemini3_Pro_Submit(HouLai_Gemini3_Pro_Generate):
+    """
+    异步提交: 参考图编码在当前线程完成，网络请求交给后台任务池，立即返回任务句柄。
+    配合 HouLai_Gemini3_Pro_Collect 使用，期间执行器可以继续运行其它节点。
+    """
+
+    RETURN_TYPES = ("HOULAI_JOB",)
+    RETURN_NAMES = ("job",)
+    FUNCTION = "submit"
+
+    def submit(self, prompt, aspect_ratio="9:16", image_size="1K", image_input=None, apikey="", seed=0,
+               use_cache=True, stream=False, max_input_side=0, max_retries=2, hedge_percentile=0,
+               provider_pool=None):
+        current_api_key = self.resolve_api_key(apikey) if provider_pool is None else None
+        if provider_pool is None and not current_api_key:
+            # 错误同样通过句柄返回，由收集节点输出黑图和错误信息
+            return (houlai_jobs.submit(lambda: (None, "Error: API Key is missing."), prefix="gemini"),)
+
+        timer = PhaseTimer("HouLai_Gemini3_Pro_Submit", aspect_ratio=aspect_ratio, image_size=image_size,
+                           stream=stream)
+        with timer.phase("encode"):
+            base64_imgs = self.image_to_base64(image_input, max_input_side)
+        payload_dict = self.build_payload(prompt, aspect_ratio, image_size, base64_imgs, seed)
+        policy = self.make_policy(max_retries, hedge_percentile, provider_pool)
+        return (self.submit_payload(timer, current_api_key, payload_dict, use_cache, stream, policy, provider_pool),)
+
+    def submit_payload(self, timer, api_key, payload_dict, use_cache, stream, policy, provider_pool):
+        """把已构建好的请求交给后台任务池，返回任务句柄"""
+        job_id = houlai_jobs.submit(self.request_images_timed, timer, api_key, payload_dict, use_cache,
+                                    stream, policy=policy, provider_pool=provider_pool, prefix="gemini")
+        print(f"💎 [Gemini Submit] 已提交后台任务: {job_id} (运行中 {houlai_jobs.pending_count()})")
+        return job_id
+
+
+class HouLai_Gemini3_Pro_Stream_Submit(HouLai_Gemini3_Pro_Submit):
+    """
+    边写边出图: 输出 GEMINI_SUBMIT_CONFIG，连接到 🛒 电商技能路由 的 生图提交 输入。
+    路由节点每产出一行提示词就立即按这里的参数提交一个后台任务 (与 Submit 节点相同)，
+    不用等模型写完全部提示词；路由节点的 jobs 输出接 HouLai_Gemini3_Pro_Collect 收集结果。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        inputs["required"] = {k: v for k, v in inputs["required"].items() if k != "prompt"}
+        return inputs
+
+    RETURN_TYPES = ("GEMINI_SUBMIT_CONFIG",)
+    RETURN_NAMES = ("submit_config",)
+    FUNCTION = "make_config"
+
+    def make_config(self, aspect_ratio="9:16", image_size="1K", image_input=None, apikey="", seed=0,
+                    use_cache=True, stream=False, max_input_side=0, max_retries=2, hedge_percentile=0,
+                    provider_pool=None):
+        current_api_key = self.resolve_api_key(apikey) if provider_pool is None else None
+        # 参考图只编码一次，所有提示词共享
+        base64_imgs = self.image_to_base64(image_input, max_input_side)
+        policy = self.make_policy(max_retries, hedge_percentile, provider_pool)
+
+        def submit_line(index, prompt):
+            """提交第 index 条提示词，返回任务句柄 (种子 > 0 时按序号递增，与 Batch 节点一致)"""
+            if provider_pool is None and not current_api_key:
+                return houlai_jobs.submit(lambda: (None, "Error: API Key is missing."), prefix="gemini")
+            item_seed = seed + index if seed > 0 else 0
+            timer = PhaseTimer("HouLai_Gemini3_Pro_Stream_Submit", index=index, aspect_ratio=aspect_ratio,
+                               image_size=image_size, stream=stream)
+            payload_dict = self.build_payload(prompt, aspect_ratio, image_size, base64_imgs, item_seed)
+            return self.submit_payload(timer, current_api_key, payload_dict, use_cache, stream, policy,
+                                       provider_pool)
+
+        return ({"submit": submit_line, "reference_images": len(base64_imgs)},)
+
+
+class HouLai_Gemini3_Pro_Collect:
+    """等待一个或多个任务句柄，按句柄顺序返回图像与日志"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "job": ("HOULAI_JOB",),
+                "timeout_seconds": ("INT", {"default": 600, "min": 10, "max": 3600, "step": 10}),
+            }
+        }
+
+    # 上游提交节点被列表驱动时会产生多个句柄，这里一次性全部收集
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("images", "response_logs")
+    OUTPUT_IS_LIST = (True, True)
+    FUNCTION = "collect"
+    CATEGORY = "HouLai_ToolBox/Google"
+
+    def collect(self, job, timeout_seconds):
+        timeout_seconds = timeout_seconds[0]
+        print(f"💎 [Gemini Collect] 等待 {len(job)} 个任务...")
+        images, logs = [], []
+        for ok, result in houlai_jobs.wait_jobs(job, timeout=timeout_seconds):
+            image, log_info = result if ok else (None, result)
+            images.append(image if image is not None else torch.zeros((1, 1024, 1024, 3)))
+            logs.append(log_info)
+        return (images, logs)
+
 
 # 节点映射
 NODE_CLASS_MAPPINGS = {
-    "HouLai_Gemini3_Pro": HouLai_Gemini3_Pro_Generate
+    "HouLai_Gemini3_Pro": HouLai_Gemini3_Pro_Generate,
+    "HouLai_Gemini3_Pro_Batch": HouLai_Gemini3_Pro_Batch,
+    "HouLai_Gemini3_Pro_Submit": HouLai_Gemini3_Pro_Submit,
+    "HouLai_Gemini3_Pro_Stream_Submit": HouLai_Gemini3_Pro_Stream_Submit,
+    "HouLai_Gemini3_Pro_Collect": HouLai_Gemini3_Pro_Collect,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "HouLai_Gemini3_Pro": "HouLai Gemini 3 Pro (Preview)"
+    "HouLai_Gemini3_Pro": "HouLai Gemini 3 Pro (Preview)",
+    "HouLai_Gemini3_Pro_Batch": "HouLai Gemini 3 Pro Batch (Preview)",
+    "HouLai_Gemini3_Pro_Submit": "HouLai Gemini 3 Pro Submit (Async)",
+    "HouLai_Gemini3_Pro_Stream_Submit": "HouLai Gemini 3 Pro Stream Submit (Async)",
+    "HouLai_Gemini3_Pro_Collect": "HouLai Gemini 3 Pro Collect (Async)",
 }
\ No newline at end of file
@@ -0,0 +1,16 @@
+"""
+后来工具箱 - 节点实现
+
+本目录与 pytest 依赖的 pylib (py.path / py.error) 同名: 在插件根目录运行 python -m pytest 时
+当前目录排在 sys.path 最前，import py 会拿到这里，所以按需转发这两个属性到 pytest 自带的实现。
+"""
+
+
+def __getattr__(name):
+    if name not in ("path", "error"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import sys
+    import importlib
+    module = importlib.import_module(f"_pytest._py.{name}")
+    sys.modules[f"{__name__}.{name}"] = module
+    return module
@@ -0,0 +1,248 @@
+"""
+后来工具箱 - 本地缓存
+
+DiskLRUCache: 内容寻址 (sha256) 的磁盘 LRU 缓存
+- 每个条目是一个目录，可包含多个文件 (如多张图片 + meta.json)
+- 总大小超过上限时按最近访问时间淘汰
+- 统计命中 / 未命中 / 淘汰次数
+
+MemoryLRU: 按字节数限制容量的内存 LRU
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+# 插件根目录 (py目录的父目录)
+PLUGIN_ROOT = Path(__file__).parent.parent.absolute()
+
+# 缓存根目录，可通过环境变量修改
+CACHE_ROOT = Path(os.environ.get("HOULAI_CACHE_DIR", str(PLUGIN_ROOT / "cache")))
+
+# 超过该时间的临时写入目录视为崩溃残留 (较新的可能是其它进程正在写入)
+STALE_TMP_SECONDS = 600
+
+
+def hash_key(*parts):
+    """把任意可 JSON 序列化 / bytes 的片段组合成稳定的 sha256 key"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        else:
+            h.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class DiskLRUCache:
+    """
+    大小受限的磁盘 LRU 缓存 (线程安全)
+
+    Args:
+        namespace: 子目录名，不同用途的缓存互不影响
+        max_bytes: 缓存总大小上限
+    """
+
+    def __init__(self, namespace, max_bytes):
+        self.root = CACHE_ROOT / namespace
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> 条目字节数，按访问时间从旧到新
+        self._total = 0
+        self._load_index()
+
+    # ----------------------------------------
+    # 内部工具
+    # ----------------------------------------
+    def _entry_dir(self, key):
+        return self.root / key[:2] / key
+
+    def _load_index(self):
+        """启动时扫描已有条目，按目录修改时间恢复 LRU 顺序，并清理写入中途崩溃留下的临时目录"""
+        if not self.root.exists():
+            return
+        now = time.time()
+        for tmp in self.root.glob(".tmp-*"):
+            try:
+                if now - tmp.stat().st_mtime > STALE_TMP_SECONDS:
+                    shutil.rmtree(tmp, ignore_errors=True)
+            except OSError:
+                continue
+        entries = []
+        for entry in self.root.glob("*/*"):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, entry.name, size))
+            except OSError:
+                continue
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total += size
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    # ----------------------------------------
+    # 对外接口
+    # ----------------------------------------
+    def get_entry(self, key):
+        """
+        读取条目
+
+        Returns:
+            Optional[Dict[str, bytes]]: 文件名 -> 内容，未命中 (或条目不完整) 返回 None
+        """
+        with self._lock:
+            expected = self._index.get(key)
+            if expected is None:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        entry = self._entry_dir(key)
+        try:
+            files = {f.name: f.read_bytes() for f in entry.iterdir()}
+            os.utime(entry)  # 刷新访问时间，重启后仍保持 LRU 顺序
+            # 读取期间被其它线程 / 进程淘汰时可能只读到一部分文件
+            complete = sum(len(data) for data in files.values()) == expected
+        except OSError:
+            complete = False
+        if not complete:
+            with self._lock:
+                if self._index.get(key) == expected:
+                    self._total -= self._index.pop(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return files
+
+    def put_entry(self, key, files):
+        """
+        写入条目 (先写临时目录再原子重命名，避免读到半个条目)
+
+        Args:
+            key: 条目 key (建议使用 hash_key 生成)
+            files: 文件名 -> bytes
+        """
+        size = sum(len(data) for data in files.values())
+        if size > self.max_bytes:
+            return
+        entry = self._entry_dir(key)
+        tmp = self.root / f".tmp-{uuid.uuid4().hex}"
+        try:
+            tmp.mkdir(parents=True)
+            for name, data in files.items():
+                (tmp / name).write_bytes(data)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            if entry.exists():
+                shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except OSError as e:
+            print(f"[HouLai Cache] 写入缓存失败: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        with self._lock:
+            self._total -= self._index.pop(key, 0)
+            self._index[key] = size
+            self._total += size
+            self._evict()
+
+    def get(self, key):
+        """单文件条目的便捷读取"""
+        entry = self.get_entry(key)
+        return entry.get("data") if entry else None
+
+    def put(self, key, data):
+        """单文件条目的便捷写入"""
+        self.put_entry(key, {"data": data})
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self._index.clear()
+            self._total = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class MemoryLRU:
+    """
+    按字节数限制容量的内存 LRU (线程安全)
+
+    Args:
+        max_bytes: 容量上限
+        sizeof: 计算单个值占用字节数的函数
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = int(max_bytes)
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (value, size)
+        self._total = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._total -= old[1]
+            self._items[key] = (value, size)
+            self._total += size
+            while self._total > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._total -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._total = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
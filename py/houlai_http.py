@@ -0,0 +1,467 @@
+"""
+后来工具箱 - 共享 HTTP 传输层
+
+所有云端节点 (Gemini / SuperCloudGen / NanoBanana / 图片下载) 统一通过本模块发请求:
+- 每个 host 一个长连接 Session，复用 DNS / TCP / TLS 握手
+- 连接池大小、单 host 最大并发连接数可配置 (环境变量或 configure())
+- 可选 HTTP/2 (需要安装 httpx[http2]，未安装时自动回退到 requests)
+- 可选请求策略: 429/5xx 指数退避重试 (遵守 Retry-After)、按历史延迟分位数发送对冲请求
+- 可选共享限流器 (houlai_ratelimit)，每次实际发出的请求 (含重试和对冲) 都要先拿到令牌
+"""
+
+import os
+import time
+import atexit
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import httpx
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTP2_AVAILABLE = False
+
+# ============================================
+# 全局配置 (可通过环境变量覆盖)
+# ============================================
+POOL_CONNECTIONS = int(os.environ.get("HOULAI_HTTP_POOL_CONNECTIONS", "4"))   # 每个 Session 缓存的连接池数量
+POOL_MAXSIZE = int(os.environ.get("HOULAI_HTTP_POOL_MAXSIZE", "16"))          # 每个 host 保持的长连接数
+MAX_PER_HOST = int(os.environ.get("HOULAI_HTTP_MAX_PER_HOST", "0"))           # 单 host 连接上限，0 = 不限制
+ENABLE_HTTP2 = os.environ.get("HOULAI_HTTP2", "0").lower() in ("1", "true", "yes")
+
+_lock = threading.Lock()
+_sessions = {}   # (scheme, netloc) -> requests.Session
+_h2_clients = {}  # (scheme, netloc, verify) -> httpx.Client
+
+
+def configure(pool_connections=None, pool_maxsize=None, max_per_host=None, http2=None):
+    """
+    修改传输层配置。已创建的连接会被关闭，下次请求时按新配置重建。
+
+    Args:
+        pool_connections: 每个 Session 缓存的连接池数量
+        pool_maxsize: 每个 host 保持的长连接数
+        max_per_host: 单 host 最大并发连接数，超出时排队等待 (0 = 不限制)
+        http2: 是否启用 HTTP/2 (需要 httpx[http2])
+    """
+    global POOL_CONNECTIONS, POOL_MAXSIZE, MAX_PER_HOST, ENABLE_HTTP2
+    if pool_connections is not None:
+        POOL_CONNECTIONS = int(pool_connections)
+    if pool_maxsize is not None:
+        POOL_MAXSIZE = int(pool_maxsize)
+    if max_per_host is not None:
+        MAX_PER_HOST = int(max_per_host)
+    if http2 is not None:
+        ENABLE_HTTP2 = bool(http2)
+    close_all()
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return (parts.scheme.lower(), parts.netloc.lower())
+
+
+def _build_session():
+    session = requests.Session()
+    # 只对"连接失败"和幂等请求(GET 轮询/下载)的读错误自动重试一次，
+    # POST 的读错误不重试，避免重复提交付费任务
+    retry = Retry(total=2, connect=2, read=2, status=0, backoff_factor=0.2,
+                  allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, raise_on_status=False)
+    # 设置了单 host 上限时，连接池即上限，池满后阻塞等待 (pool_block)
+    maxsize = MAX_PER_HOST if MAX_PER_HOST > 0 else POOL_MAXSIZE
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=maxsize,
+                          pool_block=MAX_PER_HOST > 0, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url):
+    """返回 url 所属 host 的共享 Session (线程安全，进程内复用)"""
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _build_session()
+                _sessions[key] = session
+    return session
+
+
+# ============================================
+# HTTP/2 (httpx) 支持
+# ============================================
+class _Http2Response:
+    """把 httpx.Response 包装成调用方熟悉的 requests 风格接口"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.elapsed = response.elapsed
+
+    @property
+    def content(self):
+        return self._response.content
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def json(self, **kwargs):
+        return self._response.json(**kwargs)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def iter_content(self, chunk_size=None):
+        yield self.content
+
+    def close(self):
+        self._response.close()
+
+
+def _get_h2_client(url, verify):
+    key = _host_key(url) + (bool(verify),)
+    client = _h2_clients.get(key)
+    if client is None:
+        with _lock:
+            client = _h2_clients.get(key)
+            if client is None:
+                maxsize = MAX_PER_HOST if MAX_PER_HOST > 0 else POOL_MAXSIZE
+                limits = httpx.Limits(max_connections=MAX_PER_HOST or None,
+                                      max_keepalive_connections=maxsize)
+                client = httpx.Client(http2=True, verify=verify, limits=limits)
+                _h2_clients[key] = client
+    return client
+
+
+def _request_h2(method, url, **kwargs):
+    verify = kwargs.pop("verify", True)
+    kwargs.pop("proxies", None)  # httpx 的代理是客户端级配置，这里沿用环境变量
+    timeout = kwargs.pop("timeout", None)
+    hooks = kwargs.pop("hooks", None) or {}
+    if hasattr(kwargs.get("data"), "read"):
+        kwargs["data"] = kwargs["data"].read()
+    if isinstance(kwargs.get("data"), (bytes, str)):
+        kwargs["content"] = kwargs.pop("data")
+    response = _Http2Response(_get_h2_client(url, verify).request(method, url, timeout=timeout, **kwargs))
+    # httpx 没有 requests 的响应钩子，读完响应后补发一次
+    hook = hooks.get("response")
+    if hook is not None:
+        hook(response)
+    return response
+
+
+# ============================================
+# 对外接口
+# ============================================
+def request(method, url, **kwargs):
+    """
+    通过共享连接池发送请求，参数与 requests.request 一致
+
+    Returns:
+        requests.Response (启用 HTTP/2 时为兼容接口的包装对象)
+    """
+    if hasattr(kwargs.get("data"), "fork"):
+        # 计时请求体 (houlai_metrics.TimedBody) 每次发送都从头读取
+        kwargs["data"] = kwargs["data"].fork()
+    if ENABLE_HTTP2 and HTTP2_AVAILABLE and not kwargs.get("stream"):
+        return _request_h2(method, url, **kwargs)
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+# ============================================
+# 延迟统计 / 重试 / 对冲请求
+# ============================================
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="houlai_hedge")
+
+
+def endpoint_key(url):
+    """按 scheme + host + path 区分端点 (不含查询参数，避免把 API Key 带进统计)"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}".lower()
+
+
+class LatencyTracker:
+    """按端点记录最近的成功请求耗时，用于计算对冲阈值"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, endpoint, pct, min_samples=10):
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        idx = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[idx]
+
+
+LATENCY = LatencyTracker()
+
+
+class RequestPolicy:
+    """
+    请求策略
+
+    Args:
+        max_retries: 429/5xx 或连接失败时的最大重试次数
+        hedge_percentile: 请求耗时超过该端点历史延迟的此分位数时，发送一个重复请求，先成功者胜出 (0 = 关闭)
+        min_samples: 启用对冲所需的最少历史样本数
+        backoff_base / backoff_max: 指数退避的基数与上限 (秒)，带全抖动
+        idempotent: 请求可安全重放 (如带幂等键的 POST)，读超时 / 连接中断后也重试
+    """
+
+    def __init__(self, max_retries=2, hedge_percentile=0, min_samples=10,
+                 backoff_base=1.0, backoff_max=60.0, retry_statuses=RETRY_STATUSES, idempotent=False):
+        self.max_retries = max_retries
+        self.idempotent = idempotent
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = retry_statuses
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """解析 Retry-After (秒数或 HTTP 日期)，无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _limited_request(method, url, limiter=None, **kwargs):
+    if limiter is None:
+        return request(method, url, **kwargs)
+    with limiter.slot():
+        response = request(method, url, **kwargs)
+    limiter.observe(response)
+    return response
+
+
+def _timed_request(method, url, **kwargs):
+    start = time.monotonic()
+    response = _limited_request(method, url, **kwargs)
+    if response.status_code < 400:
+        LATENCY.record(endpoint_key(url), time.monotonic() - start)
+    return response
+
+
+def _discard(future):
+    """对冲失败方完成后直接释放连接"""
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+
+def _hedged_request(method, url, policy, **kwargs):
+    delay = None
+    if policy.hedge_percentile:
+        delay = LATENCY.percentile(endpoint_key(url), policy.hedge_percentile, policy.min_samples)
+    if delay is None:
+        return _timed_request(method, url, **kwargs)
+
+    futures = [_hedge_pool.submit(_timed_request, method, url, **kwargs)]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        print(f"[HouLai HTTP] 请求超过 P{policy.hedge_percentile} 延迟 ({delay:.1f}s)，发送对冲请求")
+        futures.append(_hedge_pool.submit(_timed_request, method, url, **kwargs))
+
+    # 先成功者胜出；全部失败时返回最后一个响应或抛出最后一个异常
+    pending, fallback, last_error = set(futures), None, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if response.status_code < 400:
+                for other in pending:
+                    other.cancel()
+                    other.add_done_callback(_discard)
+                if fallback is not None:
+                    fallback.close()
+                return response
+            if fallback is not None:
+                fallback.close()
+            fallback = response
+    if fallback is not None:
+        return fallback
+    raise last_error
+
+
+def request_not_sent(error):
+    """
+    请求是否确定没有发到服务端 (连接阶段就失败了)
+
+    只有这种情况重发非幂等请求 (提交付费任务) 是安全的；读超时、连接被重置等情况下
+    服务端可能已经受理了请求。
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        # DNS 解析失败 / 连接被拒绝: urllib3 的 NewConnectionError (包在 MaxRetryError.reason 中)
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+    if httpx is not None:
+        return isinstance(error, (httpx.ConnectTimeout, httpx.ConnectError))
+    return False
+
+
+def send(method, url, policy=None, limiter=None, **kwargs):
+    """
+    按 RequestPolicy 发送请求: 429/5xx 指数退避重试 (遵守 Retry-After)，可选对冲请求
+
+    policy 为 None 时等同于 request()。
+    limiter: houlai_ratelimit.RateLimiter，发送前排队取令牌，并用响应调整速率
+    """
+    if limiter is not None:
+        kwargs["limiter"] = limiter
+    if policy is None:
+        return _limited_request(method, url, **kwargs)
+    attempt = 0
+    while True:
+        try:
+            response = _hedged_request(method, url, policy, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # 非幂等请求只在"连接都没建立"时重试，避免重复提交付费任务
+            idempotent = policy.idempotent or method.upper() in ("GET", "HEAD")
+            if attempt >= policy.max_retries or not (idempotent or request_not_sent(e)):
+                raise
+            delay = policy.backoff(attempt)
+            reason = type(e).__name__
+        else:
+            if response.status_code not in policy.retry_statuses or attempt >= policy.max_retries:
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            delay = retry_after if retry_after is not None else policy.backoff(attempt)
+            reason = f"HTTP {response.status_code}"
+            response.close()
+        attempt += 1
+        print(f"[HouLai HTTP] {reason}，{delay:.1f}s 后第 {attempt} 次重试")
+        time.sleep(delay)
+
+
+def download(url, chunk_size=256 * 1024, max_resumes=3, timeout=60, with_headers=False, **kwargs):
+    """
+    流式分块下载到内存，连接中断时用 Range 请求从断点续传
+
+    服务端不支持 Range (返回 200) 时从头重新下载。
+    headers 中带 If-None-Match / If-Modified-Since 时，服务端返回 304 则结果为 None。
+
+    Returns:
+        bytes 或 None；with_headers=True 时为 (bytes 或 None, 响应头)
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    buf = bytearray()
+    resumes = 0
+    first_headers = None
+    while True:
+        if buf:
+            # 续传时不再带条件请求头；If-Range 保证文件在两次请求之间没有变化，否则服务端返回完整内容
+            headers.pop("If-None-Match", None)
+            headers.pop("If-Modified-Since", None)
+            headers["Range"] = f"bytes={len(buf)}-"
+            if first_headers is not None and first_headers.get("ETag"):
+                headers["If-Range"] = first_headers["ETag"]
+        try:
+            with request("GET", url, headers=headers, stream=True, timeout=timeout, **kwargs) as response:
+                if first_headers is None:
+                    first_headers = response.headers
+                if response.status_code == 304:
+                    return (None, response.headers) if with_headers else None
+                if buf and response.status_code == 416:
+                    # 断点已在文件末尾
+                    break
+                response.raise_for_status()
+                if buf and response.status_code != 206:
+                    buf.clear()
+                for chunk in response.iter_content(chunk_size):
+                    buf.extend(chunk)
+            break
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.Timeout) as e:
+            if resumes >= max_resumes:
+                raise
+            resumes += 1
+            print(f"[HouLai HTTP] 下载中断 (已接收 {len(buf)} 字节)，第 {resumes} 次续传: {e}")
+    return (bytes(buf), first_headers) if with_headers else bytes(buf)
+
+
+def iter_sse_events(response, chunk_size=64 * 1024):
+    """
+    逐个产出 Server-Sent Events 的 data 内容 (需以 stream=True 发起请求)
+
+    每读完一个事件就交给调用方并丢弃缓冲，整个响应体不会同时驻留内存。
+    """
+    data_lines = []
+    for line in response.iter_lines(chunk_size=chunk_size):
+        if not line:
+            if data_lines:
+                yield b"\n".join(data_lines).decode("utf-8")
+                data_lines = []
+            continue
+        if line.startswith(b"data:"):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        yield b"\n".join(data_lines).decode("utf-8")
+
+
+def close_all():
+    """关闭所有缓存的连接 (进程退出时自动调用)"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        for client in _h2_clients.values():
+            client.close()
+        _sessions.clear()
+        _h2_clients.clear()
+
+
+atexit.register(close_all)
@@ -0,0 +1,86 @@
+"""
+后来工具箱 - 后台任务池
+
+提交类节点把耗时的网络请求放到后台线程执行并立即返回任务句柄 (job id)，
+收集类节点再按句柄等待结果。这样 ComfyUI 执行器不会被远程生成阻塞，
+其它 CPU 节点 (改色、提示词构建等) 可以与网络等待重叠执行。
+"""
+
+import os
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+JOB_WORKERS = int(os.environ.get("HOULAI_JOB_WORKERS", "8"))
+# 最多保留的任务数 (已完成的任务按提交顺序淘汰)。
+# ComfyUI 会缓存提交节点的输出，重新执行时可能再次收集同一个句柄，所以结果不在收集后立即删除。
+MAX_JOBS = int(os.environ.get("HOULAI_MAX_JOBS", "512"))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="houlai_job")
+_jobs = OrderedDict()  # job_id -> Future
+_lock = threading.Lock()
+
+
+class JobNotFound(KeyError):
+    """句柄不存在 (进程已重启或任务已被淘汰)"""
+
+
+def submit(fn, *args, prefix="job", **kwargs):
+    """
+    在后台线程池中执行 fn(*args, **kwargs)
+
+    Returns:
+        str: 任务句柄
+    """
+    job_id = f"{prefix}_{uuid.uuid4().hex[:16]}"
+    future = _executor.submit(fn, *args, **kwargs)
+    with _lock:
+        _jobs[job_id] = future
+        # 只淘汰已完成的旧任务，运行中的任务不会丢失
+        while len(_jobs) > MAX_JOBS:
+            old_id = next((jid for jid, f in _jobs.items() if f.done()), None)
+            if old_id is None:
+                break
+            del _jobs[old_id]
+    return job_id
+
+
+def get_future(job_id):
+    with _lock:
+        future = _jobs.get(job_id)
+    if future is None:
+        raise JobNotFound(job_id)
+    return future
+
+
+def wait_jobs(job_ids, timeout=None):
+    """
+    等待一组任务完成
+
+    Returns:
+        List[Tuple[bool, Any]]: 与 job_ids 顺序一致，(是否成功, 结果或错误信息)
+    """
+    futures = {}
+    results = [None] * len(job_ids)
+    for idx, job_id in enumerate(job_ids):
+        try:
+            futures[idx] = get_future(job_id)
+        except JobNotFound:
+            results[idx] = (False, f"任务不存在或已过期: {job_id}")
+
+    wait(list(futures.values()), timeout=timeout)
+    for idx, future in futures.items():
+        if not future.done():
+            results[idx] = (False, f"等待超时: {job_ids[idx]}")
+            continue
+        try:
+            results[idx] = (True, future.result())
+        except Exception as e:
+            results[idx] = (False, f"Exception: {str(e)}")
+    return results
+
+
+def pending_count():
+    with _lock:
+        return sum(1 for f in _jobs.values() if not f.done())
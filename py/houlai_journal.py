@@ -0,0 +1,151 @@
+"""
+后来工具箱 - 云端任务日志 (SQLite)
+
+每个提交成功的云端任务都会记录 task_id、轮询地址、payload 哈希、状态和结果地址 / 本地路径。
+ComfyUI 重启、节点超时或关闭等待模式后，已付费的任务不会丢失，
+可以用 ☁️ 云端任务收集器 节点恢复轮询并下载结果。
+
+API Token 不写入日志，恢复时由收集器节点重新提供。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from .houlai_cache import CACHE_ROOT
+
+DB_PATH = os.environ.get("HOULAI_JOURNAL_DB", str(CACHE_ROOT / "tasks.sqlite3"))
+
+# 结果图保存目录 (服务商返回的 URL 通常会过期)
+RESULTS_DIR = CACHE_ROOT / "task_results"
+
+# 可以恢复轮询的状态: 已提交但没拿到结果 (超时 / 网络错误时服务端可能仍在生成，下载失败可重新获取地址)
+RESUMABLE_STATUSES = ("submitted", "timeout", "network_error", "download_failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id      TEXT PRIMARY KEY,
+    node         TEXT NOT NULL,
+    api_url      TEXT,
+    poll_url     TEXT NOT NULL,
+    model        TEXT,
+    resolution   TEXT,
+    payload_hash TEXT,
+    status       TEXT NOT NULL,
+    result_url   TEXT,
+    result_path  TEXT,
+    raw          TEXT,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, created_at);
+"""
+
+
+class TaskJournal:
+    """
+    线程安全的任务日志 (每个线程一个 SQLite 连接，WAL 模式)
+
+    Args:
+        path: 数据库文件路径
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def record_submit(self, task_id, node, poll_url, api_url="", model="", resolution="", payload_hash=""):
+        """任务提交成功后立即写入 (状态 submitted)"""
+        now = time.time()
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tasks (task_id, node, api_url, poll_url, model, resolution,"
+                    " payload_hash, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'submitted', ?, ?)",
+                    (task_id, node, api_url, poll_url, model, resolution, payload_hash, now, now))
+        except sqlite3.Error as e:
+            print(f"[HouLai Journal] 写入任务日志失败: {e}")
+
+    def update(self, task_id, status, result_url=None, result_path=None, raw=None):
+        """更新状态；result_url / result_path / raw 为 None 时保留原值"""
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "UPDATE tasks SET status = ?, result_url = COALESCE(?, result_url),"
+                    " result_path = COALESCE(?, result_path), raw = COALESCE(?, raw), updated_at = ?"
+                    " WHERE task_id = ?",
+                    (status, result_url, result_path, raw, time.time(), task_id))
+        except sqlite3.Error as e:
+            print(f"[HouLai Journal] 更新任务日志失败: {e}")
+
+    def get(self, task_id):
+        row = self._conn().execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    def pending(self, limit=100, max_age_hours=0):
+        """
+        需要恢复的任务，按提交时间从旧到新
+
+        Args:
+            max_age_hours: 只返回该时间内提交的任务 (0 = 不限制)
+        """
+        sql = f"SELECT * FROM tasks WHERE status IN ({', '.join('?' * len(RESUMABLE_STATUSES))})"
+        params = list(RESUMABLE_STATUSES)
+        if max_age_hours:
+            sql += " AND created_at >= ?"
+            params.append(time.time() - max_age_hours * 3600)
+        sql += " ORDER BY created_at LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._conn().execute(sql, params)]
+
+
+JOURNAL = TaskJournal()
+
+
+def result_path_for(task_id, blob, index=0):
+    """结果图的本地保存路径 (按文件头判断扩展名，一个任务多张图时带序号)"""
+    if blob[:3] == b"\xff\xd8\xff":
+        ext = ".jpg"
+    elif blob[:4] == b"RIFF" and blob[8:12] == b"WEBP":
+        ext = ".webp"
+    else:
+        ext = ".png"
+    suffix = f"_{index}" if index else ""
+    return RESULTS_DIR / f"{task_id}{suffix}{ext}"
+
+
+def save_result(task_id, blob, index=0):
+    """
+    保存结果图字节 (一个任务有多张图时，日志中的 result_path 为换行分隔的多个路径)
+
+    Returns:
+        Optional[str]: 保存路径，失败返回 None
+    """
+    path = result_path_for(task_id, blob, index)
+    try:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_bytes(blob)
+        os.replace(tmp, path)
+        return str(path)
+    except OSError as e:
+        print(f"[HouLai Journal] 保存结果图失败: {e}")
+        return None
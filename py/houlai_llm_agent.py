@@ -10,6 +10,7 @@ ComfyUI_Ecommerce_LLM_Agent - 核心节点实现
 - 支持图片+文本输入
 - YAML技能库动态加载
 - 生成适配Flux/Qwen的提示词
+- 流式输出: 逐行产出提示词 (stream_prompts)
 """
 
 # ============================================
@@ -51,17 +52,23 @@ DEPS_OK = check_dependencies()
 import os
 import io
 import base64
+import threading
 import traceback
 from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
 # 第三方库导入 (在依赖检查通过后)
 if DEPS_OK:
-    import yaml
     from PIL import Image as PILImage
-    from openai import OpenAI
     import torch
     import numpy as np
+    from .utils import tensor2pil
+    from .houlai_ratelimit import get_limiter
+    from .houlai_llm_clients import CLIENTS, DEFAULT_TIMEOUT, DEFAULT_MAX_CONNECTIONS
+    from .houlai_skills import get_registry
+    from .houlai_llm_stream import PromptStream
+    from . import houlai_jobs
+    import comfy.utils
 
 # ============================================
 # 全局常量定义
@@ -85,94 +92,68 @@ DEFAULT_SYSTEM_PROMPT = "你是一个专业的电商视觉内容生成助手。"
 # 工具函数
 # ============================================
 
-# 全局缓存技能列表
-_SKILLS_CACHE = None
+# 当前使用的自定义技能目录 (None = 默认目录)
 _CUSTOM_SKILLS_DIR = None
 
+
+def _skills_dir(custom_path: str = "") -> Path:
+    """确定使用的技能目录 (自定义目录填写一次后保持生效)"""
+    global _CUSTOM_SKILLS_DIR
+    if custom_path and custom_path.strip():
+        _CUSTOM_SKILLS_DIR = Path(custom_path.strip())
+        return _CUSTOM_SKILLS_DIR
+    return _CUSTOM_SKILLS_DIR or SKILLS_DIR
+
+
 def scan_skills_directory(force_refresh: bool = False, custom_path: str = "") -> List[str]:
     """
-    扫描技能目录下的所有YAML文件，返回技能选项列表
+    返回技能选项列表 (技能库索引按文件 mtime 增量更新，不会每次重新解析 YAML)
     
     Args:
-        force_refresh: 是否强制刷新缓存
+        force_refresh: 是否立即检查文件变化
         custom_path: 自定义技能文件夹路径
     
     Returns:
         List[str]: 格式为 "文件名 - Key名" 的技能选项列表
     """
-    global _SKILLS_CACHE, _CUSTOM_SKILLS_DIR
-    
-    # 确定使用的技能目录
-    if custom_path and custom_path.strip():
-        skills_dir = Path(custom_path.strip())
-        _CUSTOM_SKILLS_DIR = skills_dir
-    elif _CUSTOM_SKILLS_DIR:
-        skills_dir = _CUSTOM_SKILLS_DIR
-    else:
-        skills_dir = SKILLS_DIR
-    
-    # 使用缓存（除非强制刷新）
-    if not force_refresh and _SKILLS_CACHE is not None:
-        return _SKILLS_CACHE
-    
-    skills = []
-    
-    # 确保技能目录存在
+    skills_dir = _skills_dir(custom_path)
     if not skills_dir.exists():
         print(f"[Ecommerce_Skill_Router] 警告: 技能目录不存在: {skills_dir}")
         return ["未找到技能文件"]
-    
-    # 遍历所有yaml文件
-    for yaml_file in sorted(skills_dir.glob("*.yaml")):
-        try:
-            with open(yaml_file, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
-                
-            if data and isinstance(data, dict):
-                for key in data.keys():
-                    # 格式: "文件名(不含扩展名) - Key名"
-                    display_name = f"{yaml_file.stem} - {key}"
-                    skills.append(display_name)
-        except Exception as e:
-            print(f"[Ecommerce_Skill_Router] 解析文件失败 {yaml_file}: {e}")
-            continue
-    
-    if not skills:
-        _SKILLS_CACHE = ["未找到有效技能"]
-    else:
-        _SKILLS_CACHE = skills
-    
-    return _SKILLS_CACHE
+
+    registry = get_registry(skills_dir)
+    registry.refresh(force=force_refresh)
+    return registry.options() or ["未找到有效技能"]
 
 
-def search_skill_by_keyword(keyword: str) -> Optional[str]:
+def search_skill_by_keyword(keyword: str, custom_path: str = "", top_k: int = 5) -> Optional[str]:
     """
-    根据关键词搜索匹配的技能
+    根据关键词搜索匹配的技能 (倒排索引 + BM25 排序，支持中文、拼写容错和前缀)
     
     Args:
         keyword: 搜索关键词
+        custom_path: 自定义技能文件夹路径
+        top_k: 日志中列出的候选数量
     
     Returns:
-        Optional[str]: 匹配的技能名称，未找到返回None
+        Optional[str]: 相关度最高的技能名称，未找到返回None
     """
     if not keyword or not keyword.strip():
         return None
     
-    keyword = keyword.strip().lower()
-    skills = scan_skills_directory()
-    
-    # 精确匹配
-    for skill in skills:
-        if keyword in skill.lower():
-            print(f"[Skill Search] 找到匹配: {skill}")
-            return skill
+    results = get_registry(_skills_dir(custom_path)).search(keyword.strip(), top_k=top_k)
+    if not results:
+        return None
     
-    return None
+    candidates = ", ".join(f"{skill} ({score:.2f})" for skill, score in results)
+    print(f"[Skill Search] '{keyword.strip()}' 候选: {candidates}")
+    print(f"[Skill Search] 找到匹配: {results[0][0]}")
+    return results[0][0]
 
 
 def load_skill_template(skill_selection: str, custom_path: str = "") -> Optional[str]:
     """
-    根据选择加载对应的技能模板
+    根据选择获取对应的技能模板 (从内存索引读取，模板已在加载时校验)
     
     Args:
         skill_selection: 格式为 "文件名 - Key名"
@@ -181,38 +162,7 @@ def load_skill_template(skill_selection: str, custom_path: str = "") -> Optional
     Returns:
         Optional[str]: 模板字符串，失败返回None
     """
-    global _CUSTOM_SKILLS_DIR
-    
-    try:
-        # 确定使用的技能目录
-        if custom_path and custom_path.strip():
-            skills_dir = Path(custom_path.strip())
-        elif _CUSTOM_SKILLS_DIR:
-            skills_dir = _CUSTOM_SKILLS_DIR
-        else:
-            skills_dir = SKILLS_DIR
-        
-        # 解析选择字符串
-        parts = skill_selection.split(" - ", 1)
-        if len(parts) != 2:
-            return None
-        
-        filename, key = parts
-        yaml_path = skills_dir / f"{filename}.yaml"
-        
-        if not yaml_path.exists():
-            return None
-        
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
-        
-        if key in data and "template" in data[key]:
-            return data[key]["template"]
-        
-        return None
-    except Exception as e:
-        print(f"[Ecommerce_Skill_Router] 加载模板失败: {e}")
-        return None
+    return get_registry(_skills_dir(custom_path)).template(skill_selection)
 
 
 def tensor_to_pil(image_tensor: torch.Tensor) -> PILImage.Image:
@@ -225,25 +175,17 @@ def tensor_to_pil(image_tensor: torch.Tensor) -> PILImage.Image:
     Returns:
         PILImage.Image: PIL图像对象
     """
-    # 处理batch维度
+    # 处理batch维度: [B, H, W, C] -> 取第一张，整批向量化量化
     if len(image_tensor.shape) == 4:
-        # [B, H, W, C] -> 取第一张
-        image_tensor = image_tensor[0]
+        image_tensor = image_tensor[:1]
     
-    # [H, W, C] -> 转换为numpy
     if isinstance(image_tensor, torch.Tensor):
-        image_np = image_tensor.cpu().numpy()
+        pil_image = tensor2pil(image_tensor)[0]
     else:
         image_np = np.array(image_tensor)
-    
-    # 确保值范围在0-255
-    if image_np.max() <= 1.0:
-        image_np = (image_np * 255).astype(np.uint8)
-    else:
-        image_np = image_np.astype(np.uint8)
-    
-    # 创建PIL图像
-    pil_image = PILImage.fromarray(image_np)
+        if image_np.max() <= 1.0:
+            image_np = (image_np * 255).astype(np.uint8)
+        pil_image = PILImage.fromarray(image_np.astype(np.uint8))
     
     # 限制最大尺寸
     if max(pil_image.size) > MAX_IMAGE_SIZE:
@@ -357,6 +299,19 @@ class Universal_LLM_Config:
                     "lines": 4,
                     "tooltip": "系统级提示词，定义AI助手的角色和行为"
                 }),
+            },
+            "optional": {
+                # 连接参数 (相同配置的多次调用复用同一个客户端和长连接)
+                "timeout": ("FLOAT", {
+                    "default": DEFAULT_TIMEOUT if DEPS_OK else 600.0,
+                    "min": 5.0, "max": 3600.0, "step": 5.0,
+                    "tooltip": "单次请求超时(秒)，默认与 OpenAI SDK 相同 (600 秒)，长时间的多模态生成不要调得太小"
+                }),
+                "max_connections": ("INT", {
+                    "default": DEFAULT_MAX_CONNECTIONS if DEPS_OK else 20,
+                    "min": 1, "max": 256,
+                    "tooltip": "与该接口保持的最大连接数，批量并发调用时调大"
+                }),
             }
         }
     
@@ -364,7 +319,8 @@ class Universal_LLM_Config:
     # 核心处理函数
     # ========================================
     def create_config(self, base_url: str, api_key: str, 
-                      model_name: str, system_prompt: str) -> Tuple[Dict[str, Any]]:
+                      model_name: str, system_prompt: str,
+                      timeout: float = 600.0, max_connections: int = 20) -> Tuple[Dict[str, Any]]:
         """
         创建LLM配置对象
         
@@ -373,6 +329,8 @@ class Universal_LLM_Config:
             api_key: API密钥
             model_name: 模型名称
             system_prompt: 系统提示词
+            timeout: 请求超时(秒)
+            max_connections: 最大连接数
         
         Returns:
             Tuple[Dict]: 包含配置字典的元组
@@ -382,6 +340,8 @@ class Universal_LLM_Config:
             "api_key": api_key,
             "model_name": model_name,
             "system_prompt": system_prompt,
+            "timeout": timeout,
+            "max_connections": max_connections,
         }
         
         print(f"[Universal_LLM_Config] 配置已创建: {model_name} @ {base_url}")
@@ -396,11 +356,12 @@ class Ecommerce_Skill_Router:
     FUNCTION = "process"
     
     # 修改1：定义返回类型为字符串，并匹配你截图中的名称
-    RETURN_TYPES = ("STRING", "STRING")
-    RETURN_NAMES = ("batch_prompts", "formatted_summary")
+    RETURN_TYPES = ("STRING", "STRING", "HOULAI_JOB")
+    RETURN_NAMES = ("batch_prompts", "formatted_summary", "jobs")
     
     # 修改2：关键！告知 ComfyUI 第一个输出是列表(List)，用于触发下游批量任务
-    OUTPUT_IS_LIST = (True, False) 
+    # jobs: 连接 生图提交 时每条提示词对应的出图任务句柄，接 HouLai_Gemini3_Pro_Collect
+    OUTPUT_IS_LIST = (True, False, True) 
     
     OUTPUT_NODE = False
 
@@ -430,6 +391,8 @@ class Ecommerce_Skill_Router:
                 "平台": ("STRING", {"default": "", "placeholder": "平台（可选）"}),
                 "语言": ("STRING", {"default": "", "placeholder": "语言（可选，如：中文/English）"}),
                 "自定义模板": ("STRING", {"default": "", "multiline": True, "placeholder": "自定义模板（可选）"}),
+                "流式输出": ("BOOLEAN", {"default": False, "tooltip": "以流式方式调用模型，每生成完一行立即产出一条提示词"}),
+                "生图提交": ("GEMINI_SUBMIT_CONFIG", {"tooltip": "连接 Gemini Stream Submit 节点: 每产出一条提示词立即提交出图任务 (配合流式输出，不用等模型写完)"}),
             }
         }
 
@@ -445,10 +408,12 @@ class Ecommerce_Skill_Router:
                 产品名称: str = "", 目标人群: str = "",
                 产品参数: str = "", 卖点: str = "",
                 平台: str = "", 语言: str = "",
-                自定义模板: str = "") -> Tuple[List[str], str]:
+                自定义模板: str = "",
+                流式输出: bool = False,
+                生图提交: Optional[Dict[str, Any]] = None) -> Tuple[List[str], str, List[str]]:
         
         if not DEPS_OK:
-            return (["依赖缺失"], "请安装必要的Python库")
+            return (["依赖缺失"], "请安装必要的Python库", [])
 
         try:
             # 处理刷新请求
@@ -459,7 +424,7 @@ class Ecommerce_Skill_Router:
             # 处理关键词搜索
             final_skill = 技能选择
             if 关键词搜索 and 关键词搜索.strip():
-                matched = search_skill_by_keyword(关键词搜索)
+                matched = search_skill_by_keyword(关键词搜索, 自定义技能目录)
                 if matched:
                     final_skill = matched
                     print(f"[Ecommerce_Skill_Router] 使用关键词匹配的技能: {final_skill}")
@@ -487,10 +452,10 @@ class Ecommerce_Skill_Router:
             if 使用技能:
                 template = load_skill_template(final_skill, 自定义技能目录)
                 if not template:
-                    return (["技能模板加载失败"], "请检查技能选择或使用自定义模板")
+                    return (["技能模板加载失败"], "请检查技能选择或使用自定义模板", [])
             else:
                 if not 自定义模板 or not 自定义模板.strip():
-                    return (["请提供自定义模板内容"], "关闭技能后必须填写自定义模板")
+                    return (["请提供自定义模板内容"], "关闭技能后必须填写自定义模板", [])
                 template = 自定义模板.strip()
             
             # 3. 构建最终提示词，明确告知LLM生成指定数量的提示词
@@ -507,11 +472,20 @@ class Ecommerce_Skill_Router:
                 if img_tensor is not None:
                     pil_images.append(tensor_to_pil(img_tensor))
 
-            # 3. 调用 LLM
-            response_text = self._call_llm(LLM配置, final_prompt, pil_images)
+            # 3. 调用 LLM (连接了生图提交时，每条提示词立即提交一个出图任务)
+            jobs = []
+            on_line = None
+            if 生图提交:
+                def on_line(index, line):
+                    jobs.append(self._submit_line(生图提交, index, line))
+
+            if 流式输出:
+                response_text = self._call_llm_streaming(LLM配置, final_prompt, pil_images, 生图数量, on_line)
+            else:
+                response_text = self._call_llm(LLM配置, final_prompt, pil_images)
             
             if response_text is None:
-                return (["API调用失败"], "请检查网络或API Key")
+                return (["API调用失败"], "请检查网络或API Key", jobs)
 
             # 4. 修改输出逻辑：将文本按行切分为列表
             # 过滤掉空行，确保每一行都是一个独立的 Prompt
@@ -521,15 +495,72 @@ class Ecommerce_Skill_Router:
             formatted_summary = response_text.strip()
 
             print(f"[Ecommerce_Skill_Router] 成功生成 {len(lines)} 条独立提示词")
+
+            # 非流式调用时在拿到完整响应后一次性提交
+            if on_line is not None and not 流式输出:
+                for index, line in enumerate(lines):
+                    on_line(index, line)
+            if 生图提交:
+                print(f"[Ecommerce_Skill_Router] 已提交 {len(jobs)} 个出图任务")
             
-            # 修改3：返回 (列表, 字符串)
-            return (lines, formatted_summary)
+            # 修改3：返回 (列表, 字符串, 任务句柄列表)
+            return (lines, formatted_summary, jobs)
 
         except Exception as e:
             traceback.print_exc()
-            return ([f"错误: {str(e)}"], str(e))
+            return ([f"错误: {str(e)}"], str(e), [])
+
+    # ========================================
+    # 构建消息
+    # ========================================
+    def _build_messages(self, llm_config: Dict[str, Any],
+                        prompt: str,
+                        images: List[PILImage.Image]) -> List[Dict[str, Any]]:
+        """构建消息 (系统提示词 + 文本/图片用户消息)"""
+        messages = []
+
+        # 添加系统提示词
+        if llm_config.get("system_prompt"):
+            messages.append({
+                "role": "system",
+                "content": llm_config["system_prompt"]
+            })
+
+        # 添加用户消息 (文本+图片)
+        if images:
+            # 多模态消息
+            content = []
+
+            # 添加图片
+            for pil_img in images:
+                base64_img = pil_to_base64(pil_img, "PNG")
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/png;base64,{base64_img}",
+                        "detail": "high"
+                    }
+                })
+
+            # 添加文本
+            content.append({
+                "type": "text",
+                "text": prompt
+            })
+
+            messages.append({
+                "role": "user",
+                "content": content
+            })
+        else:
+            # 纯文本消息
+            messages.append({
+                "role": "user",
+                "content": prompt
+            })
+
+        return messages
 
-    # _call_llm 函数保持不变...
     # ========================================
     # LLM API调用函数
     # ========================================
@@ -548,64 +579,27 @@ class Ecommerce_Skill_Router:
             Optional[str]: LLM响应文本，失败返回None
         """
         try:
-            # 创建OpenAI客户端
-            client = OpenAI(
-                base_url=llm_config["base_url"],
-                api_key=llm_config["api_key"],
-            )
-            
-            # 构建消息
-            messages = []
-            
-            # 添加系统提示词
-            if llm_config.get("system_prompt"):
-                messages.append({
-                    "role": "system",
-                    "content": llm_config["system_prompt"]
-                })
-            
-            # 添加用户消息 (文本+图片)
-            if images:
-                # 多模态消息
-                content = []
-                
-                # 添加图片
-                for pil_img in images:
-                    base64_img = pil_to_base64(pil_img, "PNG")
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{base64_img}",
-                            "detail": "high"
-                        }
-                    })
-                
-                # 添加文本
-                content.append({
-                    "type": "text",
-                    "text": prompt
-                })
-                
-                messages.append({
-                    "role": "user",
-                    "content": content
-                })
-            else:
-                # 纯文本消息
-                messages.append({
-                    "role": "user",
-                    "content": prompt
-                })
+            messages = self._build_messages(llm_config, prompt, images)
             
             print(f"[Ecommerce_Skill_Router] 调用模型: {llm_config['model_name']}")
             
-            # 发送请求
-            response = client.chat.completions.create(
-                model=llm_config["model_name"],
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2048,
-            )
+            # 发送请求 (同一 base_url + Key 共用限流器，并按响应头调整速率)
+            limiter = get_limiter(llm_config["base_url"], llm_config["api_key"])
+            # 复用相同配置的OpenAI客户端 (连接池和TLS会话跨执行、跨线程共享)，调用期间不会被空闲回收
+            with CLIENTS.lease(llm_config) as client:
+                try:
+                    with limiter.slot():
+                        raw_response = client.chat.completions.with_raw_response.create(
+                            model=llm_config["model_name"],
+                            messages=messages,
+                            temperature=0.7,
+                            max_tokens=2048,
+                        )
+                except Exception as e:
+                    limiter.observe_error(e)
+                    raise
+                limiter.observe(status_code=raw_response.status_code, headers=raw_response.headers)
+                response = raw_response.parse()
             
             # 提取响应文本
             result = response.choices[0].message.content
@@ -620,6 +614,108 @@ class Ecommerce_Skill_Router:
             print("=" * 60)
             return None
 
+    # ========================================
+    # 流式调用 (逐行产出提示词)
+    # ========================================
+    def stream_prompts(self, llm_config: Dict[str, Any],
+                       prompt: str,
+                       images: List[PILImage.Image],
+                       on_line=None) -> "PromptStream":
+        """
+        后台以 stream=True 调用LLM，立即返回逐行产出的提示词流
+        
+        下游可以遍历返回的流 (或通过 on_line(index, line) 回调) 在第 1 条提示词生成后
+        立即开始处理，不用等模型写完全部提示词。
+        
+        Args:
+            llm_config: LLM配置
+            prompt: 文本提示词
+            images: PIL图像列表
+            on_line: 每产出一行调用一次
+        
+        Returns:
+            PromptStream: 调用失败时 stream.error 不为空
+        """
+        stream = PromptStream(on_line=on_line, name=llm_config.get("model_name", "llm"))
+        threading.Thread(target=self._stream_llm, args=(llm_config, prompt, images, stream),
+                         name="houlai_llm_stream", daemon=True).start()
+        return stream
+
+    def _stream_llm(self, llm_config: Dict[str, Any],
+                    prompt: str,
+                    images: List[PILImage.Image],
+                    stream: "PromptStream") -> None:
+        """把模型的增量输出写入 stream (在后台线程运行)"""
+        try:
+            messages = self._build_messages(llm_config, prompt, images)
+            
+            print(f"[Ecommerce_Skill_Router] 流式调用模型: {llm_config['model_name']}")
+            
+            # 流式读取期间一直占用并发槽位 (连接仍在使用)，客户端也不会被空闲回收
+            limiter = get_limiter(llm_config["base_url"], llm_config["api_key"])
+            with CLIENTS.lease(llm_config) as client, limiter.slot():
+                try:
+                    raw_response = client.chat.completions.with_raw_response.create(
+                        model=llm_config["model_name"],
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=2048,
+                        stream=True,
+                    )
+                except Exception as e:
+                    limiter.observe_error(e)
+                    raise
+                limiter.observe(status_code=raw_response.status_code, headers=raw_response.headers)
+                for chunk in raw_response.parse():
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        stream.put_text(chunk.choices[0].delta.content)
+            stream.close()
+            
+        except Exception as e:
+            print("=" * 60)
+            print("[Ecommerce_Skill_Router] LLM 流式调用失败:")
+            traceback.print_exc()
+            print("=" * 60)
+            stream.close(error=e)
+
+    def _submit_line(self, submit_config: Dict[str, Any], index: int, line: str) -> str:
+        """按 GEMINI_SUBMIT_CONFIG 提交一条提示词，提交失败也返回句柄 (保持与提示词一一对应)"""
+        try:
+            return submit_config["submit"](index, line)
+        except Exception as e:
+            print(f"[Ecommerce_Skill_Router] 第 {index + 1} 条提示词提交失败: {e}")
+            return houlai_jobs.submit(lambda: (None, f"Exception: {str(e)}"), prefix="gemini")
+
+    def _call_llm_streaming(self, llm_config: Dict[str, Any],
+                            prompt: str,
+                            images: List[PILImage.Image],
+                            expected: int,
+                            on_line=None) -> Optional[str]:
+        """
+        流式调用LLM并在节点进度条上显示已产出的提示词数
+        
+        Args:
+            on_line: 每产出一行立即调用 on_line(index, line) (在模型输出线程中，模型仍在继续写后面的行)
+        
+        Returns:
+            Optional[str]: 完整响应文本；一行都没产出就失败时返回None
+        """
+        stream = self.stream_prompts(llm_config, prompt, images, on_line)
+        pbar = comfy.utils.ProgressBar(expected)
+        for index, _ in enumerate(stream):
+            if index == 0:
+                print(f"[Ecommerce_Skill_Router] 首条提示词用时 {stream.time_to_first_line:.2f}s")
+            pbar.update_absolute(min(index + 1, expected), expected)
+        
+        if stream.error is not None and not stream.lines:
+            return None
+        if stream.error is not None:
+            print(f"[Ecommerce_Skill_Router] 流式输出中断，保留已生成的 {len(stream.lines)} 条提示词")
+            return "\n".join(stream.lines)
+        print(f"[Ecommerce_Skill_Router] 流式调用完成，用时 {stream.finished_at - stream.started_at:.2f}s，"
+              f"响应长度: {len(stream.text)} 字符")
+        return stream.text
+
 
 # ============================================
 # 节点映射 (供ComfyUI加载使用)
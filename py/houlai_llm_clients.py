@@ -0,0 +1,117 @@
+"""
+后来工具箱 - OpenAI 客户端复用
+
+每次执行都新建 OpenAI(...) 会新建一个 httpx 连接池，重新做 DNS / TCP / TLS 握手。
+这里按 LLM 配置 (base_url + api_key + 超时 + 连接数) 缓存客户端，
+多次执行、多个线程共用同一个客户端和它的长连接；长时间未使用的客户端自动关闭。
+
+调用方通过 lease() 借用客户端，请求进行中 (含长时间的流式读取) 的客户端不会被关闭。
+"""
+
+import os
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+import httpx
+from openai import OpenAI
+
+from .houlai_cache import hash_key
+
+DEFAULT_TIMEOUT = float(os.environ.get("HOULAI_LLM_TIMEOUT", "600"))               # 请求超时 (秒)，与 OpenAI SDK 默认值一致
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get("HOULAI_LLM_MAX_CONNECTIONS", "20"))  # 单个客户端最大连接数
+IDLE_SECONDS = float(os.environ.get("HOULAI_LLM_IDLE_SECONDS", "300"))             # 空闲多久后关闭客户端
+
+# 连接超时单独设置，避免接口不可达时等满整个请求超时
+CONNECT_TIMEOUT = 10.0
+
+
+class ClientRegistry:
+    """
+    线程安全的 OpenAI 客户端缓存
+
+    Args:
+        idle_seconds: 客户端空闲超过该时间后关闭 (下次使用时重建)
+    """
+
+    def __init__(self, idle_seconds=IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._clients = {}   # key -> [client, last_used, users]
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def lease(self, llm_config):
+        """
+        借用客户端完成一次调用，期间该客户端不会被空闲回收
+
+            with CLIENTS.lease(llm_config) as client:
+                client.chat.completions.create(...)
+        """
+        entry = self._acquire(llm_config)
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[2] -= 1
+                entry[1] = time.monotonic()
+
+    def _acquire(self, llm_config):
+        """获取 (或创建) 客户端并计入使用中，返回缓存条目"""
+        timeout = float(llm_config.get("timeout") or DEFAULT_TIMEOUT)
+        max_connections = int(llm_config.get("max_connections") or DEFAULT_MAX_CONNECTIONS)
+        key = hash_key(llm_config["base_url"], llm_config["api_key"], timeout, max_connections)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                entry[2] += 1
+                self.reused += 1
+                return entry
+            client = self._create(llm_config["base_url"], llm_config["api_key"], timeout, max_connections)
+            entry = self._clients[key] = [client, now, 1]
+            self.created += 1
+            return entry
+
+    def _create(self, base_url, api_key, timeout, max_connections):
+        http_client = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout)),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections,
+                                keepalive_expiry=self.idle_seconds),
+        )
+        return OpenAI(base_url=base_url, api_key=api_key, timeout=http_client.timeout, http_client=http_client)
+
+    def _evict(self, now):
+        """关闭空闲且没有调用在进行的客户端，调用方需持有 self._lock"""
+        expired = [key for key, (_, last_used, users) in self._clients.items()
+                   if users == 0 and now - last_used > self.idle_seconds]
+        for key in expired:
+            client, _, _ = self._clients.pop(key)
+            self._close(client)
+
+    def _close(self, client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._lock:
+            clients = [client for client, _, _ in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            self._close(client)
+
+    def stats(self):
+        with self._lock:
+            in_use = sum(1 for _, _, users in self._clients.values() if users)
+            return {"clients": len(self._clients), "in_use": in_use, "created": self.created, "reused": self.reused}
+
+
+CLIENTS = ClientRegistry()
+atexit.register(CLIENTS.close_all)
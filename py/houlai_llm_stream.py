@@ -0,0 +1,145 @@
+"""
+后来工具箱 - LLM 流式输出 (逐行产出提示词)
+
+🛒 电商技能路由 开启 流式输出 后以 stream=True 调用模型，每收到一个完整行就立即产出一条提示词，
+不必等 2048 token 全部生成完。连接了 生图提交 (💎 Gemini Stream Submit) 时，
+每产出一行就通过 on_line 回调提交一个出图任务，第 1 张图在模型写第 2 行时已经开始生成。
+
+- 队列: 遍历 PromptStream，每产出一行返回一行，模型写完后迭代结束 (单个消费者)
+- 回调: PromptStream(on_line=...) / stream.add_callback(fn)
+"""
+
+import time
+import queue
+import threading
+
+# 迭代结束标记
+_DONE = object()
+
+
+class LineSplitter:
+    """
+    把增量文本切成完整行
+
+    输出与 text.split("\\n") 后去掉首尾空白、过滤空行的结果一致。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        """追加文本，返回新产生的完整行"""
+        *complete, self._buffer = (self._buffer + text).split("\n")
+        return [line.strip() for line in complete if line.strip()]
+
+    def flush(self):
+        """流结束时取出最后一行 (没有换行结尾)"""
+        line, self._buffer = self._buffer.strip(), ""
+        return [line] if line else []
+
+
+class PromptStream:
+    """
+    逐行产出的提示词流 (线程安全)
+
+    生产者调用 put_text / close；消费者遍历、注册回调或 wait() 后读取 lines / text。
+
+    Args:
+        on_line: 每产出一行调用一次 on_line(index, line)
+        name: 日志中显示的名称
+    """
+
+    def __init__(self, on_line=None, name="llm"):
+        self.name = name
+        self.lines = []
+        self.error = None
+        self.started_at = time.monotonic()
+        self.first_line_at = None
+        self.finished_at = None
+        self._chunks = []
+        self._splitter = LineSplitter()
+        self._queue = queue.Queue()
+        self._callbacks = [on_line] if on_line else []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    # ----------------------------------------
+    # 生产者
+    # ----------------------------------------
+    def put_text(self, delta):
+        """追加模型输出的增量文本"""
+        if not delta:
+            return
+        with self._lock:
+            self._chunks.append(delta)
+            lines = self._splitter.feed(delta)
+        for line in lines:
+            self._emit(line)
+
+    def close(self, error=None):
+        """结束流 (error 不为空表示调用失败，已产出的完整行仍然有效，未写完的最后一行丢弃)"""
+        if self._done.is_set():
+            return
+        with self._lock:
+            lines = self._splitter.flush() if error is None else []
+        for line in lines:
+            self._emit(line)
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._done.set()
+        self._queue.put(_DONE)
+
+    def _emit(self, line):
+        with self._lock:
+            index = len(self.lines)
+            self.lines.append(line)
+            if self.first_line_at is None:
+                self.first_line_at = time.monotonic()
+            callbacks = list(self._callbacks)
+        self._queue.put(line)
+        for callback in callbacks:
+            self._invoke(callback, index, line)
+
+    def _invoke(self, callback, *args):
+        # 回调异常不能打断模型输出
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"⚠️ [LLM Stream] 回调出错 ({self.name}): {e}")
+
+    # ----------------------------------------
+    # 消费者
+    # ----------------------------------------
+    def add_callback(self, callback):
+        """注册回调，已产出的行会先补发"""
+        with self._lock:
+            backlog = list(enumerate(self.lines))
+            self._callbacks.append(callback)
+        for index, line in backlog:
+            self._invoke(callback, index, line)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                # 放回结束标记，重复迭代时立即结束
+                self._queue.put(_DONE)
+                return
+            yield item
+
+    def wait(self, timeout=None):
+        """等待流结束，返回是否已结束"""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def text(self):
+        with self._lock:
+            return "".join(self._chunks)
+
+    @property
+    def time_to_first_line(self):
+        return None if self.first_line_at is None else self.first_line_at - self.started_at
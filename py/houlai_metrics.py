@@ -0,0 +1,183 @@
+"""
+后来工具箱 - 分阶段耗时统计
+
+每次云端节点调用创建一个 PhaseTimer，按阶段累计耗时:
+  参考图编码 / payload 序列化 / 上传 / 首字节 (TTFB) / 响应体下载 /
+  轮询次数与等待 / 结果图下载 / 解码 / 转 Tensor，以及请求、响应字节数。
+结束时追加一行 JSON 到滚动日志 (默认 logs/timing.jsonl)，同时作为节点的 timing 输出。
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+# 插件根目录 (py目录的父目录)
+PLUGIN_ROOT = Path(__file__).parent.parent.absolute()
+
+LOG_PATH = Path(os.environ.get("HOULAI_METRICS_LOG", str(PLUGIN_ROOT / "logs" / "timing.jsonl")))
+LOG_MAX_BYTES = int(os.environ.get("HOULAI_METRICS_LOG_MB", "10")) * 1024 * 1024
+LOG_BACKUPS = int(os.environ.get("HOULAI_METRICS_LOG_BACKUPS", "5"))
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger():
+    """首次写入时才创建日志文件 (RotatingFileHandler 自带线程锁)"""
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                logger = logging.getLogger("houlai.metrics")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                try:
+                    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+                    handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES,
+                                                  backupCount=LOG_BACKUPS, encoding="utf-8")
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    logger.addHandler(handler)
+                except OSError as e:
+                    print(f"[HouLai Metrics] 无法创建耗时日志: {e}")
+                _logger = logger
+    return _logger
+
+
+class TimedBody:
+    """
+    请求体包装: requests 以文件方式分块读取并发送，
+    第一次 read 记为上传开始，读到末尾记为上传结束
+    """
+
+    def __init__(self, data, timer):
+        self._data = data
+        self._pos = 0
+        self._timer = timer
+
+    def __len__(self):
+        return len(self._data)
+
+    def fork(self):
+        """重试 / 对冲请求各自需要一个从头读取的新实例"""
+        return TimedBody(self._data, self._timer)
+
+    def read(self, size=-1):
+        if self._pos == 0:
+            self._timer.mark("upload_start")
+        if size is None or size < 0:
+            size = len(self._data) - self._pos
+        chunk = self._data[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        if not chunk:
+            self._timer.mark("upload_end")
+        return chunk
+
+
+class PhaseTimer:
+    """
+    单次节点调用的耗时记录 (线程安全，可在后台线程中继续累计)
+
+    Args:
+        node: 节点名，写入日志；为 None 时 finish() 不写日志
+        **fields: 附加字段 (模型、分辨率等)
+    """
+
+    def __init__(self, node=None, **fields):
+        self.node = node
+        self.fields = dict(fields)
+        self.phases = {}
+        self.counters = {}
+        self._marks = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._t0 = time.monotonic()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def mark(self, name):
+        with self._lock:
+            self._marks[name] = time.monotonic()
+
+    # ----------------------------------------
+    # HTTP 请求分段
+    # ----------------------------------------
+    def instrument(self, body):
+        """
+        生成带计时的请求参数: send(..., **timer.instrument(body))
+
+        响应钩子在响应头到达时触发 (此时响应体尚未读取)，
+        据此把一次请求拆成 上传 / 首字节 / 下载 三段。
+        """
+        self.incr("payload_bytes", len(body))
+
+        def on_response(response, *args, **kwargs):
+            self.mark("headers")
+            self.incr("http_attempts")
+
+        return {"data": TimedBody(body, self), "hooks": {"response": on_response}}
+
+    def response_done(self, response=None):
+        """响应体读取完毕后调用，把最后一次尝试的标记换算成阶段耗时"""
+        now = time.monotonic()
+        with self._lock:
+            m = self._marks
+            if "upload_start" in m and "upload_end" in m:
+                self.phases["upload"] = self.phases.get("upload", 0.0) + m["upload_end"] - m["upload_start"]
+            if "headers" in m:
+                if "upload_end" in m:
+                    self.phases["ttfb"] = self.phases.get("ttfb", 0.0) + max(0.0, m["headers"] - m["upload_end"])
+                self.phases["download"] = self.phases.get("download", 0.0) + now - m["headers"]
+            self._marks = {}
+        if response is not None:
+            self.incr("response_bytes", len(response.content))
+
+    # ----------------------------------------
+    # 输出
+    # ----------------------------------------
+    def to_dict(self):
+        with self._lock:
+            record = {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+                "node": self.node,
+                "total": round(time.monotonic() - self._t0, 4),
+                "phases": {k: round(v, 4) for k, v in self.phases.items()},
+            }
+            record.update(self.counters)
+            record.update(self.fields)
+        return record
+
+    def finish(self, status="ok", **fields):
+        """
+        结束计时，写入滚动日志
+
+        Returns:
+            str: JSON 字符串 (作为节点的 timing 输出)
+        """
+        self.set(status=status, **fields)
+        line = json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+        if self.node:
+            _get_logger().info(line)
+        return line
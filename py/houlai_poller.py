@@ -0,0 +1,354 @@
+"""
+后来工具箱 - 自适应轮询
+
+云端绘图任务提交后需要轮询 /tasks/{id}。固定间隔轮询在 4K 长任务上浪费请求，
+在短任务结束时又平均多等半个间隔。PollSchedule 按以下信息决定下一次轮询的时间:
+1. 任务返回的进度 / 预计剩余时间字段
+2. 同一 模型 + 分辨率 历史完成耗时的 EWMA (持久化到缓存目录)
+3. 没有任何信息时按几何级数退避
+临近预计完成时间时加密轮询，所有间隔都带随机抖动，避免大量并发任务同时打到服务端。
+
+TaskPoller: 进程级轮询服务，所有节点登记的任务由同一个调度循环轮询，
+按 host 限制并发，任务成功后立即开始下载结果。
+"""
+
+import os
+import json
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from . import houlai_http
+from .houlai_cache import CACHE_ROOT
+from .houlai_metrics import PhaseTimer
+
+STATS_PATH = CACHE_ROOT / "poll_durations.json"
+
+# 进度 / 剩余时间字段 (不同中转站命名不一)
+PROGRESS_KEYS = ("progress", "percent", "percentage")
+ETA_KEYS = ("eta", "estimated_time", "remaining_time", "remaining_seconds")
+
+
+class DurationModel:
+    """
+    按 key (如 模型 + 分辨率) 记录任务完成耗时的指数加权平均
+
+    Args:
+        alpha: 新样本权重
+        path: 持久化文件，None 表示只保存在内存
+    """
+
+    def __init__(self, alpha=0.3, path=None):
+        self.alpha = alpha
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {}  # key -> {"ewma": 秒, "count": 样本数}
+        if path is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._stats = json.load(f)
+            except (OSError, ValueError):
+                self._stats = {}
+
+    def expected(self, key):
+        """预计完成耗时 (秒)，没有历史时返回 None"""
+        with self._lock:
+            entry = self._stats.get(key)
+            return entry["ewma"] if entry else None
+
+    def observe(self, key, seconds):
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                self._stats[key] = {"ewma": seconds, "count": 1}
+            else:
+                entry["ewma"] = (1 - self.alpha) * entry["ewma"] + self.alpha * seconds
+                entry["count"] += 1
+            snapshot = json.dumps(self._stats, ensure_ascii=False)
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(snapshot, encoding="utf-8")
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"[HouLai Poller] 保存耗时统计失败: {e}")
+
+
+DURATIONS = DurationModel(path=STATS_PATH)
+
+
+def extract_progress(item):
+    """
+    从任务状态中取出 (进度 0~1, 预计剩余秒数)，字段不存在时为 None
+    """
+    progress = eta = None
+    for key in PROGRESS_KEYS:
+        value = item.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            progress = value / 100.0 if value > 1 else float(value)
+            break
+    for key in ETA_KEYS:
+        value = item.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+            eta = float(value)
+            break
+    return progress, eta
+
+
+class PollSchedule:
+    """
+    单个任务的轮询节奏
+
+    Args:
+        expected: 预计完成耗时 (秒)，通常来自 DURATIONS.expected()
+        min_interval / max_interval: 轮询间隔上下限
+        jitter: 随机抖动比例 (0.2 = ±20%)
+    """
+
+    def __init__(self, expected=None, min_interval=1.0, max_interval=15.0, jitter=0.2):
+        self.expected = expected
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self._idle = 0     # 没有任何信息时的退避次数
+        self._overrun = 0  # 超过预计完成时间后的轮询次数
+
+    def _clamp(self, delay):
+        return max(self.min_interval, min(self.max_interval, delay))
+
+    def _jittered(self, delay):
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(self.min_interval * (1 - self.jitter), delay)
+
+    def next_delay(self, elapsed, progress=None, eta=None):
+        """
+        根据已等待时间和最新状态计算下一次轮询前的等待秒数
+
+        Args:
+            elapsed: 提交后已经过的秒数
+            progress: 任务进度 0~1 (可选)
+            eta: 服务端给出的预计剩余秒数 (可选)
+        """
+        remaining = None
+        if eta is not None:
+            remaining = eta
+        elif progress is not None and 0 < progress < 1 and elapsed > 0:
+            remaining = elapsed * (1 - progress) / progress
+        elif self.expected is not None:
+            remaining = self.expected - elapsed
+
+        if remaining is not None and remaining > 0:
+            # 离完成越近轮询越密: 每次只等剩余时间的一半
+            self._overrun = 0
+            delay = self._clamp(remaining / 2)
+        elif remaining is not None:
+            # 已超过预计时间: 先密集轮询，再逐步放缓
+            delay = self._clamp(self.min_interval * (1.5 ** self._overrun))
+            self._overrun += 1
+        else:
+            delay = self._clamp(self.min_interval * 2 * (1.5 ** self._idle))
+            self._idle += 1
+        return self._jittered(delay)
+
+    def error_delay(self, consecutive_errors):
+        """轮询出错 (网络异常 / 非 200) 时的指数退避"""
+        delay = min(self.max_interval * 2, self.min_interval * 2 * (2 ** (consecutive_errors - 1)))
+        return self._jittered(delay)
+
+
+# ============================================
+# 进程级多路轮询器
+# ============================================
+class _PollTask:
+    def __init__(self, task_id, poll_url, parse, headers, timeout, duration_key, on_success, timer, verify):
+        self.task_id = task_id
+        self.poll_url = poll_url
+        self.host = urlsplit(poll_url).netloc
+        self.parse = parse
+        self.headers = headers or {}
+        self.duration_key = duration_key
+        self.on_success = on_success
+        self.timer = timer
+        self.verify = verify
+        self.started = time.time()
+        self.deadline = self.started + timeout
+        self.schedule = PollSchedule(expected=DURATIONS.expected(duration_key) if duration_key else None)
+        self.fail_count = 0
+        self.last_error = ""
+        self.future = Future()
+
+
+class TaskPoller:
+    """
+    一个后台线程轮询所有未完成的任务
+
+    节点调用 register() 登记任务并拿到 Future，所有任务共享同一个调度循环:
+    - 每个任务按自己的 PollSchedule 决定下一次轮询时间
+    - 同一 host 同时在途的轮询请求不超过 max_per_host
+    - 任务成功后立即在下载线程池中执行 on_success (如下载结果图)，不等其它任务
+
+    Future 结果: (status, result, raw_response, payload)
+        status: succeeded / failed / timeout / network_error
+        result: parse 返回的结果 (如图片地址)
+        payload: on_success 的返回值
+    """
+
+    def __init__(self, max_per_host=4, workers=16):
+        self.max_per_host = max_per_host
+        self._heap = []  # (到期时间, 序号, 任务)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._inflight = defaultdict(int)   # host -> 在途请求数
+        self._waiting = defaultdict(deque)  # host -> 已到期但受并发限制的任务
+        self._pending = 0
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="houlai_poll")
+        self._download_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="houlai_download")
+
+    def register(self, task_id, poll_url, parse, headers=None, timeout=600, duration_key=None,
+                 on_success=None, timer=None, verify=True):
+        """
+        登记一个待轮询任务
+
+        Args:
+            parse: parse(poll_json) -> (state, progress, eta, result)，
+                   state 为 running / succeeded / failed
+            duration_key: 历史耗时统计的 key (如 "模型|分辨率")
+            on_success: 成功后在下载线程池中执行 on_success(result)
+            timer: houlai_metrics.PhaseTimer，累计 polls / poll_wait
+
+        Returns:
+            concurrent.futures.Future
+        """
+        task = _PollTask(task_id, poll_url, parse, headers, timeout, duration_key, on_success,
+                         timer or PhaseTimer(), verify)
+        with self._cond:
+            self._pending += 1
+            self._push(task, task.schedule.next_delay(0))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="houlai_poller", daemon=True)
+                self._thread.start()
+        return task.future
+
+    def pending_count(self):
+        with self._cond:
+            return self._pending
+
+    # ----------------------------------------
+    # 调度
+    # ----------------------------------------
+    def _push(self, task, delay):
+        """调用方需持有 self._cond"""
+        # 最后一次轮询卡在期限上
+        due = min(time.time() + delay, task.deadline)
+        heapq.heappush(self._heap, (due, next(self._seq), task))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                now = time.time()
+                single = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, task = heapq.heappop(self._heap)
+                    if self._inflight[task.host] < self.max_per_host:
+                        self._inflight[task.host] += 1
+                        single.append(task)
+                    else:
+                        self._waiting[task.host].append(task)
+            for task in single:
+                self._pool.submit(self._poll_one, task)
+
+    def _release(self, host):
+        with self._cond:
+            self._inflight[host] -= 1
+            waiting = self._waiting[host]
+            if waiting:
+                # 空出的名额立即交给排队的任务
+                heapq.heappush(self._heap, (time.time(), next(self._seq), waiting.popleft()))
+                self._cond.notify()
+
+    # ----------------------------------------
+    # 轮询
+    # ----------------------------------------
+    def _poll_one(self, task):
+        try:
+            task.timer.incr("polls")
+            res = houlai_http.get(task.poll_url, headers=task.headers, timeout=10, verify=task.verify)
+            if res.status_code == 200:
+                self._handle(task, res.json())
+            else:
+                self._handle_error(task, f"HTTP {res.status_code}")
+        except Exception as e:
+            self._handle_error(task, str(e)[:100])
+        finally:
+            self._release(task.host)
+
+    def _handle(self, task, data):
+        try:
+            state, progress, eta, result = task.parse(data)
+        except Exception as e:
+            self._handle_error(task, f"状态解析失败: {e}")
+            return
+        task.fail_count = 0
+        elapsed = time.time() - task.started
+        progress_text = f", 进度 {progress:.0%}" if progress is not None else ""
+        print(f"  ... [{task.task_id}] 状态: {state} ({int(elapsed)}s{progress_text})")
+        raw = json.dumps(data, ensure_ascii=False)
+        if state == "succeeded":
+            if task.duration_key:
+                DURATIONS.observe(task.duration_key, elapsed)
+            task.timer.add("poll_wait", elapsed)
+            if task.on_success is None:
+                self._resolve(task, ("succeeded", result, raw, None))
+            else:
+                self._download_pool.submit(self._run_on_success, task, result, raw)
+        elif state == "failed":
+            task.timer.add("poll_wait", elapsed)
+            self._resolve(task, ("failed", result, raw, None))
+        else:
+            self._reschedule(task, task.schedule.next_delay(elapsed, progress, eta))
+
+    def _handle_error(self, task, error):
+        task.fail_count += 1
+        task.last_error = error
+        print(f"⚠️ [{task.task_id}] 轮询失败 ({task.fail_count}): {error}")
+        self._reschedule(task, task.schedule.error_delay(task.fail_count))
+
+    def _reschedule(self, task, delay):
+        if time.time() >= task.deadline:
+            task.timer.add("poll_wait", time.time() - task.started)
+            if task.fail_count:
+                # 期限内一直连不上，多半是代理 / 网络问题
+                raw = json.dumps({"status": "timeout", "error": task.last_error}, ensure_ascii=False)
+                self._resolve(task, ("network_error", None, raw, None))
+            else:
+                self._resolve(task, ("timeout", None, json.dumps({"status": "timeout"}), None))
+            return
+        with self._cond:
+            self._push(task, delay)
+
+    def _run_on_success(self, task, result, raw):
+        try:
+            payload = task.on_success(result)
+        except Exception as e:
+            print(f"❌ [{task.task_id}] 结果处理失败: {e}")
+            payload = None
+        self._resolve(task, ("succeeded", result, raw, payload))
+
+    def _resolve(self, task, outcome):
+        with self._cond:
+            self._pending -= 1
+        task.future.set_result(outcome)
+
+
+POLLER = TaskPoller(max_per_host=int(os.environ.get("HOULAI_POLL_PER_HOST", "4")))
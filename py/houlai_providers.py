@@ -0,0 +1,309 @@
+"""
+后来工具箱 - 多端点 / 多 Key 负载均衡
+
+ProviderPool 保存若干 (接口地址, API Key, 权重)，每次请求按
+  权重 × 延迟 × 错误率 × 剩余额度 × 在途请求数
+打分后按分数加权随机选择一个端点；出错时自动换下一个端点重试，
+429 / 额度耗尽的端点按 Retry-After 暂停使用。
+
+🔑 后来_API端点池 节点输出 PROVIDER_POOL，连接到云端绘图 / Gemini 节点即可启用；
+没有配置任何端点时输出 None，节点使用自己的默认地址和 Key。
+"""
+
+import time
+import random
+import threading
+
+from .houlai_cache import hash_key
+from .houlai_http import parse_retry_after
+
+# 剩余额度响应头 (不同服务商命名不一)
+QUOTA_HEADERS = ("x-ratelimit-remaining-requests", "x-ratelimit-remaining", "ratelimit-remaining")
+
+# 连续失败后暂停使用的秒数上限
+MAX_COOLDOWN = 300.0
+
+# 选中的端点仍在冷却时最多等待的秒数，冷却更久时直接报错，不长时间占用执行线程
+MAX_COOLDOWN_WAIT = 10.0
+
+
+class Provider:
+    """
+    单个端点的配置与实时统计
+
+    Args:
+        base_url: 接口地址 (含义由使用它的节点决定)
+        api_key: API Key
+        weight: 静态权重 (如按额度比例设置)
+        name: 日志中显示的名称
+    """
+
+    def __init__(self, base_url, api_key, weight=1.0, name=""):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.weight = max(0.01, float(weight))
+        self.name = name or f"{self.base_url.split('//')[-1].split('/')[0]}#{api_key[-4:]}"
+        self.latency = None       # EWMA 延迟 (秒)
+        self.error_rate = 0.0     # EWMA 错误率
+        self.remaining = None     # 最近一次响应头中的剩余额度
+        self.cooldown_until = 0.0
+        self.failures = 0         # 连续失败次数
+        self.inflight = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def score(self, default_latency):
+        latency = self.latency if self.latency is not None else default_latency
+        score = self.weight / (max(latency, 0.05) * (1 + self.inflight))
+        score *= (1.0 - self.error_rate) ** 2 + 0.01
+        if self.remaining is not None and self.remaining < 5:
+            # 额度快用完时降低优先级，等响应头刷新后恢复
+            score *= 0.1 * (self.remaining + 1)
+        return score
+
+    def observe_headers(self, headers):
+        """从响应头更新剩余额度"""
+        if headers is None:
+            return
+        for key in QUOTA_HEADERS:
+            value = headers.get(key)
+            if value is None:
+                continue
+            try:
+                with self._lock:
+                    self.remaining = int(float(value))
+            except ValueError:
+                pass
+            break
+
+    def record(self, seconds, ok, status_code=None, retry_after=None, alpha=0.2):
+        with self._lock:
+            self.requests += 1
+            if ok:
+                self.latency = seconds if self.latency is None else (1 - alpha) * self.latency + alpha * seconds
+                self.error_rate *= 1 - alpha
+                self.failures = 0
+                return
+            self.error_rate = (1 - alpha) * self.error_rate + alpha
+            self.failures += 1
+            if status_code == 429 or retry_after is not None:
+                cooldown = retry_after if retry_after is not None else 30.0
+            else:
+                cooldown = min(MAX_COOLDOWN, 2.0 ** self.failures)
+            self.cooldown_until = max(self.cooldown_until, time.time() + min(cooldown, MAX_COOLDOWN))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "weight": self.weight,
+                "latency": round(self.latency, 3) if self.latency is not None else None,
+                "error_rate": round(self.error_rate, 3),
+                "remaining": self.remaining,
+                "cooling": max(0.0, round(self.cooldown_until - time.time(), 1)),
+                "requests": self.requests,
+            }
+
+
+class ProviderError(Exception):
+    """
+    端点级错误，可以换一个端点重试
+
+    Args:
+        status_code: HTTP 状态码 (网络异常时为 None)
+        retry_after: 服务端要求的等待秒数
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        """网络错误、鉴权失败 (换 Key)、限流和服务端错误可以换端点；请求本身有误 (400 等) 不行"""
+        code = self.status_code
+        return code is None or code in (401, 403, 408, 429) or code >= 500
+
+
+class NoProviderAvailable(ProviderError):
+    """所有端点都已尝试或处于冷却中 (retry_after 为最早恢复的剩余秒数)"""
+
+
+def _wait_cooldown(seconds):
+    """等待端点冷却结束，期间响应 ComfyUI 的中断"""
+    try:
+        import comfy.model_management as model_management
+    except ImportError:
+        model_management = None
+    deadline = time.monotonic() + seconds
+    while True:
+        if model_management is not None:
+            model_management.throw_exception_if_processing_interrupted()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(0.25, remaining))
+
+
+class ProviderPool:
+    """一组可互相替代的端点"""
+
+    def __init__(self, providers):
+        if not providers:
+            raise ValueError("端点池为空")
+        self.providers = list(providers)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.providers)
+
+    def choose(self, exclude=()):
+        """
+        按分数加权随机选择一个可用端点 (并计入在途请求)
+
+        Raises:
+            NoProviderAvailable: 除 exclude 外的端点都在冷却中
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [p for p in self.providers if p not in exclude]
+            if not candidates:
+                raise NoProviderAvailable("所有端点都已尝试过")
+            ready = [p for p in candidates if p.cooldown_until <= now]
+            if not ready:
+                # 全部在冷却中: 选最早恢复的那个，总比直接失败好
+                ready = [min(candidates, key=lambda p: p.cooldown_until)]
+            known = [p.latency for p in ready if p.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            scores = [p.score(default_latency) for p in ready]
+            provider = random.choices(ready, weights=scores)[0]
+            provider.inflight += 1
+        return provider
+
+    def release(self, provider):
+        with self._lock:
+            provider.inflight -= 1
+
+    def call(self, fn, max_attempts=None):
+        """
+        选择端点执行 fn(provider)，遇到 ProviderError 自动换下一个端点
+
+        Args:
+            max_attempts: 最多尝试的端点数 (默认尝试全部端点)
+
+        Returns:
+            fn 的返回值
+        """
+        max_attempts = max_attempts or len(self.providers)
+        tried = []
+        last_error = None
+        for _ in range(min(max_attempts, len(self.providers))):
+            provider = self.choose(exclude=tried)
+            tried.append(provider)
+            cooling = provider.cooldown_until - time.time()
+            if cooling > MAX_COOLDOWN_WAIT:
+                # 可用端点都在长时间冷却中 (choose 只在没有就绪端点时才会选到冷却中的端点)
+                self.release(provider)
+                raise NoProviderAvailable(f"所有端点都在冷却中，最早 {cooling:.0f}s 后恢复",
+                                          retry_after=cooling) from last_error
+            try:
+                if cooling > 0:
+                    _wait_cooldown(cooling)
+                start = time.monotonic()
+                result = fn(provider)
+            except ProviderError as e:
+                if not e.retryable:
+                    # 请求本身的问题，与端点好坏无关
+                    raise
+                provider.record(time.monotonic() - start, False, e.status_code, e.retry_after)
+                print(f"[HouLai Providers] {provider.name} 失败 ({e})，切换端点")
+                last_error = e
+                continue
+            finally:
+                self.release(provider)
+            provider.record(time.monotonic() - start, True)
+            return result
+        raise last_error
+
+    def stats(self):
+        return [p.stats() for p in self.providers]
+
+
+def retry_after_from(response):
+    """从响应头读取 Retry-After (秒)"""
+    return parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+
+
+# 相同配置复用同一个端点池，统计数据在多次执行之间保留
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def parse_provider_lines(text):
+    """
+    解析端点配置，每行一个端点:
+        接口地址 | API Key | 权重(可选) | 名称(可选)
+    空行和 # 开头的行被忽略
+    """
+    providers = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            raise ValueError(f"端点配置格式错误 (应为 地址 | Key | 权重): {line}")
+        weight = float(fields[2]) if len(fields) > 2 and fields[2] else 1.0
+        name = fields[3] if len(fields) > 3 else ""
+        providers.append((fields[0], fields[1], weight, name))
+    return providers
+
+
+def get_pool(text):
+    """按配置内容获取 (或创建) 端点池，没有配置端点时返回 None (使用节点默认地址)"""
+    specs = parse_provider_lines(text)
+    if not specs:
+        return None
+    key = hash_key("providers", specs)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ProviderPool([Provider(*spec) for spec in specs])
+            _pools[key] = pool
+    return pool
+
+
+class HouLai_Provider_Pool:
+    """
+    后来 - API 端点池
+
+    把多个中转地址 / API Key 组合成一个池，连接到云端绘图或 Gemini 节点后，
+    请求按实测延迟、错误率和剩余额度分配，单个端点出错时自动切换。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "providers": ("STRING", {
+                    "multiline": True,
+                    "default": "# 每行一个端点: 接口地址 | API Key | 权重 | 名称\n",
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("PROVIDER_POOL", "STRING")
+    RETURN_NAMES = ("provider_pool", "stats")
+    FUNCTION = "build"
+    CATEGORY = "后来/API工具"
+
+    def build(self, providers):
+        pool = get_pool(providers)
+        if pool is None:
+            print("🔑 [后来API] 端点池未配置端点，使用各节点的默认地址和 Key")
+            return (None, "未配置端点，使用节点默认地址")
+        lines = [f"{s['name']}: 权重 {s['weight']}, 延迟 {s['latency']}, 错误率 {s['error_rate']}, "
+                 f"剩余额度 {s['remaining']}, 请求数 {s['requests']}" for s in pool.stats()]
+        print(f"🔑 [后来API] 端点池: {len(pool)} 个端点")
+        return (pool, "\n".join(lines))
@@ -0,0 +1,282 @@
+"""
+后来工具箱 - 进程级自适应限流
+
+同一个 (host, API Key) 的所有请求 —— 不管来自哪个节点实例、哪个线程 —— 共用一个限流器:
+- 令牌桶限制请求速率；默认不限制并发 (由各节点自己的并发设置决定)，被限流后才临时收紧并发
+- 从响应头 (x-ratelimit-remaining / reset、RateLimit-*) 推算可持续速率，始终略低于配额
+- 遇到 429 / Retry-After 时整个 Key 暂停到指定时间，速率和并发减半，之后逐步回升 (AIMD)
+
+大批量任务时，平稳地贴着配额发送比"一起冲上去再集体退避"的有效吞吐更高。
+"""
+
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from .houlai_cache import hash_key
+from .houlai_http import parse_retry_after
+
+# 初始速率 (请求/秒)、速率上限、单个 Key 的并发上限 (0 = 不限制)，可用环境变量调整
+DEFAULT_RATE = float(os.environ.get("HOULAI_RATE_LIMIT", "5"))
+MAX_RATE = float(os.environ.get("HOULAI_RATE_LIMIT_MAX", "20"))
+MAX_CONCURRENCY = int(os.environ.get("HOULAI_RATE_MAX_CONCURRENCY", "0"))
+
+MIN_RATE = 0.05      # 最低每 20 秒一个请求
+SAFETY = 0.9         # 按响应头推算速率时预留的余量
+LIMITED_STATUSES = (429, 503)
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RateLimitTimeout(TimeoutError):
+    """在指定时间内没有拿到令牌"""
+
+
+def parse_reset(value):
+    """
+    解析配额重置时间，返回距离现在的秒数
+
+    兼容纯秒数、Unix 时间戳和 OpenAI 风格的 "6m0s" / "20ms"
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        parts = _DURATION_RE.findall(value)
+        if not parts:
+            return None
+        return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts)
+    # 大于 10 年的秒数只可能是时间戳
+    if seconds > 315360000:
+        seconds -= time.time()
+    return max(0.0, seconds)
+
+
+def _header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class RateLimiter:
+    """
+    单个 (host, API Key) 的令牌桶 + 并发限制
+
+    Args:
+        name: 日志中显示的名称
+        rate: 初始速率 (请求/秒)
+        max_rate: 速率上限
+        max_concurrency: 并发上限，0 = 不限制 (被限流后临时收紧，恢复后解除)
+    """
+
+    def __init__(self, name, rate=DEFAULT_RATE, max_rate=MAX_RATE, max_concurrency=MAX_CONCURRENCY):
+        self.name = name
+        self.max_rate = max(MIN_RATE, max_rate)
+        self.rate = min(max(MIN_RATE, rate), self.max_rate)
+        self.ceiling = self.max_rate        # 最近一次被限流时学到的速率上限，成功后缓慢上探
+        self.max_concurrency = max_concurrency if max_concurrency and max_concurrency > 0 else None
+        self.concurrency = self.max_concurrency   # None = 不限制
+        self._limited_concurrency = None    # 被限流时的在途请求数，收紧后回升到该值即解除临时上限
+        self._cap_logged = False
+        self.tokens = self.burst
+        self.inflight = 0
+        self.paused_until = 0.0
+        self.limited = 0                    # 收到 429 的次数
+        self.waited = 0.0                   # 累计排队等待秒数
+        self._successes = 0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def burst(self):
+        """桶容量: 约 1 秒的量，至少 1 个"""
+        return max(1.0, self.rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """
+        等待一个令牌和一个并发名额
+
+        Returns:
+            float: 排队等待的秒数
+
+        Raises:
+            RateLimitTimeout: timeout 秒内没有拿到
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.concurrency is not None and self.inflight >= self.concurrency:
+                    delay = None  # 等其它请求 release
+                    if not self._cap_logged:
+                        self._cap_logged = True
+                        reason = "HOULAI_RATE_MAX_CONCURRENCY" if self.max_concurrency else "被限流后临时收紧"
+                        print(f"⏳ [HouLai RateLimit] {self.name} 在途请求达到并发上限 {self.concurrency} "
+                              f"({reason})，后续请求排队")
+                elif now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.tokens < 1:
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.inflight += 1
+                    waited = now - start
+                    self.waited += waited
+                    return waited
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise RateLimitTimeout(f"{self.name}: 等待限流超时 ({timeout}s)")
+                    delay = remaining if delay is None else min(delay, remaining)
+                self._cond.wait(delay)
+
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timer=None):
+        """
+        with limiter.slot(timer): 发请求
+
+        timer: houlai_metrics.PhaseTimer，排队时间记为 rate_wait
+        """
+        waited = self.acquire()
+        if timer is not None and waited > 0.001:
+            timer.add("rate_wait", waited)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def observe(self, response=None, status_code=None, headers=None):
+        """根据响应状态码和限流响应头调整速率 (可直接传 response，或分别传状态码和响应头)"""
+        if response is not None:
+            status_code = response.status_code
+            headers = response.headers
+        headers = headers if headers is not None else {}
+        now = time.monotonic()
+        with self._cond:
+            if status_code in LIMITED_STATUSES:
+                self._on_limited(now, parse_retry_after(headers.get("Retry-After")), status_code)
+            elif status_code is not None and status_code < 400:
+                self._on_success()
+            self._apply_headers(now, headers)
+            self._cond.notify_all()
+
+    def observe_error(self, error):
+        """从 SDK 抛出的异常 (如 openai.RateLimitError) 中取状态码和响应头"""
+        response = getattr(error, "response", None)
+        status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        if status_code is not None:
+            self.observe(status_code=status_code, headers=getattr(response, "headers", None))
+
+    def _on_limited(self, now, retry_after, status_code):
+        self.limited += 1
+        self._successes = 0
+        # 记住被限流时的速率，之后回升不超过它
+        self.ceiling = max(MIN_RATE, min(self.ceiling, self.rate) * SAFETY)
+        self.rate = max(MIN_RATE, self.rate / 2)
+        current = self.concurrency if self.concurrency is not None else max(1, self.inflight)
+        if self._limited_concurrency is None:
+            self._limited_concurrency = current
+        self.concurrency = max(1, current // 2)
+        self._cap_logged = False
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else 1.0 / self.rate
+        if now + pause > self.paused_until:
+            self.paused_until = now + pause
+            print(f"⏸️ [HouLai RateLimit] {self.name} 被限流 (HTTP {status_code})，暂停 {pause:.1f}s，"
+                  f"速率降到 {self.rate:.2f}/s，并发 {self.concurrency}")
+
+    def _on_success(self):
+        # 逐步回升: 速率每次成功 +5% (不超过学到的上限)，并发每连续成功 concurrency 次 +1
+        self.ceiling = min(self.max_rate, self.ceiling * 1.01)
+        self.rate = min(self.ceiling, self.rate + max(MIN_RATE, self.rate * 0.05))
+        self._successes += 1
+        if self.concurrency is None or self._successes < self.concurrency:
+            return
+        self._successes = 0
+        self._cap_logged = False
+        self.concurrency += 1
+        if self.max_concurrency is not None:
+            self.concurrency = min(self.concurrency, self.max_concurrency)
+            if self.concurrency == self.max_concurrency:
+                self._limited_concurrency = None
+        elif self.concurrency >= (self._limited_concurrency or 1):
+            # 已回升到被限流时的并发，解除临时上限
+            self.concurrency = None
+            self._limited_concurrency = None
+
+    def _apply_headers(self, now, headers):
+        remaining = _header(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining",
+                            "ratelimit-remaining")
+        reset = parse_reset(_header(headers, "x-ratelimit-reset-requests", "x-ratelimit-reset",
+                                    "ratelimit-reset"))
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = float(remaining)
+        except ValueError:
+            return
+        if remaining <= 0:
+            # 本窗口额度已用完，等到重置
+            self.paused_until = max(self.paused_until, now + reset)
+            return
+        # 剩余额度均匀摊到重置前的时间里，且不超过被限流后学到的上限 (不撤销 AIMD 的退避)
+        sustainable = SAFETY * remaining / max(reset, 0.1)
+        self.rate = min(self.ceiling, max(MIN_RATE, sustainable))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "name": self.name,
+                "rate": round(self.rate, 3),
+                "concurrency": self.concurrency,
+                "inflight": self.inflight,
+                "limited": self.limited,
+                "waited": round(self.waited, 3),
+                "paused": max(0.0, round(self.paused_until - time.monotonic(), 1)),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url, api_key=""):
+    """
+    按 host + API Key 获取共享限流器 (Key 只保存哈希)
+
+    同一服务商的配额通常按 Key 计算，与具体接口路径无关
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}".lower()
+    key = hash_key(host, api_key or "")
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            suffix = f"#{api_key[-4:]}" if api_key else ""
+            limiter = _limiters[key] = RateLimiter(f"{parts.netloc}{suffix}")
+    return limiter
+
+
+def stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
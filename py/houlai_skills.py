@@ -0,0 +1,432 @@
+"""
+后来工具箱 - 技能库索引
+
+skills/*.yaml 中每个顶层 key 是一个技能 (name / description / category / template)。
+SkillRegistry 把所有技能解析一次放进内存索引:
+- 按文件 mtime + 大小增量重载，只重新解析改动过的文件，删除的文件从索引移除
+- 模板在加载时校验 (占位符只能是 {platform} / {selling_points} / {batch_count})，坏模板不会进入下拉列表
+- 解析结果持久化到 cache/，冷启动时未改动的文件不再解析 YAML
+- 倒排索引 (SkillSearchIndex) 覆盖 名称 / Key / 分类 / 描述 / 模板，BM25 排序，随文件变化增量更新
+"""
+
+import os
+import re
+import json
+import math
+import time
+import bisect
+import string
+import threading
+from pathlib import Path
+from collections import Counter, defaultdict
+
+import yaml
+
+from .houlai_cache import CACHE_ROOT, hash_key
+
+# 模板可用的占位符
+TEMPLATE_FIELDS = ("platform", "selling_points", "batch_count")
+
+# 两次检查文件 mtime 的最小间隔 (INPUT_TYPES 会被频繁调用)
+REFRESH_INTERVAL = 2.0
+
+INDEX_VERSION = 1
+
+# 各字段在检索中的权重 (名称 / Key 命中远比模板正文命中重要)
+FIELD_WEIGHTS = {"name": 3.0, "key": 2.5, "category": 2.0, "description": 1.5, "file": 1.0, "template": 0.3}
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 模糊匹配: 前缀命中 / 编辑距离命中的得分折扣，以及单个查询词最多扩展的词数
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.6
+MAX_EXPANSIONS = 20
+
+# 查询原文整体出现在名称 / Key 中时的得分倍数
+PHRASE_BOOST = 2.0
+
+# 结果至少要命中的查询词比例 (避免只命中一两个常见字的无关技能顶替默认选择)
+MIN_MATCH_RATIO = 0.5
+
+_CAMEL_RE = re.compile(r"([a-z0-9])([A-Z])")
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def validate_template(template):
+    """
+    检查模板能否 format
+
+    Returns:
+        错误信息，合法时返回 None
+    """
+    if not isinstance(template, str) or not template.strip():
+        return "缺少 template"
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError as e:
+        return f"模板格式错误: {e}"
+    unknown = fields - set(TEMPLATE_FIELDS)
+    if unknown:
+        return f"未知占位符: {', '.join(sorted(unknown))} (转义大括号请写成 {{{{ }}}})"
+    return None
+
+
+def parse_skill_file(path):
+    """
+    解析一个技能文件
+
+    Returns:
+        技能列表 (按文件中的顺序)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    if not isinstance(data, dict):
+        return []
+    stem = Path(path).stem
+    skills = []
+    for key, value in data.items():
+        skill_id = f"{stem} - {key}"
+        if not isinstance(value, dict):
+            print(f"[Skill Registry] 跳过 {skill_id}: 不是有效的技能配置")
+            continue
+        error = validate_template(value.get("template"))
+        if error:
+            print(f"[Skill Registry] 跳过 {skill_id}: {error}")
+            continue
+        skills.append({
+            "id": skill_id,
+            "file": stem,
+            "key": str(key),
+            "name": str(value.get("name") or key),
+            "category": str(value.get("category") or ""),
+            "description": str(value.get("description") or ""),
+            "template": value["template"],
+        })
+    return skills
+
+
+def tokenize(text, query=False):
+    """
+    分词: 英文 / 数字按单词切分 (含 CamelCase / 下划线)，中文按单字 + 相邻二字切分
+
+    "Lipstick_Detail 口红详情" -> lipstick, detail, 口, 红, 详, 情, 口红, 红详, 详情
+
+    query=True 时中文只取二字词 (单字噪声太大)，只有单个汉字时才用单字。
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(_CAMEL_RE.sub(r"\1 \2", text or "").lower()):
+        if run.isascii():
+            tokens.append(run)
+            continue
+        if not query or len(run) == 1:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _within_distance(a, b, limit):
+    """a、b 的编辑距离是否不超过 limit (按行提前结束)"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+class SkillSearchIndex:
+    """
+    技能倒排索引 (BM25 排序)
+
+    按技能增删，文件变化时只更新该文件内的技能；调用方负责加锁。
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(dict)  # 词 -> {技能 id: 加权词频}
+        self._docs = {}                     # 技能 id -> (词频表, 文档长度, 短语匹配文本)
+        self._total_length = 0.0
+        self._vocab = None                  # 英文词表 (排序后，用于前缀 / 模糊匹配)，变化时失效
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, skill):
+        skill_id = skill["id"]
+        if skill_id in self._docs:
+            self.remove(skill_id)
+        weights = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(skill.get(field, "")):
+                weights[token] += weight
+        length = sum(weights.values())
+        for token, tf in weights.items():
+            self._postings[token][skill_id] = tf
+        phrase = " ".join((skill["id"], skill.get("name", ""), skill.get("key", ""))).lower()
+        self._docs[skill_id] = (weights, length, phrase)
+        self._total_length += length
+        self._vocab = None
+
+    def remove(self, skill_id):
+        doc = self._docs.pop(skill_id, None)
+        if doc is None:
+            return
+        weights, length, _ = doc
+        for token in weights:
+            posting = self._postings[token]
+            posting.pop(skill_id, None)
+            if not posting:
+                del self._postings[token]
+        self._total_length -= length
+        self._vocab = None
+
+    def clear(self):
+        self.__init__()
+
+    def _expand(self, term):
+        """
+        查询词不在词表中时的模糊扩展 (仅英文词)
+
+        Returns:
+            [(词, 得分系数), ...]
+        """
+        if not term.isascii() or len(term) < 3:
+            return []
+        if self._vocab is None:
+            self._vocab = sorted(t for t in self._postings if t.isascii())
+        matches = []
+        # 前缀: 输入到一半的词 ("lipst" -> lipstick)
+        i = bisect.bisect_left(self._vocab, term)
+        while i < len(self._vocab) and self._vocab[i].startswith(term) and len(matches) < MAX_EXPANSIONS:
+            matches.append((self._vocab[i], PREFIX_FACTOR))
+            i += 1
+        if matches:
+            return matches
+        # 拼写错误: 短词允许 1 处、长词允许 2 处编辑
+        limit = 1 if len(term) <= 5 else 2
+        for word in self._vocab:
+            if _within_distance(term, word, limit):
+                matches.append((word, FUZZY_FACTOR))
+                if len(matches) >= MAX_EXPANSIONS:
+                    break
+        return matches
+
+    def search(self, query, top_k=10, order=None):
+        """
+        Args:
+            query: 关键词 (中英文均可)
+            top_k: 返回条数
+            order: 技能 id -> 序号，同分时按下拉列表顺序
+
+        Returns:
+            [(技能 id, 得分), ...] 按得分从高到低
+        """
+        terms = Counter(tokenize(query, query=True))
+        if not terms or not self._docs:
+            return []
+        count = len(self._docs)
+        average = self._total_length / count or 1.0
+        scores = defaultdict(float)
+        matched = defaultdict(set)   # 技能 id -> 命中的查询词
+        for term, qtf in terms.items():
+            expansions = [(term, 1.0)] if term in self._postings else self._expand(term)
+            for token, factor in expansions:
+                posting = self._postings[token]
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for skill_id, tf in posting.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._docs[skill_id][1] / average)
+                    scores[skill_id] += factor * qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched[skill_id].add(term)
+
+        required = math.ceil(len(terms) * MIN_MATCH_RATIO)
+        phrase = query.strip().lower()
+        for skill_id in list(scores):
+            if len(matched[skill_id]) < required:
+                del scores[skill_id]
+            elif phrase in self._docs[skill_id][2]:
+                scores[skill_id] *= PHRASE_BOOST
+
+        order = order or {}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], order.get(item[0], 0)))
+        return ranked[:top_k]
+
+
+class SkillRegistry:
+    """
+    一个技能目录的内存索引
+
+    Args:
+        directory: 技能目录
+        index_path: 持久化索引路径 (默认按目录路径存放在 cache/ 下)
+    """
+
+    def __init__(self, directory, index_path=None):
+        self.directory = Path(directory)
+        self.index_path = Path(index_path) if index_path else \
+            CACHE_ROOT / f"skills_index_{hash_key(str(self.directory.absolute()))[:16]}.json"
+        self._files = {}    # 文件名 -> {"mtime_ns", "size", "skills"}
+        self._skills = {}   # 技能 id -> 技能
+        self._order = []    # 下拉列表顺序
+        self._positions = {}  # 技能 id -> 下拉列表序号
+        self._search_index = SkillSearchIndex()
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self.parsed = 0     # 累计解析过的文件数
+        self._load_index()
+
+    # ----------------------------------------
+    # 持久化索引
+    # ----------------------------------------
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != INDEX_VERSION or data.get("directory") != str(self.directory.absolute()):
+            return
+        self._files = data.get("files", {})
+        for entry in self._files.values():
+            for skill in entry["skills"]:
+                self._search_index.add(skill)
+        self._rebuild()
+
+    def _save_index(self):
+        data = {"version": INDEX_VERSION, "directory": str(self.directory.absolute()), "files": self._files}
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            print(f"[Skill Registry] 保存索引失败: {e}")
+
+    def _rebuild(self):
+        """重建 id 表和下拉列表顺序 (检索索引由 _replace_file 增量维护)"""
+        self._skills = {}
+        self._order = []
+        for name in sorted(self._files):
+            for skill in self._files[name]["skills"]:
+                self._skills[skill["id"]] = skill
+                self._order.append(skill["id"])
+        self._positions = {skill_id: i for i, skill_id in enumerate(self._order)}
+
+    def _replace_file(self, name, entry):
+        """替换 (entry 为 None 时移除) 一个文件的技能，同步更新检索索引"""
+        old = self._files.pop(name, None)
+        if old:
+            for skill in old["skills"]:
+                self._search_index.remove(skill["id"])
+        if entry is not None:
+            self._files[name] = entry
+            for skill in entry["skills"]:
+                self._search_index.add(skill)
+
+    # ----------------------------------------
+    # 增量刷新
+    # ----------------------------------------
+    def refresh(self, force=False):
+        """
+        按 mtime / 大小检查目录，只重新解析改动过的文件
+
+        Args:
+            force: 忽略检查间隔，立即检查
+
+        Returns:
+            重新解析 / 移除的文件数
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked < REFRESH_INTERVAL:
+                return 0
+            self._checked = now
+            if not self.directory.is_dir():
+                changed = len(self._files)
+                self._files = {}
+                self._search_index.clear()
+                self._rebuild()
+                return changed
+
+            seen = set()
+            changed = 0
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".yaml") or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    stat = entry.stat()
+                    cached = self._files.get(entry.name)
+                    if cached and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                        continue
+                    try:
+                        skills = parse_skill_file(entry.path)
+                    except Exception as e:
+                        print(f"[Skill Registry] 解析文件失败 {entry.path}: {e}")
+                        skills = []
+                    self.parsed += 1
+                    self._replace_file(entry.name, {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "skills": skills})
+                    changed += 1
+            for name in set(self._files) - seen:
+                self._replace_file(name, None)
+                changed += 1
+
+            if changed:
+                self._rebuild()
+                self._save_index()
+                print(f"[Skill Registry] 技能库已更新: {changed} 个文件变化，共 {len(self._order)} 个技能")
+            return changed
+
+    # ----------------------------------------
+    # 查询
+    # ----------------------------------------
+    def options(self):
+        """下拉列表: "文件名 - Key名" """
+        self.refresh()
+        with self._lock:
+            return list(self._order)
+
+    def skills(self):
+        self.refresh()
+        with self._lock:
+            return [self._skills[skill_id] for skill_id in self._order]
+
+    def get(self, skill_id):
+        self.refresh()
+        with self._lock:
+            return self._skills.get(skill_id)
+
+    def template(self, skill_id):
+        skill = self.get(skill_id)
+        return skill["template"] if skill else None
+
+    def search(self, query, top_k=10):
+        """
+        全文检索技能 (名称 / Key / 分类 / 描述 / 模板)
+
+        Returns:
+            [(技能 id, 得分), ...] 按相关度从高到低，最多 top_k 条
+        """
+        self.refresh()
+        with self._lock:
+            return self._search_index.search(query, top_k, self._positions)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(directory):
+    """每个技能目录一个共享的索引"""
+    key = str(Path(directory).absolute())
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = SkillRegistry(directory)
+        return registry
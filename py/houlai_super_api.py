@@ -1,16 +1,43 @@
-import requests
+import os
 import json
-import time
-import base64
+import hashlib
 import torch
-import numpy as np
-from PIL import Image
-from io import BytesIO
 import urllib3
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from . import houlai_http
+from .houlai_cache import DiskLRUCache, MemoryLRU, hash_key
+from .houlai_journal import JOURNAL, save_result
+from .houlai_metrics import PhaseTimer
+from .houlai_poller import POLLER, extract_progress
+from .houlai_providers import ProviderError, retry_after_from
+from .houlai_ratelimit import get_limiter
+from .utils import encode_base64_cached, split_frames, decode_arrays, decode_images, uint8_to_tensor
 
 # 禁用 SSL 警告 (因为我们要开启忽略证书模式)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# 单次任务最多携带的参考图数量
+MAX_REFERENCE_IMAGES = 14
+
+# 列表输入时同时提交的任务数
+SUBMIT_WORKERS = 8
+
+# 结果图并行下载
+_download_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="houlai_image_dl")
+DOWNLOAD_HEADERS = {
+    # 增加 headers 伪装
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+# 结果图下载缓存: 磁盘按 URL (默认 2GB)，内存按内容哈希保存解码后的像素 (默认 512MB)
+DOWNLOAD_CACHE = DiskLRUCache("downloads", int(os.environ.get("HOULAI_DOWNLOAD_CACHE_MB", "2048")) * 1024 * 1024)
+DECODED_CACHE = MemoryLRU(int(os.environ.get("HOULAI_DECODED_CACHE_MB", "512")) * 1024 * 1024,
+                          sizeof=lambda arr: arr.nbytes)
+# 命中磁盘缓存时是否用 ETag / Last-Modified 向服务端确认 (结果图地址一般不会变，默认关闭)
+REVALIDATE_DOWNLOADS = os.environ.get("HOULAI_DOWNLOAD_REVALIDATE", "0") == "1"
+
 # === 核心辅助功能 ===
 
 def tensor2base64(image):
@@ -19,37 +46,109 @@ def tensor2base64(image):
         return None
     # 确保处理的是单张图片
     if len(image.shape) > 3:
-        image = image[0]
-    
-    # 转换: Tensor(0-1) -> Numpy(0-255) -> PIL
-    i = 255. * image.cpu().numpy()
-    img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-    
-    # 转字节流
-    buffered = BytesIO()
-    img.save(buffered, format="JPEG", quality=95)
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        image = image[:1]
     
     # 必须带上前缀
-    return f"data:image/jpeg;base64,{img_str}"
+    return encode_base64_cached(image, "JPEG", quality=95, data_uri=True)[0]
+
+def task_poll_url(api_url, task_id):
+    """由提交地址推导任务状态查询地址"""
+    base_url = "https://api.apimart.ai/v1/tasks" 
+    if "apimart.ai" not in api_url and "/images/generations" in api_url:
+         base_url = api_url.replace("/images/generations", "/tasks")
+    return f"{base_url}/{task_id}"
+
+def _download_one(url):
+    """
+    下载单张图片 (优先读取磁盘缓存)
+
+    Returns:
+        (bytes, sha256)
+    """
+    key = hash_key("url", url)
+    entry = DOWNLOAD_CACHE.get_entry(key)
+    if entry is not None and not {"data", "meta.json"} <= entry.keys():
+        entry = None  # 条目不完整，按未命中处理
+    meta = json.loads(entry["meta.json"]) if entry else None
+    if entry and hashlib.sha256(entry["data"]).hexdigest() != meta["sha256"]:
+        print(f"⚠️ 缓存文件校验失败，重新下载: {url}")
+        entry = meta = None
+    if entry and not REVALIDATE_DOWNLOADS:
+        return entry["data"], meta["sha256"]
+
+    headers = dict(DOWNLOAD_HEADERS)
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
 
-def load_image_from_url(url):
-    """下载图片并转为ComfyUI格式 (增强版)"""
+    print(f"⬇️ 下载图片中: {url}")
+    # verify=False 忽略证书错误；分块流式接收，大图中断时断点续传
+    blob, resp_headers = houlai_http.download(url, headers=headers, timeout=60, verify=False, with_headers=True)
+    if blob is None:
+        # 304 Not Modified
+        return entry["data"], meta["sha256"]
+
+    sha = hashlib.sha256(blob).hexdigest()
+    meta = {"url": url, "sha256": sha, "etag": resp_headers.get("ETag"),
+            "last_modified": resp_headers.get("Last-Modified")}
+    DOWNLOAD_CACHE.put_entry(key, {"data": blob, "meta.json": json.dumps(meta).encode("utf-8")})
+    return blob, sha
+
+def _decode_cached(blobs, shas):
+    """按内容哈希复用最近解码过的像素，只解码未命中的图片"""
+    arrays = [DECODED_CACHE.get(sha) for sha in shas]
+    missing = [i for i, arr in enumerate(arrays) if arr is None]
+    if missing:
+        for i, arr in zip(missing, decode_arrays([blobs[i] for i in missing])):
+            arrays[i] = arr
+            DECODED_CACHE.put(shas[i], arr)
+    return arrays
+
+def load_images_from_urls(urls, timer=None, task_id=None):
+    """
+    并行下载多张图片并合并为一个 IMAGE batch (增强版)
+
+    task_id 不为空时把原图保存到本地并更新任务日志 (服务商返回的地址通常会过期)
+
+    Returns:
+        Optional[torch.Tensor]: 全部下载失败时返回 None
+    """
+    timer = timer or PhaseTimer()
+    with timer.phase("image_download"):
+        futures = [_download_pool.submit(_download_one, url) for url in urls]
+        blobs, shas = [], []
+        for url, future in zip(urls, futures):
+            try:
+                blob, sha = future.result()
+                blobs.append(blob)
+                shas.append(sha)
+            except Exception as e:
+                print(f"❌ 图片下载失败: {url} {e}")
+    if not blobs:
+        if task_id:
+            JOURNAL.update(task_id, "download_failed", result_url="\n".join(urls))
+        return None
+
+    timer.incr("image_bytes", sum(len(blob) for blob in blobs))
+    timer.set(images=len(blobs))
+    if task_id:
+        paths = [save_result(task_id, blob, index) for index, blob in enumerate(blobs)]
+        status = "succeeded" if len(blobs) == len(urls) else "download_failed"
+        JOURNAL.update(task_id, status, result_url="\n".join(urls),
+                       result_path="\n".join(p for p in paths if p))
     try:
-        print(f"⬇️ 下载图片中: {url}")
-        # 增加 headers 伪装
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        }
-        # verify=False 忽略证书错误
-        response = requests.get(url, headers=headers, timeout=60, verify=False)
-        response.raise_for_status()
-        img = Image.open(BytesIO(response.content))
-        img = img.convert("RGB")
-        img = np.array(img).astype(np.float32) / 255.0
-        return torch.from_numpy(img)[None,]
+        with timer.phase("decode"):
+            arrays = _decode_cached(blobs, shas)
+        # 尺寸不同的结果图无法组成一个 batch，只保留与第一张相同尺寸的
+        same = [arr for arr in arrays if arr.shape == arrays[0].shape]
+        if len(same) < len(arrays):
+            print(f"⚠️ {len(arrays) - len(same)} 张结果图尺寸与第一张不同，已忽略")
+        with timer.phase("to_tensor"):
+            return uint8_to_tensor(same)
     except Exception as e:
-        print(f"❌ 图片下载失败: {e}")
+        print(f"❌ 图片解码失败: {e}")
         return None
 
 def get_blank_image(width=512, height=512):
@@ -91,18 +190,84 @@ class HouLaiSuperCloudGen:
                 "image_2": ("IMAGE",),
                 "image_3": ("IMAGE",),
                 "image_4": ("IMAGE",),
+                "max_input_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64, "tooltip": "上传前把参考图长边缩小到该值以内，0 = 不缩放"}),
+                "n": ("INT", {"default": 1, "min": 1, "max": 8, "tooltip": "单个任务生成的图片数量，所有结果合并为一个 batch 输出"}),
+                "provider_pool": ("PROVIDER_POOL", {"tooltip": "连接 🔑 API端点池 后忽略 api_url / api_token，按端点负载自动分配并在出错时切换"}),
             }
         }
 
-    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
-    RETURN_NAMES = ("image", "image_url", "raw_response")
+    # 前三个输出与旧版一致，timing / image_urls 追加在末尾，已保存的工作流连线不受影响
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING", "STRING", "STRING")
+    RETURN_NAMES = ("image", "image_url", "raw_response", "timing", "image_urls")
     FUNCTION = "run_cloud_gen"
     CATEGORY = "后来/API工具"
 
     def run_cloud_gen(self, api_url, api_token, model, prompt, aspect_ratio, resolution, seed, 
                      timeout_seconds, enable_blocking, 
-                     image_1=None, image_2=None, image_3=None, image_4=None):
+                     image_1=None, image_2=None, image_3=None, image_4=None, max_input_side=None, n=None,
+                     provider_pool=None):
+        item = self._build_item(api_url, api_token, model, prompt, aspect_ratio, resolution,
+                                timeout_seconds, enable_blocking, [image_1, image_2, image_3, image_4],
+                                max_input_side or 0, n or 1, provider_pool)
+        images, urls, raws, timings, all_urls = self._run_items([item])
+        # image_urls 为该任务全部结果地址，每行一个
+        return (images[0], urls[0], raws[0], timings[0], "\n".join(all_urls))
 
+    def _build_item(self, api_url, api_token, model, prompt, aspect_ratio, resolution,
+                    timeout_seconds, enable_blocking, images, max_input_side, n, provider_pool):
+        return {
+            "api_url": api_url,
+            "api_token": api_token,
+            "model": model,
+            "prompt": prompt,
+            "aspect_ratio": aspect_ratio,
+            "resolution": resolution,
+            "timeout_seconds": timeout_seconds,
+            "enable_blocking": enable_blocking,
+            "images": images,
+            "max_input_side": max_input_side,
+            "n": n,
+            "provider_pool": provider_pool,
+            "timer": PhaseTimer("HouLaiSuperCloudGen", model=model,
+                                resolution=resolution, aspect_ratio=aspect_ratio),
+        }
+
+    def _run_items(self, items):
+        """
+        提交并等待一组任务
+
+        Returns:
+            (images, image_url 列表, raw_response 列表, timing 列表, 全部结果地址)
+        """
+        # 1. 全部提交 (并行)，每个成功提交的任务登记到共享轮询器
+        with ThreadPoolExecutor(max_workers=min(SUBMIT_WORKERS, len(items))) as executor:
+            outcomes = list(executor.map(self._submit_and_register, items))
+
+        # 2. 等待所有任务 (总耗时由最慢的任务决定)
+        images, urls, raws, timings, all_urls = [], [], [], [], []
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, Future):
+                image, image_urls, raw_response, status = self._collect(item, outcome)
+            else:
+                image, message, raw_response, status = outcome
+                image_urls = [message] if message else []
+            images.append(image)
+            # image_url 保持单个字符串 (第一张)，image_urls 展开所有任务的全部地址
+            urls.append(image_urls[0] if image_urls else "")
+            all_urls.extend(u for u in image_urls if u.startswith("http"))
+            raws.append(raw_response)
+            timings.append(item["timer"].finish(status))
+        return images, urls, raws, timings, all_urls
+
+    def _submit_and_register(self, item):
+        """
+        提交单个任务并登记轮询
+
+        Returns:
+            轮询 Future；提交失败或未开启等待时直接返回 (image, image_url, raw_response, status)
+        """
+        timer = item["timer"]
+        api_url, model, resolution = item["api_url"], item["model"], item["resolution"]
         print(f"\n⚡ [后来API] 启动任务: {model}")
         blank_img = get_blank_image()
 
@@ -110,32 +275,33 @@ class HouLaiSuperCloudGen:
         # 1. 准备请求头 (增强伪装)
         # -------------------------------------------
         headers = {
-            "Authorization": f"Bearer {api_token.strip()}",
+            "Authorization": f"Bearer {item['api_token'].strip()}",
             "Content-Type": "application/json",
             # 伪装成 Chrome 浏览器
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            # 强制短连接，防止复用断掉的通道
-            "Connection": "close"
         }
 
+        # 每个端口的整批图片都作为参考图，线程池并行编码
         image_urls_list = []
-        for i, img in enumerate([image_1, image_2, image_3, image_4]):
-            if img is not None:
-                print(f"  - 处理参考图 {i+1}...")
-                try:
-                    b64 = tensor2base64(img)
-                    if b64: image_urls_list.append(b64)
-                except Exception as e:
-                    print(f"  ❌ 参考图 {i+1} 转换失败: {e}")
+        frames = split_frames(item["images"], MAX_REFERENCE_IMAGES)
+        if frames:
+            print(f"  - 处理参考图 {len(frames)} 张...")
+            try:
+                with timer.phase("encode"):
+                    image_urls_list = encode_base64_cached(frames, "JPEG", quality=95, data_uri=True,
+                                                           max_side=item["max_input_side"])
+                timer.set(reference_images=len(image_urls_list))
+            except Exception as e:
+                print(f"  ❌ 参考图转换失败: {e}")
 
         # -------------------------------------------
         # 2. 构建 Payload
         # -------------------------------------------
         payload = {
             "model": model,
-            "prompt": prompt,
-            "size": aspect_ratio,
-            "n": 1,
+            "prompt": item["prompt"],
+            "size": item["aspect_ratio"],
+            "n": item["n"],
             "resolution": resolution
         }
         
@@ -147,15 +313,31 @@ class HouLaiSuperCloudGen:
         # 3. 提交任务 (增强网络稳定性)
         # -------------------------------------------
         task_id = None
+        pool = item["provider_pool"]
         try:
-            print(f"  - 正在提交到: {api_url}")
-            # verify=False 关键！忽略代理证书错误
-            response = requests.post(api_url, headers=headers, json=payload, timeout=30, verify=False)
-            
+            with timer.phase("serialize"):
+                body = json.dumps(payload).encode("utf-8")
+            if pool is None:
+                print(f"  - 正在提交到: {api_url}")
+                response = self._post_task(api_url, headers, body, timer)
+            else:
+                try:
+                    provider, response = pool.call(
+                        lambda provider: self._post_task_pooled(provider, headers, body, timer))
+                except ProviderError as e:
+                    # NoProviderAvailable (所有端点都在冷却中) 没有状态码
+                    err_msg = f"API请求错误 [{e.status_code}]: {e}" if e.status_code else f"API请求错误: {e}"
+                    print(f"❌ {err_msg}")
+                    return (blank_img, "", json.dumps({"error": err_msg}), "error")
+                # 轮询也走提交成功的端点 (任务只存在于该端点)
+                api_url = provider.base_url
+                headers = dict(headers, Authorization=f"Bearer {provider.api_key}")
+                timer.set(provider=provider.name)
+
             if response.status_code != 200:
                 err_msg = f"API请求错误 [{response.status_code}]: {response.text}"
                 print(f"❌ {err_msg}")
-                return (blank_img, "", json.dumps({"error": err_msg}))
+                return (blank_img, "", json.dumps({"error": err_msg}), "error")
             
             resp_json = response.json()
             
@@ -167,87 +349,259 @@ class HouLaiSuperCloudGen:
             
             if not task_id:
                 print(f"❌ 未找到 Task ID，原始响应: {resp_json}")
-                return (blank_img, "", json.dumps(resp_json))
+                return (blank_img, "", json.dumps(resp_json), "error")
 
             print(f"✅ 任务提交成功! ID: {task_id}")
+            # 先写日志再做其它事: 之后无论超时、重启还是关闭等待，任务都可以恢复
+            poll_url = task_poll_url(api_url, task_id)
+            item["task_id"] = task_id
+            JOURNAL.record_submit(task_id, "HouLaiSuperCloudGen", poll_url, api_url, model, resolution,
+                                  hash_key(payload))
 
-            if not enable_blocking:
+            if not item["enable_blocking"]:
                 msg = f"任务已提交(ID:{task_id})，未开启等待模式。"
-                return (blank_img, msg, json.dumps(resp_json))
+                return (blank_img, msg, json.dumps(resp_json), "submitted")
 
         except Exception as e:
             err_msg = f"提交异常: {str(e)}"
             print(f"❌ {err_msg}")
-            return (blank_img, "", json.dumps({"error": err_msg}))
+            return (blank_img, "", json.dumps({"error": err_msg}), "error")
 
         # -------------------------------------------
-        # 4. 轮询等待 (增强重试机制)
+        # 4. 登记到共享轮询器，成功后立即开始下载
         # -------------------------------------------
-        base_url = "https://api.apimart.ai/v1/tasks" 
-        if "apimart.ai" not in api_url and "/images/generations" in api_url:
-             base_url = api_url.replace("/images/generations", "/tasks")
-        
-        poll_url = f"{base_url}/{task_id}"
-        
         print(f"⏳ 开始轮询结果: {poll_url}")
-        start_time = time.time()
-        
-        # 连续失败计数器
-        fail_count = 0
-        
-        while True:
-            elapsed = time.time() - start_time
-            if elapsed > timeout_seconds:
-                print(f"❌ 等待超时 ({timeout_seconds}s)")
-                return (blank_img, "", json.dumps({"status": "timeout"}))
+        return POLLER.register(task_id, poll_url, parse_task_status, headers=headers,
+                               timeout=item["timeout_seconds"], duration_key=f"{model}|{resolution}",
+                               on_success=lambda img_urls: load_images_from_urls(img_urls, timer, task_id),
+                               timer=timer, verify=False)
+
+    def _post_task(self, api_url, headers, body, timer):
+        # 同一 Key 的所有提交共用一个限流器，批量时平稳贴着配额发送
+        limiter = get_limiter(api_url, headers.get("Authorization", ""))
+        with limiter.slot(timer):
+            # verify=False 关键！忽略代理证书错误
+            response = houlai_http.post(api_url, headers=headers, timeout=30, verify=False,
+                                        **timer.instrument(body))
+        limiter.observe(response)
+        timer.response_done(response)
+        return response
+
+    def _post_task_pooled(self, provider, headers, body, timer):
+        """向端点池中的一个端点提交，失败时抛出 ProviderError 让端点池换下一个"""
+        print(f"  - 正在提交到: {provider.base_url} ({provider.name})")
+        headers = dict(headers, Authorization=f"Bearer {provider.api_key}")
+        try:
+            response = self._post_task(provider.base_url, headers, body, timer)
+        except requests.RequestException as e:
+            raise ProviderError(f"网络错误: {e}") from e
+        provider.observe_headers(response.headers)
+        if response.status_code != 200:
+            raise ProviderError(response.text[:500], response.status_code, retry_after_from(response))
+        return provider, response
+
+    def _collect(self, item, future):
+        """等待轮询 Future，转换为节点输出"""
+        blank_img = get_blank_image()
+        try:
+            # 轮询器保证在期限内给出结果，这里额外留出下载时间
+            status, img_urls, poll_data, final_img = future.result(timeout=item["timeout_seconds"] + 120)
+        except FutureTimeout:
+            JOURNAL.update(item["task_id"], "timeout")
+            return (blank_img, [], json.dumps({"status": "timeout"}), "timeout")
+
+        if status != "succeeded":
+            if status == "timeout":
+                print(f"❌ 等待超时 ({item['timeout_seconds']}s)，可稍后用云端任务收集器继续获取")
+            JOURNAL.update(item["task_id"], status, raw=poll_data)
+            return (blank_img, [], poll_data, status)
+
+        print(f"🎉 成功! 图片地址: {', '.join(img_urls)}")
+        if final_img is not None:
+            return (final_img, img_urls, poll_data, "ok")
+        else:
+            return (blank_img, img_urls, "Download Failed", "download_failed")
+
+
+class HouLaiSuperCloudGenBatch(HouLaiSuperCloudGen):
+    """
+    后来 - 全能云端绘图 批量版
+    所有输入以列表形式接收: 提示词列表中的每一条先全部提交，再由共享轮询器统一等待，
+    输出为与提示词一一对应的列表
+    """
+
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True, True, True, True)
+    FUNCTION = "run_cloud_gen_batch"
+
+    def run_cloud_gen_batch(self, api_url, api_token, model, prompt, aspect_ratio, resolution, seed,
+                            timeout_seconds, enable_blocking,
+                            image_1=None, image_2=None, image_3=None, image_4=None, max_input_side=None, n=None,
+                            provider_pool=None):
+        # 列表长度不一致时按 ComfyUI 的规则用最后一个值补齐
+        count = max(len(prompt), len(model), len(aspect_ratio), len(resolution), len(api_url))
+
+        def pick(values, idx, default=None):
+            if not values:
+                return default
+            return values[min(idx, len(values) - 1)]
+
+        items = [self._build_item(pick(api_url, idx), pick(api_token, idx), pick(model, idx), pick(prompt, idx),
+                                  pick(aspect_ratio, idx), pick(resolution, idx), pick(timeout_seconds, idx),
+                                  pick(enable_blocking, idx),
+                                  [pick(port, idx) for port in (image_1, image_2, image_3, image_4)],
+                                  pick(max_input_side, idx, 0), pick(n, idx, 1), pick(provider_pool, idx))
+                 for idx in range(count)]
+        images, urls, raws, timings, all_urls = self._run_items(items)
+        return (images, urls, raws, timings, all_urls or [""])
+
+
+def result_urls(item):
+    """收集任务结果中的全部图片地址 (兼容 url / image_url / results / result.images 等写法)"""
+    urls = []
+
+    def add(value):
+        if isinstance(value, str) and value:
+            urls.append(value)
+        elif isinstance(value, list):
+            for v in value:
+                add(v)
+        elif isinstance(value, dict):
+            add(value.get("url") or value.get("image_url"))
+
+    add(item.get("url"))
+    add(item.get("image_url"))
+    add(item.get("image_urls"))
+    add(item.get("results"))
+    if isinstance(item.get("result"), dict):
+        add(item["result"].get("images"))
+    # 去重并保持顺序
+    return list(dict.fromkeys(urls))
 
+
+def parse_task_status(poll_data):
+    """
+    解析 /tasks/{id} 的返回
+
+    Returns:
+        (state, progress, eta, img_urls)，state 为 running / succeeded / failed
+    """
+    item = {}
+    if "data" in poll_data:
+        if isinstance(poll_data["data"], list) and len(poll_data["data"]) > 0:
+            item = poll_data["data"][0]
+        elif isinstance(poll_data["data"], dict):
+            item = poll_data["data"]
+
+    status = item.get("status", "unknown")
+    progress, eta = extract_progress(item)
+
+    if status in ["succeeded", "success", "completed"]:
+        img_urls = result_urls(item)
+        if img_urls:
+            return ("succeeded", progress, eta, img_urls)
+    elif status in ["failed", "error"]:
+        return ("failed", progress, eta, None)
+    return ("running", progress, eta, None)
+
+
+class HouLaiCloudTaskCollector:
+    """
+    后来 - 云端任务收集器
+
+    从任务日志中恢复已提交但没有拿到结果的任务 (ComfyUI 重启 / 超时 / 未开启等待)，
+    重新轮询并下载结果；已下载过的任务直接读取本地保存的原图。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "api_token": ("STRING", {"default": "", "multiline": False, "placeholder": "Bearer Token (不带Bearer前缀)"}),
+                "timeout_seconds": ("INT", {"default": 300, "min": 10, "max": 3600, "step": 10, "label": "超时(秒)"}),
+                "max_tasks": ("INT", {"default": 20, "min": 1, "max": 500}),
+            },
+            "optional": {
+                # 每行一个 task_id；留空则收集所有未完成的任务
+                "task_ids": ("STRING", {"multiline": True, "default": ""}),
+                "max_age_hours": ("INT", {"default": 72, "min": 0, "max": 24 * 30, "tooltip": "只恢复该时间内提交的任务，0 = 不限制"}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
+    RETURN_NAMES = ("images", "image_urls", "task_log")
+    OUTPUT_IS_LIST = (True, True, False)
+    FUNCTION = "collect"
+    CATEGORY = "后来/API工具"
+
+    def collect(self, api_token, timeout_seconds, max_tasks, task_ids="", max_age_hours=72):
+        wanted = [t.strip() for t in task_ids.splitlines() if t.strip()]
+        if wanted:
+            rows = [JOURNAL.get(t) or {"task_id": t, "status": "unknown"} for t in wanted[:max_tasks]]
+        else:
+            rows = JOURNAL.pending(limit=max_tasks, max_age_hours=max_age_hours)
+        if not rows:
+            return ([get_blank_image()], [""], "没有需要收集的任务")
+
+        headers = {
+            "Authorization": f"Bearer {api_token.strip()}",
+            "Content-Type": "application/json",
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        }
+        print(f"📥 [后来API] 收集 {len(rows)} 个云端任务")
+
+        # 1. 已保存到本地的直接读取，其余登记到共享轮询器
+        pending = {}
+        results = [None] * len(rows)
+        for idx, row in enumerate(rows):
+            task_id = row["task_id"]
+            if row["status"] == "unknown":
+                results[idx] = (None, [], "not_found")
+                continue
+            paths = (row.get("result_path") or "").split("\n")
+            if row["status"] == "succeeded" and paths[0] and all(os.path.exists(p) for p in paths):
+                image = self._load_local(paths)
+                if image is not None:
+                    results[idx] = (image, (row.get("result_url") or "").split("\n"), "local")
+                    continue
+            timer = PhaseTimer("HouLaiCloudTaskCollector", model=row.get("model"), resolution=row.get("resolution"))
+            future = POLLER.register(
+                task_id, row["poll_url"], parse_task_status, headers=headers, timeout=timeout_seconds,
+                on_success=lambda img_urls, task_id=task_id, timer=timer: load_images_from_urls(img_urls, timer, task_id),
+                timer=timer, verify=False)
+            pending[idx] = (future, timer)
+
+        # 2. 等待所有恢复的任务
+        for idx, (future, timer) in pending.items():
+            task_id = rows[idx]["task_id"]
             try:
-                # verify=False 再次使用
-                poll_res = requests.get(poll_url, headers=headers, timeout=10, verify=False)
-                
-                # 只要连接通了，重置失败计数
-                fail_count = 0
-                
-                if poll_res.status_code == 200:
-                    poll_data = poll_res.json()
-                    
-                    status = "unknown"
-                    img_url = None
-                    item = {}
-                    
-                    if "data" in poll_data:
-                        if isinstance(poll_data["data"], list) and len(poll_data["data"]) > 0:
-                            item = poll_data["data"][0]
-                        elif isinstance(poll_data["data"], dict):
-                            item = poll_data["data"]
-                    
-                    status = item.get("status", "unknown")
-                    print(f"  ... 状态: {status} ({int(elapsed)}s)")
-                    
-                    if status in ["succeeded", "success", "completed"]:
-                        img_url = item.get("url") or item.get("image_url")
-                        if not img_url and "results" in item:
-                            if isinstance(item["results"], list) and len(item["results"]) > 0:
-                                img_url = item["results"][0].get("url")
-                        
-                        if img_url:
-                            print(f"🎉 成功! 图片地址: {img_url}")
-                            final_img = load_image_from_url(img_url)
-                            if final_img is not None:
-                                return (final_img, img_url, json.dumps(poll_data))
-                            else:
-                                return (blank_img, img_url, "Download Failed")
-                    elif status in ["failed", "error"]:
-                        return (blank_img, "", json.dumps(poll_data))
-                
-            except Exception as e:
-                fail_count += 1
-                print(f"⚠️ 网络波动 ({fail_count}): {str(e)[:100]}...") # 只打印前100个字符避免刷屏
-                
-                # 如果连续失败超过10次，可能网络真断了，但我们继续重试直到超时
-                if fail_count > 20:
-                    print("❌ 连续网络错误次数过多，请检查代理设置。")
-                    return (blank_img, "", "Network Error")
-            
-            # 稍微延长轮询时间，给网络一点喘息
-            time.sleep(3)
\ No newline at end of file
+                status, img_urls, poll_data, image = future.result(timeout=timeout_seconds + 120)
+            except FutureTimeout:
+                status, img_urls, poll_data, image = "timeout", None, "", None
+            if status != "succeeded":
+                JOURNAL.update(task_id, status, raw=poll_data or None)
+            elif image is None:
+                status = "download_failed"
+            results[idx] = (image, img_urls or [], status)
+            timer.finish(status, task_id=task_id)
+
+        images, urls, log_lines = [], [], []
+        for row, (image, image_urls, status) in zip(rows, results):
+            images.append(image if image is not None else get_blank_image())
+            urls.extend(image_urls)
+            log_lines.append(f"{row['task_id']}: {status}")
+        done = sum(1 for _, _, status in results if status in ("succeeded", "local"))
+        print(f"✅ [后来API] 收集完成 {done}/{len(rows)}")
+        return (images, urls or [""], "\n".join(log_lines))
+
+    def _load_local(self, paths):
+        """读取本地保存的结果图"""
+        try:
+            blobs = []
+            for path in paths:
+                with open(path, "rb") as f:
+                    blobs.append(f.read())
+            return decode_images(blobs)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 读取本地结果失败，改为重新下载: {e}")
+            return None
@@ -0,0 +1,223 @@
+"""
+后来工具箱 - NanoBanana 完成回调接收器
+
+🚀 NanoBanana 调度器 派发批次时把本接收器的地址填入 callback_url，
+中间件每完成 (或最终失败) 一个任务就 POST 一次结果，接收器按 batch_id 放进收件箱，
+📬 NanoBanana 结果收集器 直接从收件箱取图，不用扫描 archive 文件夹。
+
+接收器在第一次派发时于 ComfyUI 进程内启动 (标准库 http.server，后台线程)。
+每个批次登记时生成随机 token 拼在 callback_url 上，token 不匹配或未登记的批次一律拒收。
+
+| 环境变量 | 说明 |
+| HOULAI_CALLBACK_HOST | 监听地址，默认 127.0.0.1 (中间件在其它机器上时改为 0.0.0.0) |
+| HOULAI_CALLBACK_PORT | 监听端口，默认 38189 (避开第二个 ComfyUI 常用的 8189)，0 = 随机端口 |
+| HOULAI_CALLBACK_URL  | 告诉中间件的回调地址 (默认按监听地址生成) |
+"""
+
+import os
+import json
+import time
+import hmac
+import base64
+import secrets
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CALLBACK_HOST = os.environ.get("HOULAI_CALLBACK_HOST", "127.0.0.1")
+CALLBACK_PORT = int(os.environ.get("HOULAI_CALLBACK_PORT", "38189"))
+CALLBACK_URL = os.environ.get("HOULAI_CALLBACK_URL", "")
+CALLBACK_PATH = "/houlai/nanobana/callback"
+
+# 收件箱最多保留的批次数 (超出时先丢弃最早的已收齐批次，收集器正在等待的批次不会被丢弃)
+MAX_BATCHES = 64
+
+# 单次回调请求体上限
+MAX_BODY_BYTES = 256 * 1024 * 1024
+
+
+class BatchInbox:
+    """
+    单个批次的收件箱
+
+    results 按到达顺序保存 {tid, status, slot, prompt, paths, images(字节列表), error}
+    token: 回调必须携带的批次口令
+    """
+
+    def __init__(self, batch_id, total=None):
+        self.batch_id = batch_id
+        self.total = total
+        self.token = secrets.token_urlsafe(16)
+        self.results = []
+        self.created_at = time.time()
+        self.collectors = 0
+        self._tids = set()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def collecting(self):
+        """收集器等待期间持有，期间该批次不会被淘汰"""
+        with self._cond:
+            self.collectors += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self.collectors -= 1
+
+    def put(self, result):
+        with self._cond:
+            # 中间件重试回调时可能重复投递
+            if result["tid"] in self._tids:
+                return
+            self._tids.add(result["tid"])
+            self.results.append(result)
+            self._cond.notify_all()
+
+    def wait(self, count, timeout):
+        """
+        等到至少 count 个结果 (或全部到齐 / 超时)
+
+        Returns:
+            当前所有结果的副本
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.results) < count and not self.complete:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(self.results)
+
+    def wait_new(self, seen, timeout):
+        """等待第 seen 个之后的新结果，返回新增部分 (超时返回空列表)"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.results) <= seen and not self.complete:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self.results[seen:]
+
+    @property
+    def complete(self):
+        return self.total is not None and len(self.results) >= self.total
+
+
+class CallbackReceiver:
+    """按 batch_id 分发回调结果的接收器"""
+
+    def __init__(self, host=CALLBACK_HOST, port=CALLBACK_PORT, public_url=CALLBACK_URL):
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self._server = None
+        self._inboxes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """回调地址 (会按需启动接收器)"""
+        self.start()
+        if self.public_url:
+            return self.public_url
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        return f"http://{host}:{self._server.server_port}{CALLBACK_PATH}"
+
+    def start(self):
+        with self._lock:
+            if self._server is not None:
+                return
+            try:
+                server = ThreadingHTTPServer((self.host, self.port), _Handler)
+            except OSError as e:
+                # 端口被占用 (如同时开了两个 ComfyUI) 时换随机端口
+                print(f"⚠️ [NanoBanana] 回调端口 {self.port} 不可用 ({e})，改用随机端口")
+                server = ThreadingHTTPServer((self.host, 0), _Handler)
+            server.daemon_threads = True
+            server.receiver = self
+            threading.Thread(target=server.serve_forever, name="houlai_callbacks", daemon=True).start()
+            self._server = server
+        print(f"📬 [NanoBanana] 回调接收器已启动: {self.host}:{server.server_port}")
+
+    def callback_url(self, inbox):
+        """带批次 token 的回调地址 (会按需启动接收器)"""
+        url = self.url
+        return f"{url}{'&' if '?' in url else '?'}token={inbox.token}"
+
+    def expect(self, batch_id, total):
+        """派发前登记批次 (任务总数用于判断是否收齐)，只有登记过的批次才接收回调"""
+        with self._lock:
+            inbox = self._inboxes.get(batch_id)
+            if inbox is None:
+                inbox = self._inboxes[batch_id] = BatchInbox(batch_id)
+                self._evict()
+        inbox.total = total
+        return inbox
+
+    def _evict(self):
+        """调用方需持有 self._lock；先丢最早的已收齐批次，再丢最早的未收齐批次，有收集器等待的批次跳过"""
+        excess = len(self._inboxes) - MAX_BATCHES
+        if excess <= 0:
+            return
+        idle = [inbox for inbox in self._inboxes.values() if not inbox.collectors]
+        idle.sort(key=lambda inbox: not inbox.complete)  # 稳定排序，同类中保持登记顺序
+        for inbox in idle[:excess]:
+            del self._inboxes[inbox.batch_id]
+
+    def inbox(self, batch_id):
+        with self._lock:
+            return self._inboxes.get(batch_id)
+
+    def deliver(self, payload, token):
+        inbox = self.inbox(payload["batch_id"])
+        if inbox is None or not token or not hmac.compare_digest(token, inbox.token):
+            raise PermissionError(f"未登记的批次或 token 不匹配: {payload['batch_id']}")
+        images = [base64.b64decode(data) for data in payload.get("images") or []]
+        inbox.put({
+            "tid": payload["tid"],
+            "status": payload.get("status", "done"),
+            "slot": payload.get("slot"),
+            "prompt": payload.get("prompt", ""),
+            "paths": payload.get("paths") or [],
+            "images": images,
+            "error": payload.get("error"),
+        })
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        if parts.path.rstrip("/") != CALLBACK_PATH:
+            return self._reply(404, {"error": "not found"})
+        token = (parse_qs(parts.query).get("token") or [""])[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            return self._reply(413 if length else 411, {"error": "invalid body size"})
+        try:
+            self.server.receiver.deliver(json.loads(self.rfile.read(length)), token)
+        except PermissionError as e:
+            return self._reply(403, {"error": str(e)})
+        except (KeyError, TypeError, ValueError) as e:
+            return self._reply(400, {"error": str(e)})
+        self._reply(200, {"ok": True})
+
+    def log_message(self, format, *args):
+        pass
+
+
+RECEIVER = CallbackReceiver()
@@ -0,0 +1,157 @@
+"""
+后来工具箱 - NanoBanana 调度清单 (manifest) 格式
+
+v1: 每个任务的 image_uris 都是完整的 base64 参考图列表，批量时同一组参考图被重复 N 次
+v2: 顶层 assets 表按内容哈希只存一份参考图，任务通过 image_refs 引用；请求体 gzip 压缩
+
+    {
+      "manifest_version": 2,
+      "batch_id": "...",
+      "assets": {"<sha256>": "data:image/png;base64,..."},
+      "manifest": [{"tid": "...", "prompt": "...", "image_refs": ["<sha256>", ...], ...}]
+    }
+
+本模块只依赖标准库，中间件直接复用 decode_body / normalize_manifest。
+"""
+
+import gzip
+import json
+import time
+import uuid
+import hashlib
+
+MANIFEST_VERSION = 2
+
+# gzip 压缩级别: base64 PNG 的压缩收益主要来自 base64 本身，高级别收益很小
+GZIP_LEVEL = 5
+
+# 参与幂等键计算的任务字段 (tid / api_key / 回调地址等与生成结果无关的字段不参与)
+IDEMPOTENT_FIELDS = ("mode", "model", "prompt", "aspect_ratio", "image_size", "seed", "slot")
+
+
+def new_batch_id():
+    """批次 ID: 秒级时间便于排序和查找，随机后缀保证同一秒内多次派发也不冲突"""
+    return f"NB_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:12]}"
+
+
+def item_key(item, image_uris):
+    """
+    任务的幂等键: 相同参数 + 相同参考图 (按内容哈希) 得到相同的键
+
+    中间件据此识别重复提交，同样的任务只执行 (计费) 一次。
+    随机种子 (seed 为 0 / 未设置) 的任务每次运行都应该出新图，返回 None 不参与内容去重，
+    这类任务只按 tid 去重 (同一清单被重发)。
+    """
+    if not is_deterministic(item):
+        return None
+    content = {field: item.get(field) for field in IDEMPOTENT_FIELDS}
+    content["image_refs"] = [asset_id(uri) for uri in image_uris]
+    blob = json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+def is_deterministic(item):
+    """固定种子的任务相同参数会得到相同结果，才可以按内容去重"""
+    try:
+        return int(item.get("seed") or 0) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def asset_id(uri):
+    """参考图的内容哈希 (对 data URI 文本计算 sha256)"""
+    return hashlib.sha256(uri.encode("ascii")).hexdigest()
+
+
+def build_manifest(batch_id, items, image_uris, **extra):
+    """
+    构建 v2 清单
+
+    Args:
+        batch_id: 批次 ID
+        items: 任务列表 (不含图片字段)，每个任务都引用全部 image_uris
+        image_uris: 共享参考图 (data URI)，相同内容只保存一份
+        extra: 其它顶层字段 (frontend / nanobana_config 等)
+
+    Returns:
+        dict
+    """
+    assets = {}
+    refs = []
+    for uri in image_uris:
+        key = asset_id(uri)
+        assets.setdefault(key, uri)
+        refs.append(key)
+    manifest = [dict(item, image_refs=refs) for item in items]
+    return dict(extra, manifest_version=MANIFEST_VERSION, batch_id=batch_id, assets=assets, manifest=manifest)
+
+
+def build_manifest_v1(batch_id, items, image_uris, **extra):
+    """旧格式: 每个任务内联完整参考图 (兼容旧版中间件)"""
+    manifest = [dict(item, image_uris=list(image_uris)) for item in items]
+    return dict(extra, batch_id=batch_id, manifest=manifest)
+
+
+def encode_body(payload, compress=True):
+    """
+    序列化请求体
+
+    Returns:
+        (body_bytes, headers)
+    """
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        # mtime=0: 相同清单得到相同字节
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def decode_body(body, content_encoding=""):
+    """中间件端: 按 Content-Encoding 解压并解析 JSON"""
+    if "gzip" in (content_encoding or "").lower():
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+def normalize_manifest(payload):
+    """
+    中间件端: 把任意版本的清单统一成 (任务列表, assets 表)，任务中只保留 image_refs
+
+    v1 清单中内联的参考图在这里去重，入库时每张图只存一份。
+    """
+    if payload.get("manifest_version", 1) >= 2:
+        return payload.get("manifest", []), payload.get("assets", {})
+    assets = {}
+    items = []
+    for item in payload.get("manifest", []):
+        item = dict(item)
+        refs = []
+        for uri in item.pop("image_uris", None) or []:
+            key = asset_id(uri)
+            assets.setdefault(key, uri)
+            refs.append(key)
+        item["image_refs"] = refs
+        items.append(item)
+    return items, assets
+
+
+def expand_manifest(payload):
+    """
+    中间件端: 把任意版本的清单统一展开成 v1 形式 (每个任务带 image_uris)
+
+    展开后各任务的 image_uris 共享同一批字符串对象，不会复制参考图内容。
+
+    Raises:
+        KeyError: 任务引用了 assets 中不存在的哈希
+    """
+    if payload.get("manifest_version", 1) < 2:
+        return payload.get("manifest", [])
+    assets = payload.get("assets", {})
+    expanded = []
+    for item in payload.get("manifest", []):
+        item = dict(item)
+        item["image_uris"] = [assets[ref] for ref in item.pop("image_refs", [])]
+        expanded.append(item)
+    return expanded
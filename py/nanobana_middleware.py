@@ -0,0 +1,509 @@
+"""
+后来工具箱 - NanoBanana 中间件 (参考实现)
+
+🚀 NanoBanana 调度器 把整批任务 POST 到 /api/v1/dispatch 后立即返回，真正的生成由本中间件完成:
+- 清单 (v1 / v2，可 gzip) 入库到 SQLite 持久化优先级队列，重启后继续执行
+- 每个模型一组工作线程，并发数可按模型配置
+- 同一 API Key 的请求共用 houlai_ratelimit 限流器，429 时自动降速
+- 失败任务指数退避重试，结果写入 archive/<batch_id>/，并可 POST 到 callback_url
+- 提交成功后立即保存服务端 task_id: 重启后继续轮询这些任务，提交结果未知的任务记为失败而不是重发
+- 幂等: 重发的同一请求 (相同 tid) 被忽略；内容相同的固定种子任务 (idempotency_key) 只执行一次，
+  重复提交方在原任务完成时收到同样的结果，不会重复计费
+- 后端可插拔: stub (本地模拟，离线压测用) / taskapi (与 ☁️ 全能云端绘图 相同的提交 + 轮询协议)
+
+在插件根目录运行:
+    python -m py.nanobana_middleware --port 8001 --backend stub
+    python -m py.nanobana_middleware --backend taskapi --api-url https://api.apimart.ai/v1/images/generations \\
+        --concurrency nano-banana-2=8,nano-banana-2-4k=2
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from . import houlai_http
+from .houlai_cache import CACHE_ROOT, PLUGIN_ROOT
+from .houlai_providers import ProviderError, retry_after_from
+from .houlai_ratelimit import get_limiter, stats as limiter_stats
+from .nanobana_manifest import decode_body, normalize_manifest, new_batch_id
+from .nanobana_queue import DONE, FAILED, JobQueue
+
+DEFAULT_PORT = 8001
+DEFAULT_DB = CACHE_ROOT / "nanobana_queue.sqlite3"
+DEFAULT_ARCHIVE = PLUGIN_ROOT / "archive"
+
+# 单个清单请求体上限 (解压前)
+MAX_BODY_BYTES = 512 * 1024 * 1024
+
+# 重试退避上限 (秒)
+MAX_RETRY_DELAY = 120.0
+
+# 没有任务时工作线程的最长等待时间 (入队时会被立即唤醒)
+IDLE_WAIT = 5.0
+
+
+class JobFailed(Exception):
+    """不可重试的失败 (任务已在服务端提交，重试会重复计费)"""
+
+
+# ============================================
+# 后端
+# ============================================
+def stub_png(width, height, rgb):
+    """纯标准库生成单色 PNG"""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    row = b"\x00" + bytes(rgb) * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b""))
+
+
+class StubBackend:
+    """
+    本地模拟后端: 等待一段随机时间后返回按提示词着色的纯色图
+
+    Args:
+        latency: 平均耗时 (秒)
+        fail_rate: 模拟 503 / 429 的概率
+    """
+
+    name = "stub"
+    endpoint = "stub://local"
+    resubmit_safe = True   # 不计费，重启后中断的任务可以直接重跑
+
+    def __init__(self, latency=2.0, fail_rate=0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+
+    def generate(self, job, limiter, on_submitted=None):
+        # 模拟同步接口: 整个生成过程都算一次在途请求
+        with limiter.slot():
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.fail_rate:
+            if random.random() < 0.5:
+                limiter.observe(status_code=429, headers={"Retry-After": "1"})
+                raise ProviderError("模拟限流", 429, 1.0)
+            limiter.observe(status_code=503)
+            raise ProviderError("模拟服务端错误", 503)
+        limiter.observe(status_code=200)
+        item = job["item"]
+        rgb = hashlib.sha256(item.get("prompt", "").encode("utf-8")).digest()[:3]
+        return [stub_png(256, 256, rgb)]
+
+
+class TaskApiBackend:
+    """
+    异步任务接口后端: 提交 -> 共享轮询器等待 -> 下载结果图
+
+    协议与 ☁️ 全能云端绘图 相同 (POST 返回 task_id，GET /tasks/{id} 查询)
+    """
+
+    name = "taskapi"
+    resubmit_safe = False
+
+    def __init__(self, api_url, timeout=600):
+        # 解析逻辑与云端绘图节点共用 (该模块依赖 torch，只在使用本后端时导入)
+        from .houlai_super_api import task_poll_url, parse_task_status
+        from .houlai_poller import POLLER
+        self._poll_url = task_poll_url
+        self._parse = parse_task_status
+        self._poller = POLLER
+        self.endpoint = api_url
+        self.timeout = timeout
+
+    @staticmethod
+    def _headers(job):
+        return {"Authorization": f"Bearer {(job['api_key'] or '').strip()}", "Content-Type": "application/json"}
+
+    def generate(self, job, limiter, on_submitted=None):
+        """
+        提交并等待结果
+
+        on_submitted(task_id): 拿到 task_id 后、开始轮询前调用，用于持久化 (重启后由 resume 继续轮询)
+        """
+        item = job["item"]
+        headers = self._headers(job)
+        payload = {"model": item.get("model"), "prompt": item.get("prompt", ""),
+                   "resolution": item.get("image_size", "1K"), "n": 1}
+        if item.get("aspect_ratio") and item["aspect_ratio"] != "auto":
+            payload["size"] = item["aspect_ratio"]
+        if item.get("seed"):
+            payload["seed"] = item["seed"]
+        if job["image_uris"]:
+            payload["image_urls"] = job["image_uris"]
+
+        try:
+            # 限流只作用于提交请求，轮询等待期间不占用并发名额
+            response = houlai_http.send("POST", self.endpoint, limiter=limiter, json=payload, headers=headers,
+                                        timeout=60, verify=False)
+        except Exception as e:
+            if houlai_http.request_not_sent(e):
+                # 连接都没建立，服务端不可能受理，可以安全重试
+                raise ProviderError(f"连接失败: {e}") from e
+            # 读超时 / 连接中断: 服务端可能已受理，重试会重复计费
+            raise JobFailed(f"提交结果未知 (服务端可能已受理，不再重试): {e}") from e
+        if response.status_code != 200:
+            raise ProviderError(response.text[:500], response.status_code, retry_after_from(response))
+        data = response.json().get("data")
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        task_id = (data or {}).get("task_id")
+        if not task_id:
+            raise JobFailed(f"未找到 Task ID: {response.text[:500]}")
+        if on_submitted is not None:
+            on_submitted(task_id)
+        return self._wait(job, task_id)
+
+    def resume(self, job):
+        """继续等待重启前已提交的任务 (不重新提交)"""
+        return self._wait(job, job["provider_task_id"])
+
+    def _wait(self, job, task_id):
+        # 提交成功后不再重试 (避免重复计费)，失败直接记为 failed
+        item = job["item"]
+        future = self._poller.register(
+            task_id, self._poll_url(self.endpoint, task_id), self._parse, headers=self._headers(job),
+            timeout=self.timeout, duration_key=f"{item.get('model')}|{item.get('image_size')}",
+            on_success=lambda urls: [houlai_http.download(url, verify=False) for url in urls], verify=False)
+        try:
+            status, _, raw, blobs = future.result()
+        except Exception as e:
+            raise JobFailed(f"任务 {task_id} 查询 / 下载失败: {e}") from e
+        if status != "succeeded" or not blobs:
+            raise JobFailed(f"任务 {task_id} {status}: {str(raw)[:500]}")
+        return blobs
+
+
+BACKENDS = {"stub": StubBackend, "taskapi": TaskApiBackend}
+
+
+# ============================================
+# 调度
+# ============================================
+def _safe_name(value):
+    """用作文件 / 目录名 (去掉路径分隔符等)"""
+    return re.sub(r"[^\w.-]", "_", str(value)).strip(".") or "_"
+
+
+def parse_concurrency(text):
+    """解析 "模型=并发数,模型=并发数" """
+    limits = {}
+    for part in (text or "").split(","):
+        if "=" in part:
+            model, value = part.split("=", 1)
+            limits[model.strip()] = max(1, int(value))
+    return limits
+
+
+class Middleware:
+    """
+    队列 + 按模型分组的工作线程
+
+    Args:
+        queue: nanobana_queue.JobQueue
+        backend: 后端实例 (需要 endpoint、resubmit_safe 属性和 generate(job, limiter, on_submitted) -> [图片字节]，
+                 由后端决定哪一段请求受限流器约束并上报响应状态；异步任务后端还需要 resume(job) 继续轮询)
+        archive_dir: 结果保存目录
+        concurrency: {模型: 并发数}
+        default_concurrency: 未配置模型的并发数
+        max_attempts: 单个任务最多执行次数
+        dedupe_window: 按 idempotency_key 去重的时间窗口 (秒)，0 = 只按 tid 去重
+    """
+
+    def __init__(self, queue, backend, archive_dir=DEFAULT_ARCHIVE, concurrency=None,
+                 default_concurrency=2, max_attempts=3, dedupe_window=24 * 3600):
+        self.queue = queue
+        self.backend = backend
+        self.archive_dir = str(archive_dir)
+        self.concurrency = concurrency or {}
+        self.default_concurrency = default_concurrency
+        self.max_attempts = max_attempts
+        self.dedupe_window = dedupe_window
+        self._workers = {}   # 模型 -> 线程列表
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._completed = 0
+        self._failed = 0
+
+    def start(self):
+        resumed, requeued, failed = self.queue.recover(getattr(self.backend, "resubmit_safe", False))
+        if resumed or requeued:
+            print(f"♻️ [NanoBanana 中间件] 恢复上次未完成的任务: 继续轮询 {len(resumed)} 个，重新排队 {requeued} 个")
+        for job in failed:
+            self._finish_failed(job, job["error"])
+        for job in resumed:
+            threading.Thread(target=self._run_job, args=(job, True), daemon=True,
+                             name=f"nanobana_resume_{job['tid']}").start()
+        for model in self.queue.models():
+            self._ensure_workers(model)
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def dispatch(self, payload):
+        """入队一个清单，立即返回"""
+        batch_id = payload.get("batch_id") or new_batch_id()
+        items, assets = normalize_manifest(payload)
+        callback_url = (payload.get("frontend") or {}).get("callback_url", "")
+        accepted, duplicates = self.queue.add_batch(batch_id, items, assets, callback_url, self.dedupe_window)
+        for model in {item.get("model", "") for item in items}:
+            self._ensure_workers(model)
+        with self._cond:
+            self._cond.notify_all()
+        print(f"📥 [NanoBanana 中间件] 批次 {batch_id}: 入队 {accepted}/{len(items)} 个任务"
+              + (f"，{len(duplicates)} 个与已有任务重复" if duplicates else ""))
+        # 原任务已经完成的重复任务，直接回传已有结果
+        for tid, original_tid in duplicates.items():
+            original = self.queue.get(original_tid)
+            if original is not None and original["status"] in (DONE, FAILED):
+                target = {"tid": tid, "batch_id": batch_id, "callback_url": callback_url}
+                threading.Thread(target=self._notify_duplicate, args=(original, target), daemon=True).start()
+        return {"batch_id": batch_id, "accepted": accepted, "total": len(items), "duplicates": duplicates}
+
+    def _notify_duplicate(self, original, target):
+        paths = (original.get("result") or {}).get("paths", [])
+        blobs = []
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    blobs.append(f.read())
+            except OSError:
+                pass
+        status = "done" if original["status"] == DONE else "failed"
+        self._post_callback(original, target, status, paths, blobs, original.get("error"))
+
+    def _ensure_workers(self, model):
+        with self._cond:
+            if model in self._workers:
+                return
+            count = self.concurrency.get(model, self.default_concurrency)
+            threads = [threading.Thread(target=self._worker, args=(model,), daemon=True,
+                                        name=f"nanobana_{model}_{i}") for i in range(count)]
+            self._workers[model] = threads
+        for thread in threads:
+            thread.start()
+
+    def _worker(self, model):
+        while not self._stop.is_set():
+            job = self.queue.claim(model)
+            if job is None:
+                due = self.queue.next_due(model)
+                with self._cond:
+                    self._cond.wait(IDLE_WAIT if due is None else min(max(due, 0.05), IDLE_WAIT))
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job, resume=False):
+        tid = job["tid"]
+        limiter = get_limiter(self.backend.endpoint, job["api_key"] or "")
+        start = time.monotonic()
+        try:
+            if resume:
+                blobs = self.backend.resume(job)
+            else:
+                blobs = self.backend.generate(job, limiter, lambda task_id: self.queue.set_task_id(tid, task_id))
+        except JobFailed as e:
+            self._finish_failed(job, str(e))
+            return
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            # 只重试确定可以重发的错误 (后端显式标记可重试 / 请求没有发出)，其余一律记为失败
+            retryable = e.retryable if isinstance(e, ProviderError) else houlai_http.request_not_sent(e)
+            if retryable and job["attempts"] < self.max_attempts:
+                delay = retry_after if retry_after is not None else \
+                    random.uniform(0, min(MAX_RETRY_DELAY, 2.0 ** job["attempts"]))
+                print(f"🔁 [NanoBanana 中间件] {tid} 第 {job['attempts']} 次失败 ({e})，{delay:.1f}s 后重试")
+                self.queue.retry(tid, str(e), delay)
+                with self._cond:
+                    self._cond.notify_all()
+            else:
+                self._finish_failed(job, str(e))
+            return
+
+        elapsed = time.monotonic() - start
+        paths = self._archive(job, blobs, elapsed)
+        self.queue.complete(tid, {"paths": paths, "seconds": round(elapsed, 3)})
+        self._completed += 1
+        print(f"✅ [NanoBanana 中间件] {tid} 完成 ({elapsed:.1f}s)")
+        self._callback(job, "done", paths=paths, blobs=blobs)
+
+    def _finish_failed(self, job, error):
+        print(f"❌ [NanoBanana 中间件] {job['tid']} 失败: {error}")
+        self.queue.fail(job["tid"], error)
+        self._failed += 1
+        self._callback(job, "failed", error=error)
+
+    def _archive(self, job, blobs, elapsed):
+        """结果图和元数据写入 archive/<batch_id>/ (先写临时文件再重命名)"""
+        folder = os.path.join(self.archive_dir, _safe_name(job["batch_id"]))
+        os.makedirs(folder, exist_ok=True)
+        name = _safe_name(job["tid"])
+        paths = []
+        for idx, blob in enumerate(blobs):
+            ext = ".jpg" if blob[:3] == b"\xff\xd8\xff" else ".png"
+            path = os.path.join(folder, f"{name}_{idx}{ext}" if idx else f"{name}{ext}")
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+            paths.append(path)
+        item = {k: v for k, v in job["item"].items() if k != "image_refs"}
+        meta = dict(item, batch_id=job["batch_id"], attempts=job["attempts"], seconds=round(elapsed, 3),
+                    reference_images=len(job["image_uris"]), files=[os.path.basename(p) for p in paths])
+        with open(os.path.join(folder, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return paths
+
+    def _callback(self, job, status, paths=(), blobs=(), error=None):
+        """任务结束时通知 callback_url，重复提交到该任务上的批次也一并通知"""
+        targets = [{"tid": job["tid"], "batch_id": job["batch_id"], "callback_url": job.get("callback_url")}]
+        targets += self.queue.aliases(job["tid"])
+        for target in targets:
+            self._post_callback(job, target, status, paths, blobs, error)
+
+    def _post_callback(self, job, target, status, paths, blobs, error):
+        """POST 一个任务的结果 (附带 base64 结果图，接收方不必与中间件在同一台机器)"""
+        url = target.get("callback_url")
+        if not url:
+            return
+        body = {
+            "batch_id": target["batch_id"],
+            "tid": target["tid"],
+            "status": status,
+            "slot": job["item"].get("slot"),
+            "prompt": job["item"].get("prompt", ""),
+            "paths": list(paths),
+            "images": [base64.b64encode(blob).decode("ascii") for blob in blobs],
+            "error": error,
+        }
+        try:
+            response = houlai_http.send("POST", url, houlai_http.RequestPolicy(max_retries=2), json=body,
+                                        timeout=30, proxies={"http": None, "https": None})
+            if response.status_code >= 400:
+                print(f"⚠️ [NanoBanana 中间件] 回调返回 {response.status_code}: {url.split('?')[0]}")
+        except Exception as e:
+            # 日志中不打印地址里的批次 token
+            print(f"⚠️ [NanoBanana 中间件] 回调失败 ({url.split('?')[0]}): {e}")
+
+    def stats(self):
+        with self._cond:
+            workers = {model: len(threads) for model, threads in self._workers.items()}
+        return {
+            "backend": self.backend.name,
+            "queue": self.queue.counts(),
+            "workers": workers,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rate_limits": limiter_stats(),
+        }
+
+
+# ============================================
+# HTTP 接口
+# ============================================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.rstrip("/")
+        if path != "/api/v1/dispatch":
+            return self._reply(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            return self._reply(413 if length else 411, {"error": "invalid body size"})
+        try:
+            payload = decode_body(self.rfile.read(length), self.headers.get("Content-Encoding", ""))
+        except (OSError, ValueError) as e:
+            return self._reply(400, {"error": f"无法解析清单: {e}"})
+        try:
+            result = self.server.middleware.dispatch(payload)
+        except (KeyError, TypeError, ValueError) as e:
+            return self._reply(400, {"error": f"清单格式错误: {e}"})
+        self._reply(200, dict(result, status="queued"))
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip("/")
+        middleware = self.server.middleware
+        if path in ("", "/health", "/api/v1/health"):
+            return self._reply(200, {"status": "ok"})
+        if path == "/api/v1/stats":
+            return self._reply(200, middleware.stats())
+        if path.startswith("/api/v1/batches/"):
+            batch_id = path.rsplit("/", 1)[-1]
+            jobs = middleware.queue.batch_status(batch_id)
+            if not jobs:
+                return self._reply(404, {"error": "batch not found"})
+            return self._reply(200, {"batch_id": batch_id, "jobs": jobs})
+        self._reply(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(middleware, host="127.0.0.1", port=DEFAULT_PORT):
+    """启动中间件 (阻塞)"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.middleware = middleware
+    middleware.start()
+    print(f"🚀 [NanoBanana 中间件] 监听 http://{host}:{server.server_port}  后端: {middleware.backend.name}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        middleware.stop()
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NanoBanana 中间件")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="stub")
+    parser.add_argument("--api-url", default="https://api.apimart.ai/v1/images/generations",
+                        help="taskapi 后端的提交地址")
+    parser.add_argument("--db", default=str(DEFAULT_DB), help="任务队列数据库路径")
+    parser.add_argument("--archive", default=str(DEFAULT_ARCHIVE), help="结果保存目录")
+    parser.add_argument("--concurrency", default="", help="按模型设置并发，如 nano-banana-2=8,nano-banana-2-4k=2")
+    parser.add_argument("--default-concurrency", type=int, default=2)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--dedupe-hours", type=float, default=24, help="相同内容的任务在该时间内只执行一次，0 = 关闭")
+    parser.add_argument("--task-timeout", type=int, default=600, help="taskapi 后端单个任务的等待上限 (秒)")
+    parser.add_argument("--stub-latency", type=float, default=2.0)
+    parser.add_argument("--stub-fail-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.backend == "stub":
+        backend = StubBackend(args.stub_latency, args.stub_fail_rate)
+    else:
+        backend = TaskApiBackend(args.api_url, args.task_timeout)
+    middleware = Middleware(JobQueue(args.db), backend, args.archive, parse_concurrency(args.concurrency),
+                            args.default_concurrency, args.max_attempts, int(args.dedupe_hours * 3600))
+    serve(middleware, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
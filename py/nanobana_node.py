@@ -1,11 +1,20 @@
-import requests
+import os
 import time
-import base64
-import io
-import json
-import numpy as np
-from PIL import Image
+from io import BytesIO
+
 import torch
+from PIL import Image
+import comfy.utils
+
+from . import houlai_http
+from .houlai_metrics import PhaseTimer
+from .houlai_ratelimit import get_limiter
+from .nanobana_callbacks import RECEIVER
+from .nanobana_manifest import build_manifest, build_manifest_v1, encode_body, item_key, new_batch_id
+from .utils import encode_base64_cached, split_frames, decode_images
+
+# 单个任务最多携带的参考图数量
+MAX_REFERENCE_IMAGES = 14
 
 class NanoBananaScheduler:
     def __init__(self):
@@ -36,29 +45,32 @@ class NanoBananaScheduler:
                 "image6": ("IMAGE",),
                 "image7": ("IMAGE",),
                 "image8": ("IMAGE",),
+                "max_input_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 64, "tooltip": "上传前把参考图长边缩小到该值以内，0 = 不缩放"}),
+                "compact_manifest": ("BOOLEAN", {"default": True, "label_on": "v2: 参考图去重+gzip", "label_off": "v1: 兼容旧中间件",
+                                                 "tooltip": "参考图只在清单顶层存一份，任务按哈希引用，请求体 gzip 压缩"}),
+                "enable_callback": ("BOOLEAN", {"default": True, "label_on": "开启:结果回传", "label_off": "关闭:只写 archive",
+                                                "tooltip": "让中间件把每个完成的任务回传给本机，配合 📬 NanoBanana 结果收集器 使用"}),
             }
         }
 
-    # === 无输出接口，发完即止 ===
-    RETURN_TYPES = ()
-    RETURN_NAMES = ()
+    # === 发完即止，只输出本次调度的耗时记录和批次 ID ===
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("timing", "batch_id")
     OUTPUT_NODE = True
     FUNCTION = "process"
     CATEGORY = "NanoBanana"
 
     def process(self, middleware_url, api_key, prompt, mode, model, aspect_ratio, image_size, seed, **kwargs):
+        timer = PhaseTimer("NanoBananaScheduler", model=model, image_size=image_size, mode=mode)
+
         # 1. 收集图片 (image1 ~ image8)
-        collected_images = []
-        for i in range(1, 9):
-            key = f"image{i}"
-            if key in kwargs and kwargs[key] is not None:
-                img_tensor = kwargs[key][0]
-                i = 255. * img_tensor.cpu().numpy()
-                img_pil = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-                buffered = io.BytesIO()
-                img_pil.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                collected_images.append(f"data:image/png;base64,{img_str}")
+        # 每个端口的整批图片都作为参考图
+        frames = split_frames([kwargs.get(f"image{i}") for i in range(1, 9)], MAX_REFERENCE_IMAGES)
+        # 所有参考图在线程池中并行编码 (已编码过的参考图直接复用缓存)
+        max_side = kwargs.get("max_input_side", 0)
+        with timer.phase("encode"):
+            collected_images = encode_base64_cached(frames, "PNG", data_uri=True, max_side=max_side) if frames else []
+        timer.set(reference_images=len(collected_images))
 
         # 2. 拆分 Prompt (实现批量)
         # 过滤空行，确保每一行都是一个独立的任务
@@ -66,16 +78,17 @@ class NanoBananaScheduler:
         if not prompt_list: prompt_list = [""]
 
         print(f"🚀 [NanoBanana] 准备发射 {len(prompt_list)} 个任务...")
+        timer.set(tasks=len(prompt_list))
 
         # 3. 构造批量 Manifest
-        batch_id = f"NB_{int(time.time())}"
+        # 批次 ID 带随机后缀: 多个调度器同一秒内派发也不会冲突 (任务 ID 和 archive 目录都基于它)
+        batch_id = new_batch_id()
         manifest_items = []
         
         for idx, p_text in enumerate(prompt_list):
             manifest_items.append({
                 "tid": f"{batch_id}_T{idx}",
                 "prompt": p_text,
-                "image_uris": collected_images, # 共享参考图
                 "api_key": api_key,
                 
                 # 透传参数
@@ -87,32 +100,173 @@ class NanoBananaScheduler:
                 
                 "slot": {"image_index": idx, "prompt_index": idx, "copy_index": 0}
             })
+            # 幂等键: 中间件据此识别重复提交，同样的任务只计费一次 (随机种子的任务不设置，每次运行都重新生成)
+            idempotency_key = item_key(manifest_items[-1], collected_images)
+            if idempotency_key:
+                manifest_items[-1]["idempotency_key"] = idempotency_key
 
-        payload = {
-            "batch_id": batch_id,
-            "frontend": {"order_id": batch_id, "callback_url": ""},
-            "nanobana_config": {},
-            "manifest": manifest_items
-        }
+        # 共享参考图: v2 在顶层 assets 表中只存一份，任务按内容哈希引用
+        compact = kwargs.get("compact_manifest", True)
+        build = build_manifest if compact else build_manifest_v1
+        # 结果回传: 先登记批次再派发，避免回调先于登记到达
+        callback_url = ""
+        if kwargs.get("enable_callback", True):
+            callback_url = RECEIVER.callback_url(RECEIVER.expect(batch_id, len(manifest_items)))
+        payload = build(batch_id, manifest_items, collected_images,
+                        frontend={"order_id": batch_id, "callback_url": callback_url},
+                        nanobana_config={})
 
         # 4. 发射指令 (Fire and Forget)
         ui_msg = ""
+        status = "ok"
         try:
             url = f"{middleware_url.rstrip('/')}/api/v1/dispatch"
-            
+            with timer.phase("serialize"):
+                body, headers = encode_body(payload, compress=compact)
+            headers["Idempotency-Key"] = batch_id
+
             # 这里是关键：中间件现在是秒回的，所以这里的 timeout 即使是 5秒都够用了
-            res = requests.post(url, json=payload, timeout=30, proxies={"http": None, "https": None})
+            # 中间件按 tid / 幂等键去重，超时或连接中断后重发同一清单是安全的
+            policy = houlai_http.RequestPolicy(max_retries=3, idempotent=True)
+            res = houlai_http.send("POST", url, policy, limiter=get_limiter(url, api_key), headers=headers,
+                                   timeout=30, proxies={"http": None, "https": None}, **timer.instrument(body))
+            timer.response_done(res)
             
             if res.status_code == 200:
                 print(f"✅ [NanoBanana] 发射成功！Batch ID: {batch_id}")
-                ui_msg = f"✅ 已发送 {len(prompt_list)} 个任务到后台。\nBatch ID: {batch_id}\n请在 archive 文件夹查看结果。"
+                where = "用 📬 NanoBanana 结果收集器 获取结果" if callback_url else "请在 archive 文件夹查看结果"
+                ui_msg = f"✅ 已发送 {len(prompt_list)} 个任务到后台。\nBatch ID: {batch_id}\n{where}。"
+                try:
+                    duplicates = res.json().get("duplicates") or {}
+                except ValueError:
+                    duplicates = {}
+                if duplicates:
+                    ui_msg += f"\n其中 {len(duplicates)} 个任务与之前提交的相同，直接复用结果，不会重复计费。"
             else:
                 print(f"❌ [NanoBanana] 发射失败: {res.status_code}")
                 ui_msg = f"❌ 服务器报错: {res.text}"
+                status = "error"
 
         except Exception as e:
             print(f"❌ [NanoBanana] 连接错误: {e}")
             ui_msg = f"❌ 无法连接中间件: {e}"
+            status = "error"
 
         # 任务立即结束，ComfyUI 变绿
-        return {"ui": {"text": ui_msg}}
\ No newline at end of file
+        return {"ui": {"text": ui_msg}, "result": (timer.finish(status, batch_id=batch_id), batch_id)}
+
+
+class NanoBananaCollector:
+    """
+    NanoBanana 结果收集器
+
+    从回调收件箱按到达顺序取回某个批次的结果图，每到一张就更新进度条预览；
+    min_results > 0 时收到这么多张就返回，下游 (放大 / 改色) 不必等整批完成。
+    收件箱中没有该批次 (如 ComfyUI 重启过) 时，向中间件查询进度并读取 archive 中的文件。
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "batch_id": ("STRING", {"default": "", "forceInput": True}),
+                "timeout_seconds": ("INT", {"default": 600, "min": 5, "max": 7200, "step": 5}),
+                "min_results": ("INT", {"default": 0, "min": 0, "max": 1000, "tooltip": "收到这么多张就返回，0 = 等整批完成"}),
+            },
+            "optional": {
+                "middleware_url": ("STRING", {"default": "http://127.0.0.1:8001", "tooltip": "收件箱里没有该批次时，向中间件查询结果"}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
+    RETURN_NAMES = ("images", "prompts", "log")
+    OUTPUT_IS_LIST = (True, True, False)
+    FUNCTION = "collect"
+    CATEGORY = "NanoBanana"
+
+    @classmethod
+    def IS_CHANGED(s, batch_id, **kwargs):
+        # 批次还有结果未到时，每次执行都重新收集
+        inbox = RECEIVER.inbox(batch_id)
+        if inbox is None or not inbox.complete:
+            return float("nan")
+        return len(inbox.results)
+
+    def collect(self, batch_id, timeout_seconds, min_results, middleware_url=""):
+        inbox = RECEIVER.inbox(batch_id)
+        if inbox is None:
+            if not middleware_url:
+                return ([self._blank()], [""], f"❌ 没有批次 {batch_id} 的回调记录")
+            results, total = self._from_middleware(batch_id, timeout_seconds, min_results, middleware_url)
+        else:
+            results, total = self._from_inbox(inbox, timeout_seconds, min_results)
+
+        images, prompts, log_lines = [], [], []
+        for result in results:
+            if result["status"] != "done":
+                log_lines.append(f"{result['tid']}: ❌ {result.get('error')}")
+                continue
+            for blob in result["images"]:
+                images.append(decode_images([blob]))
+                prompts.append(result.get("prompt", ""))
+            log_lines.append(f"{result['tid']}: ✅ {len(result['images'])} 张")
+        log_lines.insert(0, f"批次 {batch_id}: {len(results)}/{total if total is not None else '?'} 个任务已返回")
+        print(f"📬 [NanoBanana] {log_lines[0]}")
+        if not images:
+            return ([self._blank()], [""], "\n".join(log_lines))
+        return (images, prompts, "\n".join(log_lines))
+
+    def _from_inbox(self, inbox, timeout_seconds, min_results):
+        """逐个等待新结果，到达即预览"""
+        total = inbox.total
+        target = min_results or total or 1
+        pbar = comfy.utils.ProgressBar(total or target)
+        deadline = time.monotonic() + timeout_seconds
+        results = []
+        with inbox.collecting():
+            while len(results) < target and not (inbox.complete and len(results) >= len(inbox.results)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for result in inbox.wait_new(len(results), remaining):
+                    results.append(result)
+                    preview = None
+                    if result["images"]:
+                        preview = ("JPEG", Image.open(BytesIO(result["images"][0])), 512)
+                    pbar.update_absolute(len(results), total or target, preview)
+        return results, total
+
+    def _from_middleware(self, batch_id, timeout_seconds, min_results, middleware_url):
+        """查询中间件的批次进度，读取 archive 中已完成任务的文件 (需与中间件在同一台机器)"""
+        url = f"{middleware_url.rstrip('/')}/api/v1/batches/{batch_id}"
+        deadline = time.monotonic() + timeout_seconds
+        jobs, finished = [], []
+        while True:
+            try:
+                res = houlai_http.get(url, timeout=10, proxies={"http": None, "https": None})
+                if res.status_code == 404:
+                    print(f"⚠️ [NanoBanana] 中间件中没有批次 {batch_id}")
+                    break
+                jobs = res.json().get("jobs", []) if res.status_code == 200 else jobs
+            except Exception as e:
+                print(f"⚠️ [NanoBanana] 查询中间件失败: {e}")
+            finished = [job for job in jobs if job["status"] in ("done", "failed")]
+            target = min_results or len(jobs)
+            if (jobs and len(finished) >= target) or time.monotonic() >= deadline:
+                break
+            time.sleep(2.0)
+
+        results = []
+        for job in finished:
+            paths = (job.get("result") or {}).get("paths", [])
+            blobs = []
+            for path in paths:
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        blobs.append(f.read())
+            results.append({"tid": job["tid"], "status": job["status"], "prompt": "", "images": blobs,
+                            "error": job.get("error")})
+        return results, len(jobs) or None
+
+    def _blank(self):
+        return torch.zeros((1, 512, 512, 3), dtype=torch.float32)
\ No newline at end of file
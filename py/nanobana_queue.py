@@ -0,0 +1,267 @@
+"""
+后来工具箱 - NanoBanana 中间件的持久化任务队列 (SQLite)
+
+- 参考图按内容哈希存一份 (assets 表)，任务只保存引用，与 v2 清单格式一致
+- 按 (模型, 优先级, 提交时间) 出队，同一模型内优先级高的先执行
+- 失败任务带 next_run_at 延迟重试
+- 提交成功后保存服务端 task_id；中间件重启时已提交的任务继续轮询，提交结果未知的任务不再重发
+- 按任务内容的幂等键去重: 重复提交的任务不再执行，记为原任务的别名，原任务完成后一起通知
+
+中间件需要在重启后继续执行，所以任务中保存了 API Key，数据库文件不要外传。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from .nanobana_manifest import is_deterministic
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    id  TEXT PRIMARY KEY,
+    uri TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    tid          TEXT PRIMARY KEY,
+    batch_id     TEXT NOT NULL,
+    model        TEXT NOT NULL,
+    api_key      TEXT,
+    priority     INTEGER NOT NULL DEFAULT 0,
+    status       TEXT NOT NULL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    next_run_at  REAL NOT NULL,
+    item         TEXT NOT NULL,
+    idem_key     TEXT,
+    provider_task_id TEXT,
+    callback_url TEXT,
+    result       TEXT,
+    error        TEXT,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, model, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id);
+CREATE TABLE IF NOT EXISTS aliases (
+    tid          TEXT PRIMARY KEY,
+    batch_id     TEXT NOT NULL,
+    original_tid TEXT NOT NULL,
+    callback_url TEXT,
+    created_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_aliases_original ON aliases (original_tid);
+CREATE INDEX IF NOT EXISTS idx_aliases_batch ON aliases (batch_id);
+"""
+
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# 幂等去重的默认时间窗口 (秒)
+DEDUPE_WINDOW = 24 * 3600
+
+RECOVER_ERROR = "中间件重启时任务状态未知 (提交请求可能已到达服务端，为避免重复计费不再重发)"
+
+
+class JobQueue:
+    """
+    线程安全的持久化优先级队列 (所有写操作串行化，读写共用一个连接)
+
+    Args:
+        path: 数据库文件路径
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column in ("idem_key", "provider_task_id"):
+            if column not in columns:
+                # 旧版数据库升级
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_idem ON jobs (idem_key, created_at)")
+
+    def recover(self, resubmit=False):
+        """
+        处理上次异常退出时执行中的任务
+
+        - 已保存服务端 task_id 的任务保持 running，返回给调用方继续轮询 (不重新提交)
+        - 没有 task_id 的任务无法确认提交请求是否已到达服务端: resubmit=True (本地模拟等不计费的后端)
+          放回队列，否则记为失败，避免重复计费
+
+        Returns:
+            (需要继续轮询的任务列表, 放回队列的数量, 记为失败的任务列表)
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            unknown = self._conn.execute("SELECT * FROM jobs WHERE status = ? AND provider_task_id IS NULL",
+                                         (RUNNING,)).fetchall()
+            if resubmit:
+                status, error = QUEUED, None
+            else:
+                status, error = FAILED, RECOVER_ERROR
+            self._conn.executemany("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE tid = ?",
+                                   [(status, error, now, row["tid"]) for row in unknown])
+            resumed = self._conn.execute("SELECT * FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        failed = [] if resubmit else [dict(self._job(row), status=FAILED, error=RECOVER_ERROR) for row in unknown]
+        return [self._job(row) for row in resumed], len(unknown) if resubmit else 0, failed
+
+    def add_batch(self, batch_id, items, assets, callback_url="", dedupe_window=DEDUPE_WINDOW):
+        """
+        入队一个批次
+
+        - tid 已存在 (同一请求被重发) 的任务直接忽略
+        - idempotency_key 与时间窗口内未失败的任务相同时不再执行，记为该任务的别名
+          (随机种子的任务即使带了 idempotency_key 也不按内容去重，重新运行就该出新图)
+
+        Args:
+            items: 清单中的任务 (image_refs 引用 assets 中的哈希)
+            assets: {哈希: data URI}
+            dedupe_window: 幂等去重的时间窗口 (秒)，0 = 只按 tid 去重
+
+        Returns:
+            (新入队的任务数, {重复任务 tid: 原任务 tid})
+        """
+        now = time.time()
+        accepted = 0
+        duplicates = {}
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO assets (id, uri) VALUES (?, ?)", assets.items())
+            for item in items:
+                item = dict(item)
+                tid = item["tid"]
+                api_key = item.pop("api_key", "")
+                idem_key = item.get("idempotency_key")
+                if self._conn.execute("SELECT 1 FROM jobs WHERE tid = ? UNION ALL SELECT 1 FROM aliases WHERE tid = ?",
+                                      (tid, tid)).fetchone():
+                    continue
+                if not is_deterministic(item):
+                    idem_key = None
+                if idem_key and dedupe_window:
+                    row = self._conn.execute(
+                        "SELECT tid FROM jobs WHERE idem_key = ? AND status != ? AND created_at >= ?"
+                        " ORDER BY created_at DESC LIMIT 1", (idem_key, FAILED, now - dedupe_window)).fetchone()
+                    if row is not None:
+                        self._conn.execute("INSERT INTO aliases (tid, batch_id, original_tid, callback_url, created_at)"
+                                           " VALUES (?, ?, ?, ?, ?)", (tid, batch_id, row["tid"], callback_url, now))
+                        duplicates[tid] = row["tid"]
+                        continue
+                self._conn.execute(
+                    "INSERT INTO jobs (tid, batch_id, model, api_key, priority, status, next_run_at, item, idem_key,"
+                    " callback_url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (tid, batch_id, item.get("model", ""), api_key, int(item.get("priority", 0)), QUEUED, now,
+                     json.dumps(item, ensure_ascii=False), idem_key, callback_url, now, now))
+                accepted += 1
+        return accepted, duplicates
+
+    def claim(self, model):
+        """
+        取出该模型下一个可执行的任务并标记为 running
+
+        Returns:
+            任务 dict (item 已解析，image_uris 已展开) 或 None
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND model = ? AND next_run_at <= ?"
+                " ORDER BY priority DESC, created_at LIMIT 1", (QUEUED, model, now)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE tid = ?",
+                               (RUNNING, now, row["tid"]))
+        job = self._job(row)
+        job["attempts"] += 1
+        return job
+
+    def _job(self, row):
+        """待执行任务 (item 已解析，image_uris 已展开)"""
+        job = dict(row)
+        job["item"] = json.loads(job["item"])
+        job["image_uris"] = self.assets(job["item"].get("image_refs", []))
+        return job
+
+    def next_due(self, model):
+        """该模型最早可执行任务的等待秒数 (没有排队任务时为 None)"""
+        row = self._read("SELECT MIN(next_run_at) AS due FROM jobs WHERE status = ? AND model = ?",
+                         (QUEUED, model))[0]
+        if row["due"] is None:
+            return None
+        return max(0.0, row["due"] - time.time())
+
+    def assets(self, refs):
+        if not refs:
+            return []
+        placeholders = ", ".join("?" * len(set(refs)))
+        rows = self._read(f"SELECT id, uri FROM assets WHERE id IN ({placeholders})", list(set(refs)))
+        table = {row["id"]: row["uri"] for row in rows}
+        return [table[ref] for ref in refs if ref in table]
+
+    def set_task_id(self, tid, task_id):
+        """提交成功后立即保存服务端 task_id (重启后据此继续轮询)"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET provider_task_id = ?, updated_at = ? WHERE tid = ?",
+                               (task_id, time.time(), tid))
+
+    def complete(self, tid, result):
+        self._finish(tid, DONE, json.dumps(result, ensure_ascii=False), None)
+
+    def fail(self, tid, error):
+        self._finish(tid, FAILED, None, error)
+
+    def retry(self, tid, error, delay):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, next_run_at = ?, updated_at = ? WHERE tid = ?",
+                               (QUEUED, error, time.time() + delay, time.time(), tid))
+
+    def _finish(self, tid, status, result, error):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE tid = ?",
+                               (status, result, error, time.time(), tid))
+
+    def get(self, tid):
+        rows = self._read("SELECT * FROM jobs WHERE tid = ?", (tid,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["item"] = json.loads(job["item"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def aliases(self, original_tid):
+        """重复提交到原任务上的别名 (tid, batch_id, callback_url)"""
+        return [dict(row) for row in self._read(
+            "SELECT tid, batch_id, callback_url FROM aliases WHERE original_tid = ?", (original_tid,))]
+
+    def models(self):
+        """有排队任务的模型"""
+        return [row["model"] for row in self._read("SELECT DISTINCT model FROM jobs WHERE status = ?", (QUEUED,))]
+
+    def batch_status(self, batch_id):
+        """批次中的任务进度 (别名任务显示原任务的状态和结果)"""
+        rows = self._read(
+            "SELECT tid, model, status, attempts, result, error, updated_at, NULL AS original_tid FROM jobs"
+            " WHERE batch_id = ?"
+            " UNION ALL SELECT a.tid, j.model, j.status, j.attempts, j.result, j.error, j.updated_at, a.original_tid"
+            " FROM aliases a JOIN jobs j ON j.tid = a.original_tid WHERE a.batch_id = ?"
+            " ORDER BY tid", (batch_id, batch_id))
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            jobs.append(job)
+        return jobs
+
+    def counts(self):
+        rows = self._read("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
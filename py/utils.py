@@ -0,0 +1,318 @@
+"""
+后来工具箱 - 公共工具函数
+
+1. 图像编解码 (Tensor <-> 图像字节):
+   - 整批向量化 uint8 量化 (复用线程内缓冲，不经过 float64)
+   - 直接解码到预分配的 float32 Tensor
+   - 可选加速后端: simplejpeg (JPEG)、opencv (PNG/WebP)，未安装时使用 Pillow
+   - 多张图片在线程池中并行编解码
+2. 参考图编码缓存 (按 Tensor 指纹 + 编码参数，内存 LRU + 磁盘两级)
+"""
+
+import os
+import io
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+from .houlai_cache import DiskLRUCache, MemoryLRU, hash_key
+
+# 编解码线程池 (Pillow / simplejpeg / opencv 编解码时都会释放 GIL)
+CODEC_WORKERS = int(os.environ.get("HOULAI_CODEC_WORKERS", str(min(8, os.cpu_count() or 4))))
+_codec_pool = ThreadPoolExecutor(max_workers=CODEC_WORKERS, thread_name_prefix="houlai_codec")
+
+# PNG 压缩级别 (0-9)，默认与 Pillow 相同；调低编码更快但上传体积更大
+PNG_COMPRESS_LEVEL = int(os.environ.get("HOULAI_PNG_COMPRESS_LEVEL", "6"))
+_scratch = threading.local()
+
+# 每个线程常驻的量化缓冲上限: 大 batch 按块量化，超过上限的单帧缓冲用完即释放
+SCRATCH_MAX_BYTES = int(os.environ.get("HOULAI_SCRATCH_MB", "64")) * 1024 * 1024
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 参考图编码缓存: 内存 (默认 256MB) + 磁盘 (默认 1GB)
+_REF_MEMORY = MemoryLRU(int(os.environ.get("HOULAI_REF_CACHE_MB", "256")) * 1024 * 1024)
+_REF_DISK = DiskLRUCache("ref_encodings", int(os.environ.get("HOULAI_REF_DISK_CACHE_MB", "1024")) * 1024 * 1024)
+
+
+# ============================================
+# Tensor <-> uint8
+# ============================================
+def _scratch_buffer(shape):
+    """
+    线程内复用的 float32 临时缓冲，避免每次量化都重新分配内存
+
+    形状变化时替换旧缓冲；超过 SCRATCH_MAX_BYTES 的缓冲不保留，避免每个线程都常驻一份大内存
+    """
+    buf = getattr(_scratch, "buf", None)
+    if buf is not None and buf.shape == shape:
+        return buf
+    _scratch.buf = None
+    buf = torch.empty(shape, dtype=torch.float32)
+    if buf.numel() * 4 <= SCRATCH_MAX_BYTES:
+        _scratch.buf = buf
+    return buf
+
+
+def tensor_to_uint8(images):
+    """
+    ComfyUI 图像 Tensor (0-1 float) 整批量化为 uint8 numpy 数组
+
+    Args:
+        images: [B, H, W, C] 或 [H, W, C]
+
+    Returns:
+        np.ndarray: [B, H, W, C] uint8 (新分配的内存，可安全长期持有)
+    """
+    t = images.detach()
+    if t.dim() == 3:
+        t = t.unsqueeze(0)
+    if t.device.type != "cpu":
+        # 在显卡上量化后再拷贝，传输量只有 float32 的 1/4
+        return t.mul(255.0).add_(0.5).clamp_(0, 255).to(torch.uint8).cpu().numpy()
+    # 按块量化: 临时缓冲最多 SCRATCH_MAX_BYTES (至少一帧)，结果直接写入 uint8 输出
+    count = t.shape[0]
+    frame_bytes = max(1, t[0].numel() * 4)
+    chunk = max(1, min(count, SCRATCH_MAX_BYTES // frame_bytes))
+    buf = _scratch_buffer((chunk,) + tuple(t.shape[1:]))
+    out = np.empty(tuple(t.shape), dtype=np.uint8)
+    out_t = torch.from_numpy(out)
+    for start in range(0, count, chunk):
+        part = buf[:min(chunk, count - start)]
+        torch.mul(t[start:start + len(part)], 255.0, out=part).add_(0.5).clamp_(0, 255)
+        out_t[start:start + len(part)].copy_(part)
+    return out
+
+
+def uint8_to_tensor(arrays):
+    """
+    一组相同尺寸的 uint8 HWC 数组写入预分配的 [B, H, W, 3] float32 Tensor
+
+    Raises:
+        ValueError: 尺寸不一致 (无法组成一个 IMAGE batch)
+    """
+    first = arrays[0]
+    if any(a.shape != first.shape for a in arrays):
+        sizes = ", ".join(f"{a.shape[1]}x{a.shape[0]}" for a in arrays)
+        raise ValueError(f"图片尺寸不一致，无法合并为一个 batch: {sizes}")
+    out = torch.empty((len(arrays),) + first.shape, dtype=torch.float32)
+    out_np = out.numpy()  # 与 out 共享内存，逐张写入时由 numpy 完成 uint8 -> float32 转换
+    for i, arr in enumerate(arrays):
+        out_np[i] = arr
+    return out.mul_(1.0 / 255.0)
+
+
+def tensor2pil(image):
+    """Tensor -> PIL 图片列表 (整批量化)"""
+    return [Image.fromarray(arr) for arr in tensor_to_uint8(image)]
+
+
+def pil2tensor(image):
+    """PIL 图片 (或列表) -> [B, H, W, 3] float32 Tensor"""
+    images = image if isinstance(image, (list, tuple)) else [image]
+    return uint8_to_tensor([np.asarray(img.convert("RGB")) for img in images])
+
+
+# ============================================
+# 编码
+# ============================================
+def _downscale(arr, max_side):
+    """长边超过 max_side 时等比缩小 (0 = 不缩放)"""
+    h, w = arr.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return arr
+    scale = max_side / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if cv2 is not None:
+        return cv2.resize(arr, size, interpolation=cv2.INTER_AREA)
+    return np.asarray(Image.fromarray(arr).resize(size, Image.Resampling.LANCZOS))
+
+
+def _encode_array(arr, format, quality, max_side=0):
+    """单张 uint8 HWC RGB / RGBA 数组编码为图片字节 (可选先缩小到 max_side)"""
+    arr = _downscale(arr, max_side)
+    rgba = arr.ndim == 3 and arr.shape[2] == 4
+    if format == "JPEG" and rgba:
+        arr, rgba = arr[..., :3], False  # JPEG 不支持透明通道
+    if format == "JPEG" and simplejpeg is not None:
+        return simplejpeg.encode_jpeg(np.ascontiguousarray(arr), quality=quality, colorspace="RGB")
+    if format in ("PNG", "WEBP") and cv2 is not None:
+        bgr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA if rgba else cv2.COLOR_RGB2BGR)
+        if format == "PNG":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESS_LEVEL]
+        else:
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        ok, buf = cv2.imencode(f".{format.lower()}", bgr, params)
+        if ok:
+            return buf.tobytes()
+    buffered = io.BytesIO()
+    save_kwargs = {"quality": quality} if format in ("JPEG", "WEBP") else {"compress_level": PNG_COMPRESS_LEVEL}
+    Image.fromarray(arr).save(buffered, format=format, **save_kwargs)
+    return buffered.getvalue()
+
+
+def _iter_frames(images):
+    """接受一个 batch Tensor 或 Tensor 列表，逐帧产出 uint8 数组"""
+    if isinstance(images, torch.Tensor):
+        yield from tensor_to_uint8(images)
+    else:
+        for image in images:
+            yield from tensor_to_uint8(image)
+
+
+def encode_images(images, format="PNG", quality=95, max_side=0):
+    """
+    整批图像并行编码
+
+    Args:
+        images: [B, H, W, C] Tensor，或若干 Tensor 组成的列表 (尺寸可不同)
+        format: JPEG / PNG / WEBP
+        quality: JPEG / WebP 质量
+        max_side: 编码前把长边缩小到该值以内 (0 = 保持原尺寸)
+
+    Returns:
+        List[bytes]: 每一帧的编码结果，顺序与输入一致
+    """
+    format = format.upper()
+    frames = list(_iter_frames(images))
+    if len(frames) == 1:
+        return [_encode_array(frames[0], format, quality, max_side)]
+    return list(_codec_pool.map(lambda arr: _encode_array(arr, format, quality, max_side), frames))
+
+
+def encode_base64(images, format="PNG", quality=95, data_uri=False, max_side=0):
+    """
+    整批图像并行编码为 Base64 字符串列表
+
+    Args:
+        data_uri: 是否带 data:image/xxx;base64, 前缀
+    """
+    format = format.upper()
+    prefix = f"data:{MIME_TYPES[format]};base64," if data_uri else ""
+    return [prefix + base64.b64encode(blob).decode("utf-8")
+            for blob in encode_images(images, format, quality, max_side)]
+
+
+# ============================================
+# 参考图编码缓存
+# ============================================
+def tensor_fingerprint(image):
+    """
+    单帧 Tensor 的指纹: 形状 + 量化后完整 uint8 像素的 blake2b
+
+    编码结果只取决于 uint8 像素，量化后相同的图编码也相同；哈希整张图而不是采样，
+    不同内容不会共用缓存 (含磁盘缓存) 中的编码结果。
+    """
+    arr = tensor_to_uint8(image)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(arr.shape).encode())
+    h.update(np.ascontiguousarray(arr).data)
+    return h.hexdigest()
+
+
+def split_frames(images, max_count=0):
+    """
+    把若干 IMAGE 输入 (每个可能是多帧 batch) 展开成单帧列表
+
+    Args:
+        images: Tensor 或 Tensor 列表，None 会被跳过
+        max_count: 最多保留的帧数 (0 = 不限制)
+    """
+    if isinstance(images, torch.Tensor):
+        images = [images]
+    frames = []
+    for image in images:
+        if image is None:
+            continue
+        if image.dim() == 3:
+            image = image.unsqueeze(0)
+        frames.extend(image[i:i + 1] for i in range(image.shape[0]))
+    if max_count and len(frames) > max_count:
+        print(f"[HouLai] 参考图共 {len(frames)} 张，超过上限 {max_count}，多余的将被忽略")
+        frames = frames[:max_count]
+    return frames
+
+
+def encode_base64_cached(images, format="PNG", quality=95, data_uri=False, max_side=0):
+    """
+    与 encode_base64 相同，但按帧查询编码缓存，只编码未命中的帧
+
+    同一批产品参考图在多条提示词 / 多次执行之间只会被编码一次。
+    """
+    format = format.upper()
+    frames = split_frames(images)
+
+    keys = [hash_key("ref", tensor_fingerprint(f), format, quality, data_uri, max_side) for f in frames]
+    results = [None] * len(frames)
+    missing = []
+    for i, key in enumerate(keys):
+        value = _REF_MEMORY.get(key)
+        if value is None:
+            blob = _REF_DISK.get(key)
+            if blob is not None:
+                value = blob.decode("ascii")
+                _REF_MEMORY.put(key, value)
+        if value is None:
+            missing.append(i)
+        else:
+            results[i] = value
+
+    if missing:
+        encoded = encode_base64([frames[i] for i in missing], format, quality, data_uri, max_side)
+        for i, value in zip(missing, encoded):
+            results[i] = value
+            _REF_MEMORY.put(keys[i], value)
+            _REF_DISK.put(keys[i], value.encode("ascii"))
+    return results
+
+
+# ============================================
+# 解码
+# ============================================
+def _decode_bytes(blob):
+    """图片字节 -> uint8 HWC RGB 数组"""
+    if simplejpeg is not None and blob[:3] == b"\xff\xd8\xff":
+        return simplejpeg.decode_jpeg(blob, colorspace="RGB")
+    if cv2 is not None:
+        arr = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if arr is not None:
+            return cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+    with Image.open(io.BytesIO(blob)) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def decode_arrays(blobs):
+    """并行解码为 uint8 数组列表"""
+    if len(blobs) == 1:
+        return [_decode_bytes(blobs[0])]
+    return list(_codec_pool.map(_decode_bytes, blobs))
+
+
+def decode_async(blob):
+    """在解码线程池中解码一张图片，返回 Future (流式接收时边收边解码)"""
+    return _codec_pool.submit(_decode_bytes, blob)
+
+
+def decode_images(blobs):
+    """
+    图片字节列表并行解码，直接写入预分配的 [B, H, W, 3] float32 Tensor
+
+    Raises:
+        ValueError: 图片尺寸不一致
+    """
+    return uint8_to_tensor(decode_arrays(blobs))
@@ -0,0 +1,31 @@
+"""
+测试环境: 不经过插件根目录的 __init__.py (需要 ComfyUI)，直接把 py 目录加载为 houlai_py 包
+
+在插件根目录运行 `python -m pytest tests` (py 目录与 pylib 同名的问题见 py/__init__.py)。
+缓存和耗时日志写到临时目录，不影响插件自己的 cache / logs。
+"""
+
+import os
+import sys
+import tempfile
+import importlib.util
+from pathlib import Path
+
+PY_DIR = Path(__file__).resolve().parent.parent / "py"
+
+_TMP = tempfile.mkdtemp(prefix="houlai-tests-")
+os.environ.setdefault("HOULAI_CACHE_DIR", os.path.join(_TMP, "cache"))
+os.environ.setdefault("HOULAI_METRICS_LOG", os.path.join(_TMP, "timing.jsonl"))
+
+
+def _load_package(name):
+    spec = importlib.util.spec_from_file_location(name, PY_DIR / "__init__.py",
+                                                  submodule_search_locations=[str(PY_DIR)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+if "houlai_py" not in sys.modules:
+    _load_package("houlai_py")
@@ -0,0 +1,49 @@
+from houlai_py.houlai_llm_stream import LineSplitter, PromptStream
+
+
+def test_splitter_matches_split_strip():
+    text = "first line\n\n  second  \r\nthird\n   \nlast"
+    splitter = LineSplitter()
+    lines = []
+    for i in range(0, len(text), 3):
+        lines += splitter.feed(text[i:i + 3])
+    lines += splitter.flush()
+    assert lines == [line.strip() for line in text.split("\n") if line.strip()]
+
+
+def test_splitter_holds_incomplete_line():
+    splitter = LineSplitter()
+    assert splitter.feed("hello wor") == []
+    assert splitter.feed("ld\nnext") == ["hello world"]
+    assert splitter.flush() == ["next"]
+    assert splitter.flush() == []
+
+
+def test_splitter_multiple_lines_in_one_chunk():
+    splitter = LineSplitter()
+    assert splitter.feed("a\nb\nc\n") == ["a", "b", "c"]
+    assert splitter.flush() == []
+
+
+def test_stream_yields_lines_and_callbacks():
+    seen = []
+    stream = PromptStream(on_line=lambda index, line: seen.append((index, line)))
+    stream.put_text("one\ntw")
+    stream.put_text("o\nthree")
+    stream.close()
+    assert list(stream) == ["one", "two", "three"]
+    assert seen == [(0, "one"), (1, "two"), (2, "three")]
+    assert stream.text == "one\ntwo\nthree"
+    # 后注册的回调补发已产出的行
+    late = []
+    stream.add_callback(lambda index, line: late.append(line))
+    assert late == ["one", "two", "three"]
+
+
+def test_stream_error_drops_partial_line():
+    stream = PromptStream()
+    stream.put_text("done\nhalf")
+    error = RuntimeError("disconnected")
+    stream.close(error)
+    assert list(stream) == ["done"]
+    assert stream.error is error
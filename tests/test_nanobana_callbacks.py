@@ -0,0 +1,54 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from houlai_py import nanobana_callbacks
+from houlai_py.nanobana_callbacks import CallbackReceiver
+
+
+@pytest.fixture
+def receiver():
+    return CallbackReceiver(host="127.0.0.1", port=0)
+
+
+def post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode("utf-8"),
+                                     {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def result(batch_id, tid="t1"):
+    return {"batch_id": batch_id, "tid": tid, "status": "done", "images": []}
+
+
+def test_callback_requires_batch_token(receiver):
+    inbox = receiver.expect("b1", 2)
+    url = receiver.callback_url(inbox)
+    assert post(url, result("b1")) == 200
+    assert post(receiver.url, result("b1", "t2")) == 403
+    assert post(url.replace(inbox.token, "wrong"), result("b1", "t2")) == 403
+    assert [r["tid"] for r in inbox.results] == ["t1"]
+
+
+def test_unknown_batch_is_rejected(receiver):
+    url = receiver.callback_url(receiver.expect("b1", 1))
+    assert post(url, result("other")) == 403
+    assert receiver.inbox("other") is None
+
+
+def test_eviction_skips_batches_with_collector(receiver, monkeypatch):
+    monkeypatch.setattr(nanobana_callbacks, "MAX_BATCHES", 2)
+    waiting = receiver.expect("waiting", 1)
+    done = receiver.expect("done", 1)
+    done.put(result("done"))
+    with waiting.collecting():
+        receiver.expect("new", 1)
+        receiver.expect("newer", 1)
+    assert receiver.inbox("waiting") is waiting
+    assert receiver.inbox("done") is None
@@ -0,0 +1,177 @@
+import threading
+
+import pytest
+
+from houlai_py.nanobana_manifest import item_key
+from houlai_py.nanobana_middleware import Middleware
+from houlai_py.nanobana_queue import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "jobs.db")
+
+
+def make_item(tid, seed=7, prompt="a red lipstick"):
+    item = {"tid": tid, "mode": "text2img", "model": "nano-banana", "prompt": prompt, "seed": seed,
+            "api_key": "sk-test"}
+    key = item_key(item, [])
+    if key:
+        item["idempotency_key"] = key
+    return item
+
+
+def test_resent_tid_is_ignored(queue):
+    assert queue.add_batch("b1", [make_item("t1")], {}) == (1, {})
+    assert queue.add_batch("b1", [make_item("t1")], {}) == (0, {})
+    assert queue.counts() == {QUEUED: 1}
+
+
+def test_api_key_not_stored_in_item(queue):
+    queue.add_batch("b1", [make_item("t1")], {})
+    job = queue.get("t1")
+    assert job["api_key"] == "sk-test"
+    assert "api_key" not in job["item"]
+
+
+def test_assets_are_stored_once(queue):
+    item = dict(make_item("t1"), image_refs=["h1", "h2"])
+    queue.add_batch("b1", [item], {"h1": "data:a", "h2": "data:b"})
+    queue.add_batch("b2", [dict(make_item("t2", prompt="x"), image_refs=["h1"])], {"h1": "data:a"})
+    job = queue.claim("nano-banana")
+    assert job["tid"] == "t1"
+    assert job["attempts"] == 1
+    assert job["image_uris"] == ["data:a", "data:b"]
+
+
+def test_claim_respects_priority_and_retry_delay(queue):
+    queue.add_batch("b1", [make_item("low", prompt="a"), dict(make_item("high", prompt="b"), priority=5)], {})
+    assert queue.claim("nano-banana")["tid"] == "high"
+    queue.retry("high", "429", delay=60)
+    assert queue.claim("nano-banana")["tid"] == "low"
+    assert queue.claim("nano-banana") is None
+    assert queue.next_due("nano-banana") == pytest.approx(60, abs=1)
+
+
+# ----------------------------------------
+# 幂等去重
+# ----------------------------------------
+def test_fixed_seed_duplicate_becomes_alias(queue):
+    queue.add_batch("b1", [make_item("t1")], {})
+    accepted, duplicates = queue.add_batch("b2", [make_item("t2"), make_item("t3", prompt="other")], {})
+    assert accepted == 1
+    assert duplicates == {"t2": "t1"}
+    assert [a["tid"] for a in queue.aliases("t1")] == ["t2"]
+
+    queue.complete("t1", {"url": "https://example.com/1.png"})
+    status = {job["tid"]: job for job in queue.batch_status("b2")}
+    # 别名任务显示原任务的状态和结果
+    assert status["t2"]["status"] == DONE
+    assert status["t2"]["original_tid"] == "t1"
+    assert status["t2"]["result"] == {"url": "https://example.com/1.png"}
+    assert status["t3"]["status"] == QUEUED
+
+
+def test_duplicate_within_one_batch(queue):
+    accepted, duplicates = queue.add_batch("b1", [make_item("t1"), make_item("t2")], {})
+    assert accepted == 1
+    assert duplicates == {"t2": "t1"}
+
+
+def test_random_seed_is_not_deduplicated(queue):
+    assert item_key(make_item("t1", seed=0), []) is None
+    # 即使客户端带了相同的 idempotency_key，随机种子的任务也要重新生成
+    items = [dict(make_item("t1", seed=0), idempotency_key="same"),
+             dict(make_item("t2", seed=0), idempotency_key="same")]
+    assert queue.add_batch("b1", items, {}) == (2, {})
+    assert queue.get("t2")["idem_key"] is None
+
+
+def test_failed_original_is_not_reused(queue):
+    queue.add_batch("b1", [make_item("t1")], {})
+    queue.fail("t1", "boom")
+    assert queue.add_batch("b2", [make_item("t2")], {}) == (1, {})
+
+
+def test_dedupe_window_zero_only_checks_tid(queue):
+    queue.add_batch("b1", [make_item("t1")], {})
+    assert queue.add_batch("b2", [make_item("t2")], {}, dedupe_window=0) == (1, {})
+
+
+def test_alias_tid_is_not_resubmitted(queue):
+    queue.add_batch("b1", [make_item("t1")], {})
+    queue.add_batch("b2", [make_item("t2")], {})
+    assert queue.add_batch("b2", [make_item("t2")], {}) == (0, {})
+
+
+# ----------------------------------------
+# 重启恢复
+# ----------------------------------------
+def test_recover_resumes_submitted_and_fails_unknown(queue):
+    queue.add_batch("b1", [make_item("submitted", prompt="a"), make_item("unknown", prompt="b"),
+                           make_item("waiting", prompt="c")], {})
+    queue.claim("nano-banana")
+    queue.claim("nano-banana")
+    queue.set_task_id("submitted", "task-123")
+
+    resumed, requeued, failed = queue.recover()
+    assert [job["tid"] for job in resumed] == ["submitted"]
+    assert resumed[0]["provider_task_id"] == "task-123"
+    assert requeued == 0
+    assert [job["tid"] for job in failed] == ["unknown"]
+    # 提交结果未知的任务不会被重新提交
+    assert queue.get("unknown")["status"] == FAILED
+    assert queue.get("submitted")["status"] == RUNNING
+    assert queue.get("waiting")["status"] == QUEUED
+
+
+def test_recover_requeues_when_resubmit_is_safe(queue):
+    queue.add_batch("b1", [make_item("t1")], {})
+    queue.claim("nano-banana")
+    resumed, requeued, failed = queue.recover(resubmit=True)
+    assert (resumed, requeued, failed) == ([], 1, [])
+    assert queue.get("t1")["status"] == QUEUED
+
+
+class FakeTaskBackend:
+    name = "fake"
+    endpoint = "fake://local"
+    resubmit_safe = False
+
+    def __init__(self):
+        self.submitted = []
+        self.resumed = []
+        self.done = threading.Event()
+
+    def generate(self, job, limiter, on_submitted=None):
+        self.submitted.append(job["tid"])
+        on_submitted(f"task-{job['tid']}")
+        raise RuntimeError("crash after submit")
+
+    def resume(self, job):
+        self.resumed.append(job["provider_task_id"])
+        self.done.set()
+        return [b"\x89PNG\r\n\x1a\n"]
+
+
+def test_middleware_resumes_polling_without_resubmitting(queue, tmp_path):
+    queue.add_batch("b1", [make_item("t1")], {})
+    backend = FakeTaskBackend()
+    middleware = Middleware(queue, backend, tmp_path / "archive")
+    job = queue.claim("nano-banana")
+    # 模拟提交成功后进程退出: task_id 已保存，任务仍是 running
+    with pytest.raises(RuntimeError):
+        backend.generate(job, None, lambda task_id: queue.set_task_id(job["tid"], task_id))
+
+    middleware.start()
+    try:
+        assert backend.done.wait(5)
+        for _ in range(50):
+            if queue.get("t1")["status"] == DONE:
+                break
+            threading.Event().wait(0.05)
+    finally:
+        middleware.stop()
+    assert backend.submitted == ["t1"]
+    assert backend.resumed == ["task-t1"]
+    assert queue.get("t1")["status"] == DONE
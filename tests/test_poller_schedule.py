@@ -0,0 +1,57 @@
+import pytest
+
+from houlai_py.houlai_poller import DurationModel, PollSchedule, extract_progress
+
+
+def test_waits_half_the_expected_remaining_time():
+    schedule = PollSchedule(expected=60, jitter=0)
+    assert schedule.next_delay(10) == 15          # 剩余 50 秒，受 max_interval 限制
+    assert schedule.next_delay(52) == pytest.approx(4)
+    assert schedule.next_delay(59.5) == 1         # 不低于 min_interval
+
+
+def test_overrun_backs_off_gradually():
+    schedule = PollSchedule(expected=30, jitter=0)
+    delays = [schedule.next_delay(40 + i) for i in range(4)]
+    assert delays == pytest.approx([1, 1.5, 2.25, 3.375])
+    # 重新回到预计时间内时重置
+    schedule.expected = 100
+    schedule.next_delay(50)
+    assert schedule.next_delay(200) == 1
+
+
+def test_eta_and_progress_override_expected():
+    schedule = PollSchedule(expected=600, jitter=0)
+    assert schedule.next_delay(10, eta=6) == 3
+    assert schedule.next_delay(8, progress=0.5) == 4
+
+
+def test_no_information_backs_off():
+    schedule = PollSchedule(jitter=0)
+    assert [schedule.next_delay(0) for _ in range(3)] == pytest.approx([2, 3, 4.5])
+
+
+def test_error_delay_is_exponential_and_capped():
+    schedule = PollSchedule(jitter=0)
+    assert [schedule.error_delay(n) for n in (1, 2, 3)] == [2, 4, 8]
+    assert schedule.error_delay(20) == 30
+
+
+def test_jitter_stays_within_bounds():
+    schedule = PollSchedule(expected=60, jitter=0.2)
+    for _ in range(100):
+        assert 12 <= schedule.next_delay(10) <= 18
+
+
+def test_extract_progress():
+    assert extract_progress({"progress": 40}) == (0.4, None)
+    assert extract_progress({"percent": 0.25, "eta": 12}) == (0.25, 12.0)
+    assert extract_progress({"progress": True, "eta": -1}) == (None, None)
+
+
+def test_duration_model_ewma():
+    model = DurationModel(alpha=0.5)
+    assert model.expected("m") is None
+    model.observe("m", 10)
+    model.observe("m", 20)
+    assert model.expected("m") == 15
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from houlai_py.houlai_ratelimit import MIN_RATE, SAFETY, RateLimiter, RateLimitTimeout, parse_reset
+
+
+# ----------------------------------------
+# parse_reset
+# ----------------------------------------
+@pytest.mark.parametrize("value, expected", [
+    ("1.5", 1.5),
+    ("6m0s", 360.0),
+    ("20ms", 0.02),
+    ("1h2m3s", 3723.0),
+    (" 30 ", 30.0),
+])
+def test_parse_reset_durations(value, expected):
+    assert parse_reset(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_reset_invalid(value):
+    assert parse_reset(value) is None
+
+
+def test_parse_reset_unix_timestamp():
+    assert parse_reset(str(time.time() + 30)) == pytest.approx(30, abs=1)
+    # 已经过去的时间戳不会得到负数
+    assert parse_reset(str(time.time() - 30)) == 0.0
+
+
+# ----------------------------------------
+# AIMD
+# ----------------------------------------
+def test_limited_halves_rate_and_learns_ceiling():
+    limiter = RateLimiter("test", rate=10, max_rate=20)
+    limiter.observe(status_code=429, headers={"Retry-After": "0"})
+    assert limiter.rate == pytest.approx(5)
+    assert limiter.ceiling == pytest.approx(10 * SAFETY)
+    assert limiter.limited == 1
+
+    for _ in range(200):
+        limiter.observe(status_code=200)
+    # 成功后回升，但不超过 (缓慢上探的) 上限
+    assert limiter.rate == pytest.approx(limiter.ceiling)
+    assert limiter.rate <= 20
+
+
+def test_retry_after_pauses_key():
+    limiter = RateLimiter("test", rate=10)
+    limiter.observe(status_code=429, headers={"Retry-After": "30"})
+    assert limiter.stats()["paused"] == pytest.approx(30, abs=1)
+
+
+def test_rate_never_below_minimum():
+    limiter = RateLimiter("test", rate=MIN_RATE)
+    for _ in range(5):
+        limiter.observe(status_code=503, headers={"Retry-After": "0"})
+    assert limiter.rate == MIN_RATE
+
+
+def test_headers_set_sustainable_rate():
+    limiter = RateLimiter("test", rate=5, max_rate=20)
+    limiter.observe(status_code=200, headers={"x-ratelimit-remaining-requests": "10",
+                                              "x-ratelimit-reset-requests": "10s"})
+    assert limiter.rate == pytest.approx(SAFETY * 10 / 10)
+
+
+def test_headers_clamped_to_learned_ceiling():
+    limiter = RateLimiter("test", rate=10, max_rate=20)
+    limiter.observe(status_code=429, headers={"Retry-After": "0"})
+    ceiling = limiter.ceiling
+    # 响应头给出的额度很多，也不能越过被限流后学到的上限
+    limiter.observe(status_code=200, headers={"ratelimit-remaining": "1000", "ratelimit-reset": "1"})
+    assert limiter.rate <= limiter.ceiling <= ceiling * 1.01
+
+
+def test_exhausted_quota_pauses_until_reset():
+    limiter = RateLimiter("test")
+    limiter.observe(status_code=200, headers={"x-ratelimit-remaining": "0", "x-ratelimit-reset": "20"})
+    assert limiter.stats()["paused"] == pytest.approx(20, abs=1)
+
+
+# ----------------------------------------
+# 并发
+# ----------------------------------------
+def test_concurrency_unlimited_until_limited_then_recovers():
+    limiter = RateLimiter("test", rate=20, max_rate=20, max_concurrency=0)
+    assert limiter.concurrency is None
+    for _ in range(4):
+        limiter.acquire()
+    limiter.observe(status_code=429, headers={"Retry-After": "0"})
+    # 按被限流时的在途请求数减半
+    assert limiter.concurrency == 2
+    for _ in range(4):
+        limiter.release()
+
+    for _ in range(20):
+        limiter.observe(status_code=200)
+        if limiter.concurrency is None:
+            break
+    # 回升到被限流时的并发后解除临时上限
+    assert limiter.concurrency is None
+
+
+def test_configured_concurrency_is_not_exceeded():
+    limiter = RateLimiter("test", rate=20, max_rate=20, max_concurrency=2)
+    limiter.observe(status_code=429, headers={"Retry-After": "0"})
+    assert limiter.concurrency == 1
+    for _ in range(20):
+        limiter.observe(status_code=200)
+    assert limiter.concurrency == 2
+
+
+def test_acquire_waits_for_free_slot():
+    limiter = RateLimiter("test", rate=20, max_rate=20, max_concurrency=1)
+    limiter.acquire()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.05)
+    limiter.release()
+    limiter.acquire(timeout=1)
+    assert limiter.inflight == 1
@@ -0,0 +1,71 @@
+import pytest
+
+from houlai_py.houlai_skills import SkillSearchIndex, tokenize
+
+SKILLS = [
+    {"id": "beauty/lipstick", "file": "beauty", "key": "Lipstick_Detail", "name": "口红详情页",
+     "category": "美妆", "description": "口红质地和色号展示", "template": "..."},
+    {"id": "beauty/perfume", "file": "beauty", "key": "Perfume_Scene", "name": "香水场景图",
+     "category": "美妆", "description": "香水氛围场景", "template": "可以搭配口红等道具"},
+    {"id": "fashion/dress", "file": "fashion", "key": "Dress_Model", "name": "连衣裙模特图",
+     "category": "服饰", "description": "模特上身展示", "template": "..."},
+]
+
+
+@pytest.fixture
+def index():
+    index = SkillSearchIndex()
+    for skill in SKILLS:
+        index.add(skill)
+    return index
+
+
+def ids(results):
+    return [skill_id for skill_id, _ in results]
+
+
+def test_tokenize_mixed_text():
+    assert tokenize("Lipstick_Detail 口红") == ["lipstick", "detail", "口", "红", "口红"]
+    assert tokenize("口红详情", query=True) == ["口红", "红详", "详情"]
+    assert tokenize("红", query=True) == ["红"]
+
+
+def test_name_match_outranks_template_match(index):
+    assert ids(index.search("口红"))[:2] == ["beauty/lipstick", "beauty/perfume"]
+
+
+def test_english_key_match(index):
+    assert ids(index.search("dress"))[0] == "fashion/dress"
+
+
+def test_prefix_and_typo_expansion(index):
+    assert ids(index.search("lipst")) == ["beauty/lipstick"]
+    assert ids(index.search("perfme")) == ["beauty/perfume"]
+
+
+def test_unrelated_query_returns_nothing(index):
+    assert index.search("手机壳") == []
+    assert index.search("") == []
+
+
+def test_min_match_ratio_filters_partial_hits(index):
+    # 只命中一个常见查询词的技能不返回
+    assert ids(index.search("香水 氛围")) == ["beauty/perfume"]
+
+
+def test_tie_broken_by_order():
+    index = SkillSearchIndex()
+    index.add({"id": "a", "name": "海报"})
+    index.add({"id": "b", "name": "海报"})
+    assert ids(index.search("海报", order={"a": 1, "b": 0})) == ["b", "a"]
+    assert ids(index.search("海报", order={"a": 0, "b": 1})) == ["a", "b"]
+
+
+def test_remove_and_replace(index):
+    index.remove("beauty/lipstick")
+    assert len(index) == 2
+    assert "beauty/lipstick" not in ids(index.search("口红"))
+    assert index.search("lipstick") == []
+    index.add(dict(SKILLS[2], name="口红模特图"))
+    assert ids(index.search("口红"))[0] == "fashion/dress"
+    assert len(index) == 2